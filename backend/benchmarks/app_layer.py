@@ -0,0 +1,135 @@
+# benchmarks/app_layer.py
+
+"""
+DB の待ち時間を除いた、サービス層（Python 側）だけの処理時間を測る。
+
+    cd backend && python -m benchmarks.app_layer --rooms 20 --members 8 --rounds 5000 --iterations 200
+
+- リポジトリはメモリ実装（src/repositories/memory.py）。Mongo / Redis には繋がない
+- 合成データ（ルーム・参加者・ポイント記録・精算）を入れてから、読み取り系のユースケースを
+  それぞれ --iterations 回呼び、1回あたりの µs（壁時計）と CPU µs を出す
+- 同じ操作を実サーバーで測った値からこれを引けば、DB とネットワークにかかっている分が分かる
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from src.repositories.memory import MemorySeriesCacheRepository, Storage
+from src.services.activity_service import ActivityService
+from src.services.export_service import LedgerExportService
+from src.services.misc_service import PointService, SettlementService
+from src.services.room_service import RoomService
+from src.services.series_service import SeriesService
+
+
+async def seed(storage: Storage, rooms: int, members: int, rounds: int, settlements: int) -> dict:
+    rng = random.Random(0)
+    start = datetime(2025, 1, 1)
+    uids = [f"u{i:05d}" for i in range(rooms * members)]
+    for uid in uids:
+        await storage.users().create({"uid": uid, "external_id": f"ext-{uid}", "display_name": uid})
+    room_ids = [f"r{i:04d}" for i in range(rooms)]
+    room_members = {}
+    for i, room_id in enumerate(room_ids):
+        # 隣のルームと半分ずつ重ねて、ユーザーが複数ルームに入っている状態にする
+        picked = [uids[(i * members + j + members // 2 * (j % 2)) % len(uids)] for j in range(members)]
+        picked = list(dict.fromkeys(picked))
+        room_members[room_id] = picked
+        await storage.rooms().create({"room_id": room_id, "name": room_id, "color_id": i % 8}, created_by=picked[0])
+        for uid in picked[1:]:
+            await storage.rooms().add_member(room_id, uid)
+    for n in range(rounds):
+        room_id = room_ids[n % rooms]
+        players = rng.sample(room_members[room_id], min(4, len(room_members[room_id])))
+        values = [rng.randint(-50, 50) for _ in players[:-1]]
+        await storage.points().create({
+            "room_id": room_id,
+            "round_id": f"PON-{n:07d}",
+            "points": [{"uid": u, "value": v} for u, v in zip(players, values + [-sum(values)])],
+            "approved_by": players,
+            "created_at": start + timedelta(minutes=n),
+        })
+    for n in range(settlements):
+        room_id = room_ids[n % rooms]
+        a, b = rng.sample(room_members[room_id], 2)
+        await storage.settlements().create({
+            "room_id": room_id, "from_uid": a, "to_uid": b, "amount": rng.randint(1, 100),
+            "approved": True, "created_at": start + timedelta(minutes=n * 7, seconds=30),
+        })
+    return {"room_id": room_ids[0], "uid": room_members[room_ids[0]][0]}
+
+
+async def timed(iterations: int, fn) -> tuple[float, float]:
+    """(1回あたりの壁時計 µs, CPU µs)"""
+    await fn()  # 初回（遅延 import など）は除く
+    wall, cpu = time.perf_counter(), time.process_time()
+    for _ in range(iterations):
+        await fn()
+    return (
+        (time.perf_counter() - wall) / iterations * 1e6,
+        (time.process_time() - cpu) / iterations * 1e6,
+    )
+
+
+async def run(args) -> None:
+    storage = Storage()
+    started = time.perf_counter()
+    target = await seed(storage, args.rooms, args.members, args.rounds, args.settlements)
+    print(f"seeded {args.rooms} rooms / {args.rounds} rounds / {args.settlements} settlements "
+          f"in {time.perf_counter() - started:.2f}s")
+    room_id, uid = target["room_id"], target["uid"]
+
+    rooms = RoomService(storage.rooms(), storage.points())
+    points = PointService(storage.points(), storage.rooms(), storage.round_cache())
+    settles = SettlementService(storage.settlements(), storage.settle_cache(), storage.points())
+    activity = ActivityService(storage.points(), storage.settlements())
+    export = LedgerExportService(storage.points(), storage.settlements(), storage.rooms(), batch_size=500)
+    series = SeriesService(storage.points(), storage.rooms(), storage.series_cache())
+
+    async def series_miss():
+        # キャッシュを毎回空にして系列の計算（累積・間引き）を測る
+        await SeriesService(storage.points(), storage.rooms(), MemorySeriesCacheRepository()).balance_series(room_id)
+
+    async def export_room():
+        chunks = await export.export_room(room_id, uid, "jsonl", with_balance=True)
+        async for _ in chunks:
+            pass
+
+    cases = {
+        "rooms.get_room": lambda: rooms.get_room(room_id),
+        "rooms.list_user_rooms": lambda: rooms.list_user_rooms(uid),
+        "rooms.list_members": lambda: rooms.list_members(room_id),
+        "points.history": lambda: points.history(room_id),
+        "points.room_balances": lambda: storage.points().room_balances(room_id),
+        "settlements.history_by_uid": lambda: settles.history_by_uid(uid),
+        "settlements.balance_check": lambda: settles._get_balance(uid),
+        "activity.feed (20)": lambda: activity.feed(uid, limit=20),
+        "series (cache hit)": lambda: series.balance_series(room_id),
+        "series (computed)": series_miss,
+        "export.room jsonl": export_room,
+    }
+    print(f"{'operation':<30} {'µs/op':>10} {'CPU µs/op':>10}")
+    for name, fn in cases.items():
+        if args.only and args.only not in name:
+            continue
+        iterations = max(1, args.iterations // 20) if name in ("series (computed)", "export.room jsonl") else args.iterations
+        wall, cpu = await timed(iterations, fn)
+        print(f"{name:<30} {wall:>10.1f} {cpu:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rooms", type=int, default=20)
+    parser.add_argument("--members", type=int, default=8)
+    parser.add_argument("--rounds", type=int, default=5000)
+    parser.add_argument("--settlements", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--only", help="run operations whose name contains this")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
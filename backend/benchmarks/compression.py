@@ -0,0 +1,167 @@
+# benchmarks/compression.py
+
+"""
+エンドポイントごとの圧縮の CPU 時間とバイト数を比べる（COMPRESSION_* のレベル決め用）。
+
+    cd backend && python -m benchmarks.compression --rows 2000 --iterations 50
+    cd backend && python -m benchmarks.compression --url http://localhost:8000/api --token <JWT> --room <room_id>
+
+- 既定では各エンドポイントのレスポンスと同じ形の JSON を合成する
+  （--url を付けると実際のサーバーから Accept-Encoding: identity で取ってきた本文を使う）
+- 方式（gzip / br / zstd。入っているもの）とレベルごとに、圧縮後のバイト数・圧縮率・
+  1レスポンスあたりの CPU 時間（µs）・処理速度（MB/s）を出す
+- export はミドルウェアと同じくチャンクごとにフラッシュしたストリーミング圧縮で測る
+"""
+
+import argparse
+import json
+import random
+import time
+import urllib.request
+from datetime import datetime, timedelta
+
+from src.compression import BrotliCodec, GzipCodec, ZstdCodec, brotli, zstandard
+
+LEVELS = {
+    "gzip": (GzipCodec, [1, 6, 9]),
+    "br": (BrotliCodec, [1, 5, 9]),
+    "zstd": (ZstdCodec, [1, 3, 9]),
+}
+
+
+def _dumps(value) -> bytes:
+    # FastAPI の JSONResponse と同じ区切り
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+
+
+def synthetic_payloads(rows: int, members: int, chunk_rows: int) -> dict[str, list[bytes]]:
+    """エンドポイント → 本文のチャンク（1チャンクなら通常のレスポンス）"""
+    rng = random.Random(0)
+    uids = [f"user_{i:04d}_{rng.getrandbits(64):016x}" for i in range(members)]
+    start = datetime(2025, 1, 1)
+
+    def point_row(i):
+        values = [rng.randint(-50, 50) for _ in uids[:-1]]
+        return {
+            "round_id": f"round-{i:06d}",
+            "points": [{"uid": u, "value": v} for u, v in zip(uids, values + [-sum(values)])],
+            "created_at": (start + timedelta(minutes=7 * i)).isoformat(),
+            "approved_by": uids,
+            "is_deleted": False,
+        }
+
+    history = [point_row(i) for i in range(rows)]
+    settlements = [
+        {
+            "from_uid": rng.choice(uids),
+            "to_uid": rng.choice(uids),
+            "amount": rng.randint(1, 500),
+            "approved": True,
+            "created_at": (start + timedelta(hours=i)).isoformat(),
+            "approved_at": (start + timedelta(hours=i, minutes=1)).isoformat(),
+            "is_deleted": False,
+        }
+        for i in range(rows)
+    ]
+    rooms = [
+        {
+            "room_id": f"r{i:05d}",
+            "name": f"Room {i}",
+            "description": "weekly mahjong" if i % 3 else None,
+            "color_id": i % 8,
+            "created_by": uids[i % members],
+            "created_at": start.isoformat(),
+            "is_archived": False,
+            "members": [{"uid": u, "joined_at": start.isoformat()} for u in uids],
+            "pending_members": [],
+        }
+        for i in range(max(1, rows // 50))
+    ]
+    users = [
+        {"uid": u, "display_name": f"Player {i}", "icon_url": f"https://cdn.example.com/icons/{u}.png",
+         "registered_at": start.isoformat(), "is_online": bool(i % 2)}
+        for i, u in enumerate(uids * max(1, rows // (members * 10)))
+    ]
+    export_rows = [
+        {"room_id": "r00001", "round_id": r["round_id"], "uid": p["uid"], "value": p["value"], "created_at": r["created_at"]}
+        for r in history for p in r["points"]
+    ]
+    export = [
+        b"".join(_dumps(row) + b"\n" for row in export_rows[i:i + chunk_rows])
+        for i in range(0, len(export_rows), chunk_rows)
+    ]
+    return {
+        "rooms/{id}/points/history": [_dumps(history)],
+        "rooms/{id}/settle/history": [_dumps(settlements)],
+        "rooms": [_dumps(rooms)],
+        "users": [_dumps(users)],
+        "rooms/{id}/export (ndjson stream)": export,
+    }
+
+
+def fetch_payloads(url: str, token: str, room: str) -> dict[str, list[bytes]]:
+    paths = [
+        f"/rooms/{room}/points/history",
+        f"/rooms/{room}/settle/history",
+        "/rooms",
+        "/users",
+        "/users/me/points/history",
+    ]
+    payloads = {}
+    for path in paths:
+        request = urllib.request.Request(
+            url.rstrip("/") + path,
+            headers={"Authorization": f"Bearer {token}", "Accept-Encoding": "identity"},
+        )
+        with urllib.request.urlopen(request) as response:
+            payloads[path] = [response.read()]
+    return payloads
+
+
+def measure(codec, chunks: list[bytes], iterations: int) -> tuple[int, float]:
+    """(圧縮後のバイト数, 1レスポンスあたりの CPU µs)"""
+    start = time.process_time()
+    for _ in range(iterations):
+        if len(chunks) == 1:
+            size = len(codec.compress(chunks[0]))
+        else:
+            stream = codec.stream()
+            size = sum(len(stream.chunk(c)) for c in chunks) + len(stream.finish())
+    return size, (time.process_time() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2000, help="history / settlement rows")
+    parser.add_argument("--members", type=int, default=4)
+    parser.add_argument("--chunk-rows", type=int, default=500, help="rows per streamed export chunk")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--url", help="API base of a running server, e.g. http://localhost:8000/api")
+    parser.add_argument("--token")
+    parser.add_argument("--room")
+    args = parser.parse_args()
+
+    if args.url:
+        payloads = fetch_payloads(args.url, args.token, args.room)
+    else:
+        payloads = synthetic_payloads(args.rows, args.members, args.chunk_rows)
+
+    missing = [name for name, module in (("br", brotli), ("zstd", zstandard)) if module is None]
+    if missing:
+        print(f"not installed, skipped: {', '.join(missing)}")
+
+    print(f"{'endpoint':<36} {'codec':<8} {'bytes':>10} {'ratio':>7} {'µs CPU':>10} {'MB/s':>8}")
+    for endpoint, chunks in payloads.items():
+        raw = sum(len(c) for c in chunks)
+        print(f"{endpoint:<36} {'identity':<8} {raw:>10} {1:>7.2f} {0:>10.0f} {'-':>8}")
+        for name, (cls, levels) in LEVELS.items():
+            if (name == "br" and brotli is None) or (name == "zstd" and zstandard is None):
+                continue
+            for level in levels:
+                size, us = measure(cls(level), chunks, args.iterations)
+                mbps = raw / us if us else float("inf")
+                print(f"{'':<36} {f'{name}-{level}':<8} {size:>10} {raw / size:>7.2f} {us:>10.0f} {mbps:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# benchmarks/import_time.py
+
+"""
+ワーカー起動（import src.main）にかかる時間を -X importtime で測り、予算を超えたら失敗する。
+
+    cd backend && python -m benchmarks.import_time --budget-ms 1500 --runs 5
+
+- 各回を新しいプロセスで測り、中央値を予算と比べる（ディスクキャッシュ等の揺れを均す）
+- 起動時にしか要らないモジュール（認証プロバイダ・任意依存）が import 時に読み込まれていたら、
+  時間に関係なく失敗する
+- 遅い import の上位を表示する（原因の特定用）
+
+終了コード 0 = 予算内、1 = 超過または禁止モジュールの読み込み。CI でそのまま使える。
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# import src.main の時点で読み込まれてはいけないもの（起動時・初回利用時に遅延 import する）
+LAZY_MODULES = {
+    "google": "auth provider (firebase) must be imported by src.auth_providers at startup",
+    "requests": "pulled in by google-auth; only the firebase provider needs it",
+    "jose": "auth provider (supabase) must be imported by src.auth_providers at startup",
+    "pyarrow": "optional parquet export dependency",
+}
+
+
+def measure_once(target: str) -> list[tuple[int, int, str]]:
+    """(self µs, cumulative µs, モジュール名) の一覧。名前の字下げは import の深さ"""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr[-4000:])
+        raise SystemExit(f"import {target} failed")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), int(cumulative_us), name.rstrip()))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--target", default="src.main")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_TIME_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    totals = []
+    last = []
+    for _ in range(args.runs):
+        last = measure_once(args.target)
+        totals.append(next(c for _, c, name in last if name.strip() == args.target))
+    median_ms = statistics.median(totals) / 1000
+
+    print(f"import {args.target}: median {median_ms:.0f} ms over {args.runs} runs "
+          f"(min {min(totals) / 1000:.0f}, max {max(totals) / 1000:.0f}), budget {args.budget_ms:.0f} ms")
+    print("\nslowest imports (cumulative, last run):")
+    for self_us, cumulative_us, name in sorted(last, key=lambda r: r[1], reverse=True)[:args.top]:
+        print(f"  {cumulative_us / 1000:8.1f} ms  {self_us / 1000:7.1f} ms self  {name.strip()}")
+
+    failures = []
+    loaded = {name.strip().split(".")[0] for _, _, name in last}
+    for module, reason in LAZY_MODULES.items():
+        if module in loaded:
+            failures.append(f"{module} is imported at import time: {reason}")
+    if median_ms > args.budget_ms:
+        failures.append(f"median import time {median_ms:.0f} ms exceeds budget {args.budget_ms:.0f} ms")
+
+    if failures:
+        print("\nFAILED")
+        for failure in failures:
+            print(f"  - {failure}")
+        raise SystemExit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()
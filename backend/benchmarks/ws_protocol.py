@@ -0,0 +1,76 @@
+# benchmarks/ws_protocol.py
+
+"""
+WebSocket ブロードキャスト1回あたりのバイト数と CPU 時間を比べる。
+
+    cd backend && python -m benchmarks.ws_protocol --members 50 --iterations 2000
+
+- json-per-send: 従来の send_json（受信者ごとに json.dumps。Starlette と同じ区切り）
+- json:          型付きイベントを1回だけエンコード
+- msgpack:       satopon.msgpack.v1（[code, 値...] の配列、1回だけエンコード）
+"""
+
+import argparse
+import json
+import time
+
+from src.events import JSON, MSGPACK, PointFinalTable, PointRoundStatus, msgpack
+
+
+def sample_events(members: int):
+    uids = [f"user_{i:04d}_{'x' * 20}" for i in range(members)]
+    table = {uid: (i % 7) - 3 for i, uid in enumerate(uids)}
+    return {
+        "point_final_table": lambda: PointFinalTable(room_id="room_ab12cd34", round_id="round_ef56", table=table),
+        "point_round_status": lambda: PointRoundStatus(
+            room_id="room_ab12cd34",
+            round_id="round_ef56",
+            participants=uids,
+            submitted=uids[: members // 2],
+            sum=0,
+            complete=False,
+            table=None,
+            approvals=[],
+            ttl=42,
+        ),
+    }
+
+
+def measure(make_event, members: int, iterations: int, protocol: str | None) -> tuple[int, float]:
+    start = time.process_time()
+    for _ in range(iterations):
+        event = make_event()
+        if protocol is None:
+            payload = event.to_dict()
+            for _ in range(members):
+                data = json.dumps(payload, separators=(",", ":"), ensure_ascii=False)
+        else:
+            for _ in range(members):
+                data = event.encode(protocol)
+    elapsed = time.process_time() - start
+    size = len(data.encode() if isinstance(data, str) else data)
+    return size, elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    variants = [("json-per-send", None), ("json", JSON)]
+    if msgpack is not None:
+        variants.append(("msgpack", MSGPACK))
+    else:
+        print("msgpack is not installed; skipping the binary protocol")
+
+    print(f"{args.members} recipients, {args.iterations} broadcasts")
+    print(f"{'event':<20} {'variant':<14} {'bytes/frame':>12} {'µs CPU/broadcast':>17}")
+    for name, make_event in sample_events(args.members).items():
+        for label, protocol in variants:
+            size, us = measure(make_event, args.members, args.iterations, protocol)
+            print(f"{name:<20} {label:<14} {size:>12} {us:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+# benchmarks/ws_soak.py
+
+"""
+WebSocket の長時間負荷（ソーク）試験。接続あたりのメモリと、入退室・切断の繰り返しで
+タイマー・presence・購読が溜まっていかないかを見る。ノードあたりの接続数の見積もり用。
+
+    cd backend && python -m benchmarks.ws_soak --connections 20000 --duration 4h --churn 50
+
+- 試験用の Mongo / Redis（MONGODB_URI / REDIS_URI。DB 名の既定は satopon_soak）に
+  ユーザー soak000000… とルーム soak0000… を作り、uvicorn（1ワーカー）を子プロセスで起動する。
+  既存のサーバーに向けるときは --url（SUPABASE_JWT_SECRET / PROFILING_SECRET を揃えること）
+- トークンは SUPABASE_JWT_SECRET で署名したスタブ（AUTH_PROVIDER=supabase の検証をそのまま通る）
+- 各クライアントは 接続 → enter_room → 滞在 → leave_room → 切断 を繰り返す。
+  平均滞在は connections / churn 秒（1秒あたり約 churn 本が入れ替わる）
+- --join-rate で参加申請 → 取消（HTTP）も流し、参加申請の自動取消タイマーを作らせる
+- --sample 秒ごとに GET /ws/stats と Redis を読み、JSON Lines で --out に書く:
+  RSS・接続あたり RSS・タスク数（コルーチン別）・購読数・presence のキー数/メンバー数・DBSIZE、
+  配送遅延（ping → pong と、enter_room → 同じルームの他の接続に user_entered が届くまで）の p50/p99、
+  クライアント側のイベントループ遅延（これが大きいと遅延の数字はクライアント律速）
+- 漏れの判定（1つでも当たれば終了コード 1）:
+  - 定常区間（--warmup 以降）で、接続あたり RSS・接続あたりタスク数・Redis のキー数が
+    区間の長さぶん外挿して --tolerance 以上増えている
+  - 全員切断して --drain 秒待った後に、接続・購読・presence・タイマーのタスクが残っている
+
+ファイルディスクリプタの上限は hard まで引き上げる。1つの送信元 IP からは約 28000 本
+（エフェメラルポートの数）までしか張れないので、それ以上は --url で複数の送信元から流す。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import secrets
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+# 子プロセス（サーバー）にも引き継ぐ。本番の DB を触らないよう DB 名を分ける
+os.environ.setdefault("MONGO_DB_NAME", "satopon_soak")
+os.environ.setdefault("AUTH_PROVIDER", "supabase")
+os.environ.setdefault("SUPABASE_JWT_SECRET", "soak-secret")
+os.environ.setdefault("PROFILING_SECRET", secrets.token_hex(16))
+
+import websockets
+from jose import jwt
+from motor.motor_asyncio import AsyncIOMotorClient
+from redis.asyncio import Redis
+
+from src.config import MONGO_DB_NAME, MONGODB_URI, PROFILING_SECRET, REDIS_URI, SUPABASE_JWT_SECRET
+from src.profiling import PROFILE_HEADER, sign_profile_request
+from src.redis_keys import keys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PREFIX = "soak"
+# 切断後に残っていてはいけないタスク（コルーチンの __qualname__）
+TIMER_COROS = ("RoomService._auto_cancel_join_request", "PointService._watch_timeout", "UpdateNotices._flush_later")
+
+
+def parse_duration(value: str) -> float:
+    units = {"s": 1, "m": 60, "h": 3600}
+    if value[-1] in units:
+        return float(value[:-1]) * units[value[-1]]
+    return float(value)
+
+
+def uid_of(i: int) -> str:
+    return f"{PREFIX}{i:06d}"
+
+
+def room_of(i: int, rooms: int) -> str:
+    return f"{PREFIX}{i % rooms:04d}"
+
+
+# ─── 準備 ───
+
+async def seed(connections: int, rooms: int, token_ttl: float) -> list[str]:
+    """ユーザー・ルーム・メンバーを作り直し、接続ごとのトークンを返す"""
+    db = AsyncIOMotorClient(MONGODB_URI)[MONGO_DB_NAME]
+    await cleanup_db(db)
+    now = datetime.now()
+    await db.users.insert_many([
+        {
+            "uid": uid_of(i),
+            "external_id": f"{PREFIX}-ext-{i}",
+            "display_name": f"soak {i}",
+            "registered_at": now,
+            "is_deleted": False,
+        }
+        for i in range(connections)
+    ])
+    await db.rooms.insert_many([
+        {
+            "room_id": room_of(r, rooms),
+            "name": f"soak room {r}",
+            "description": None,
+            "color_id": 1,
+            "created_by": uid_of(r),
+            "created_at": now,
+            "is_archived": False,
+        }
+        for r in range(rooms)
+    ])
+    await db.room_members.insert_many([
+        {"room_id": room_of(i, rooms), "uid": uid_of(i), "state": "member", "joined_at": now, "updated_at": now}
+        for i in range(connections)
+    ])
+    exp = int(time.time() + token_ttl)
+    return [
+        jwt.encode({"sub": f"{PREFIX}-ext-{i}", "aud": "authenticated", "exp": exp}, SUPABASE_JWT_SECRET, algorithm="HS256")
+        for i in range(connections)
+    ]
+
+
+async def cleanup_db(db) -> None:
+    pattern = {"$regex": f"^{PREFIX}"}
+    await db.users.delete_many({"uid": pattern})
+    await db.rooms.delete_many({"room_id": pattern})
+    await db.room_members.delete_many({"room_id": pattern})
+
+
+def raise_fd_limit(needed: int) -> None:
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = hard if hard != resource.RLIM_INFINITY else max(soft, needed)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+    if target < needed:
+        print(f"warning: open file limit {target} < {needed}; raise `ulimit -Hn` first")
+
+
+def start_server(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "src.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", "1", "--log-level", "warning", "--backlog", "4096"],
+        cwd=BACKEND_DIR,
+    )
+
+
+def http(base: str, method: str, path: str, token: str | None = None, timeout: float = 10) -> tuple[int, bytes]:
+    headers = {PROFILE_HEADER: sign_profile_request(int(time.time()) + 60, PROFILING_SECRET)}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(base + path, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+async def wait_ready(base: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = await asyncio.to_thread(http, base, "GET", "/ws/stats", None, 2)
+            if status == 200:
+                return
+            if status == 403:
+                raise SystemExit("GET /ws/stats returned 403: PROFILING_SECRET differs from the server's")
+        except OSError:
+            pass
+        await asyncio.sleep(0.5)
+    raise SystemExit(f"server at {base} did not become ready")
+
+
+# ─── クライアント ───
+
+class Window:
+    """サンプル間隔ごとのクライアント側の数字（読んだらリセット）"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.disconnects = 0
+        self.errors = 0
+        self.ping_ms: list[float] = []
+        self.deliver_ms: list[float] = []
+        self.loop_lag_ms = 0.0
+        self.join_requests = 0
+
+
+class Soak:
+    def __init__(self, args, tokens: list[str]):
+        self.args = args
+        self.tokens = tokens
+        self.ws_url = args.url.replace("http", "ws", 1) + "/ws"
+        self.window = Window()
+        self.open: dict[int, object] = {}
+        self.entered: dict[str, float] = {}  # f"{room_id}:{uid}" → enter_room を送った時刻
+        self.ping_sent: dict[int, float] = {}
+        self.stopping = asyncio.Event()
+        # churn=0 なら入れ替えず、最後まで繋いだまま
+        self.mean_session = args.connections / args.churn if args.churn > 0 else None
+
+    async def client(self, i: int) -> None:
+        uid, room_id = uid_of(i), room_of(i, self.args.rooms)
+        while not self.stopping.is_set():
+            try:
+                async with websockets.connect(
+                    f"{self.ws_url}?token={self.tokens[i]}",
+                    ping_interval=None,
+                    open_timeout=30,
+                    close_timeout=5,
+                    max_queue=None,
+                ) as ws:
+                    self.window.connects += 1
+                    self.open[i] = ws
+                    reader = asyncio.create_task(self.read(i, uid, ws))
+                    try:
+                        self.entered[f"{room_id}:{uid}"] = time.perf_counter()
+                        await ws.send(json.dumps({"type": "enter_room", "room_id": room_id}))
+                        await self.dwell(
+                            random.expovariate(1 / self.mean_session) if self.mean_session else self.args.duration
+                        )
+                        await ws.send(json.dumps({"type": "leave_room", "room_id": room_id}))
+                    finally:
+                        self.open.pop(i, None)
+                        self.ping_sent.pop(i, None)
+                        reader.cancel()
+                self.window.disconnects += 1
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                self.window.errors += 1
+                await asyncio.sleep(random.uniform(1, 5))
+                continue
+            # 再接続までの間（同時に再接続が集中しないようにばらす）
+            await asyncio.sleep(random.uniform(0, 2))
+
+    async def dwell(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def read(self, i: int, uid: str, ws) -> None:
+        try:
+            async for raw in ws:
+                now = time.perf_counter()
+                event = json.loads(raw)
+                if event.get("type") == "pong" and (sent := self.ping_sent.pop(i, None)) is not None:
+                    self.window.ping_ms.append((now - sent) * 1000)
+                elif event.get("type") == "user_entered" and event.get("uid") != uid:
+                    sent = self.entered.get(f"{event['room_id']}:{event['uid']}")
+                    if sent is not None:
+                        self.window.deliver_ms.append((now - sent) * 1000)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def pinger(self) -> None:
+        """開いている接続から無作為に選んで ping を送る（1秒に --pings 回）"""
+        while not self.stopping.is_set():
+            if self.open:
+                i = random.choice(list(self.open))
+                if i not in self.ping_sent:
+                    self.ping_sent[i] = time.perf_counter()
+                    try:
+                        await self.open[i].send(json.dumps({"type": "ping"}))
+                    except (KeyError, websockets.exceptions.ConnectionClosed):
+                        self.ping_sent.pop(i, None)
+            await asyncio.sleep(1 / self.args.pings)
+
+    async def joiner(self) -> None:
+        """他のルームへ参加申請し、しばらくして取り消す（一部は自動取消の期限を過ぎてから）"""
+        while not self.stopping.is_set():
+            i = random.randrange(self.args.connections)
+            other = room_of(i + 1, self.args.rooms)
+            asyncio.create_task(self.join_then_cancel(self.tokens[i], other))
+            await asyncio.sleep(random.expovariate(self.args.join_rate))
+
+    async def join_then_cancel(self, token: str, room_id: str) -> None:
+        status, _ = await asyncio.to_thread(http, self.args.url, "POST", f"/api/rooms/{room_id}/join", token)
+        if status == 200:
+            self.window.join_requests += 1
+            await asyncio.sleep(random.uniform(0, 45))
+            await asyncio.to_thread(http, self.args.url, "POST", f"/api/rooms/{room_id}/cancel_join", token)
+
+    async def lag_probe(self) -> None:
+        while not self.stopping.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(0.1)
+            lag = (time.perf_counter() - start - 0.1) * 1000
+            self.window.loop_lag_ms = max(self.window.loop_lag_ms, lag)
+
+    async def prune_entered(self) -> None:
+        while not self.stopping.is_set():
+            cutoff = time.perf_counter() - 30
+            for key in [k for k, t in self.entered.items() if t < cutoff]:
+                del self.entered[key]
+            await asyncio.sleep(10)
+
+
+# ─── 計測 ───
+
+async def redis_counts(redis: Redis, rooms: int) -> dict:
+    presence_keys = 0
+    presence_members = 0
+    for r in range(rooms):
+        if members := await redis.scard(keys.presence(room_of(r, rooms))):
+            presence_keys += 1
+            presence_members += members
+    return {"dbsize": await redis.dbsize(), "presence_keys": presence_keys, "presence_members": presence_members}
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 2)
+
+
+async def sample(soak: Soak, redis: Redis, started: float, baseline: dict, out) -> dict:
+    status, body = await asyncio.to_thread(http, soak.args.url, "GET", "/ws/stats")
+    server = json.loads(body) if status == 200 else {}
+    window, soak.window = soak.window, Window()
+    connections = server.get("connections", 0)
+    rss = server.get("rss_bytes")
+    row = {
+        "t": round(time.monotonic() - started, 1),
+        "client_open": len(soak.open),
+        "connects": window.connects,
+        "disconnects": window.disconnects,
+        "errors": window.errors,
+        "join_requests": window.join_requests,
+        "ping_p50_ms": percentile(window.ping_ms, 0.5),
+        "ping_p99_ms": percentile(window.ping_ms, 0.99),
+        "deliver_p50_ms": percentile(window.deliver_ms, 0.5),
+        "deliver_p99_ms": percentile(window.deliver_ms, 0.99),
+        "client_loop_lag_ms": round(window.loop_lag_ms, 1),
+        **server,
+        "rss_per_conn": (rss - baseline["rss_bytes"]) / connections if rss and connections else None,
+        "tasks_per_conn": (server.get("tasks", 0) - baseline["tasks"]) / connections if connections else None,
+        **await redis_counts(redis, soak.args.rooms),
+    }
+    out.write(json.dumps(row) + "\n")
+    out.flush()
+    print(
+        f"t={row['t']:>8.0f}s conns={connections:>6} rss={(rss or 0) / 2**20:8.1f}MiB "
+        f"rss/conn={(row['rss_per_conn'] or 0) / 1024:6.1f}KiB tasks={server.get('tasks', 0):>6} "
+        f"presence={row['presence_members']:>6} keys={row['dbsize']:>7} "
+        f"ping p99={row['ping_p99_ms']}ms deliver p99={row['deliver_p99_ms']}ms errors={window.errors}"
+    )
+    return row
+
+
+def growth(rows: list[dict], field: str) -> float | None:
+    """最小二乗の傾き × 区間の長さ を平均値で割ったもの（区間内の相対的な増え方）"""
+    points = [(r["t"], r[field]) for r in rows if r.get(field) is not None]
+    if len(points) < 3:
+        return None
+    ts, vs = zip(*points)
+    mean_t, mean_v = statistics.fmean(ts), statistics.fmean(vs)
+    var_t = sum((t - mean_t) ** 2 for t in ts)
+    if not var_t or not mean_v:
+        return None
+    slope = sum((t - mean_t) * (v - mean_v) for t, v in points) / var_t
+    return slope * (ts[-1] - ts[0]) / abs(mean_v)
+
+
+def check_leaks(steady: list[dict], drained: dict, baseline: dict, tolerance: float) -> list[str]:
+    failures = []
+    for field in ("rss_per_conn", "tasks_per_conn", "dbsize", "presence_keys"):
+        g = growth(steady, field)
+        if g is not None and g > tolerance:
+            failures.append(f"{field} grew {g:.0%} over the steady window (tolerance {tolerance:.0%})")
+    for field, value in (
+        ("connections", drained.get("connections")),
+        ("subscriptions", drained.get("topics", {}).get("subscriptions")),
+        ("room_updated notices", drained.get("notices", {}).get("uids")),
+        ("presence members", drained.get("presence_members")),
+    ):
+        if value:
+            failures.append(f"{value} {field} left after every client disconnected")
+    for coro in TIMER_COROS:
+        if count := drained.get("tasks_by_coro", {}).get(coro):
+            failures.append(f"{count} {coro} tasks left after every client disconnected")
+    if (extra := drained.get("tasks", 0) - baseline["tasks"]) > 10:
+        failures.append(f"{extra} more tasks than before the run: {drained.get('tasks_by_coro')}")
+    return failures
+
+
+# ─── 本体 ───
+
+async def run(args) -> int:
+    raise_fd_limit(args.connections * 2 + 1000)
+    print(f"seeding {args.connections} users in {args.rooms} rooms ({MONGO_DB_NAME})")
+    tokens = await seed(args.connections, args.rooms, args.duration + 86400)
+
+    server = None
+    if args.spawn:
+        server = start_server(args.port)
+    try:
+        await wait_ready(args.url)
+        redis = Redis.from_url(REDIS_URI, decode_responses=True)
+        _, body = await asyncio.to_thread(http, args.url, "GET", "/ws/stats")
+        baseline = json.loads(body)
+        print(f"baseline: rss={baseline['rss_bytes'] / 2**20:.1f}MiB tasks={baseline['tasks']}")
+
+        soak = Soak(args, tokens)
+        helpers = [asyncio.create_task(h()) for h in (soak.pinger, soak.lag_probe, soak.prune_entered)]
+        if args.join_rate > 0:
+            helpers.append(asyncio.create_task(soak.joiner()))
+        clients = []
+        started = time.monotonic()
+        rows = []
+        next_sample = started + args.sample
+        with open(args.out, "w") as out:
+            # 一斉に張ると SYN が溢れるので --ramp 本/秒で増やす
+            for i in range(args.connections):
+                clients.append(asyncio.create_task(soak.client(i)))
+                if time.monotonic() >= next_sample:
+                    rows.append(await sample(soak, redis, started, baseline, out))
+                    next_sample += args.sample
+                await asyncio.sleep(1 / args.ramp)
+            while time.monotonic() - started < args.duration:
+                await asyncio.sleep(max(0, next_sample - time.monotonic()))
+                rows.append(await sample(soak, redis, started, baseline, out))
+                next_sample += args.sample
+
+            print(f"disconnecting every client and waiting {args.drain:.0f}s")
+            soak.stopping.set()
+            await asyncio.gather(*clients, return_exceptions=True)
+            for task in helpers:
+                task.cancel()
+            await asyncio.sleep(args.drain)
+            drained = await sample(soak, redis, started, baseline, out)
+
+        steady = [r for r in rows if r["t"] >= args.warmup]
+        peak = max(rows, key=lambda r: r.get("connections", 0), default={})
+        if peak.get("rss_per_conn"):
+            per_conn = peak["rss_per_conn"]
+            print(f"\npeak {peak['connections']} connections: {per_conn / 1024:.1f} KiB RSS per connection "
+                  f"(~{2**30 / per_conn:,.0f} connections per GiB above baseline)")
+        failures = check_leaks(steady, drained, baseline, args.tolerance)
+        await redis.aclose() if hasattr(redis, "aclose") else await redis.close()
+    finally:
+        if server is not None:
+            server.send_signal(signal.SIGINT)
+            server.wait(timeout=30)
+        if not args.keep_data:
+            await cleanup_db(AsyncIOMotorClient(MONGODB_URI)[MONGO_DB_NAME])
+
+    print(f"samples written to {args.out}")
+    if failures:
+        print("\nLEAKS SUSPECTED")
+        for failure in failures:
+            print(f"  - {failure}")
+        return 1
+    print("\nOK: no growth beyond tolerance and nothing left after disconnect")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=20000)
+    parser.add_argument("--rooms", type=int, default=500)
+    parser.add_argument("--duration", type=parse_duration, default=parse_duration("1h"),
+                        help="e.g. 90s, 30m, 4h (includes the ramp-up)")
+    parser.add_argument("--churn", type=float, default=50, help="reconnects per second at steady state")
+    parser.add_argument("--ramp", type=float, default=500, help="new connections per second while ramping up")
+    parser.add_argument("--join-rate", type=float, default=1, help="join request + cancel per second (0 = off)")
+    parser.add_argument("--pings", type=float, default=20, help="latency pings per second")
+    parser.add_argument("--sample", type=float, default=30, help="seconds between samples")
+    parser.add_argument("--warmup", type=parse_duration, default=parse_duration("10m"),
+                        help="ignore samples before this for the growth checks")
+    parser.add_argument("--drain", type=float, default=45, help="seconds to wait after disconnecting everyone")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative growth over the steady window")
+    parser.add_argument("--url", default=None, help="existing server (default: spawn uvicorn on --port)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--out", default="ws_soak.jsonl")
+    parser.add_argument("--keep-data", action="store_true")
+    args = parser.parse_args()
+    args.spawn = args.url is None
+    args.url = (args.url or f"http://127.0.0.1:{args.port}").rstrip("/")
+    raise SystemExit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# src/api/batch.py
+
+"""
+POST /api/batch: ルーム画面などの読み取り（詳細・在室・履歴・プロフィール）を1往復にまとめる。
+
+    {"requests": [{"path": "/rooms/abc"}, {"path": "/rooms/abc/presence"},
+                  {"method": "POST", "path": "/users/profiles", "body": {"uids": [...]}}]}
+    → {"responses": [{"status": 200, "headers": {...}, "body": ...}, ...]}（要求と同じ順）
+
+- 認証は batch 自体で1回だけ。サブリクエストの get_current_uid は batch_uid を返すだけになる
+- 各サブリクエストは同じアプリに ASGI で渡して並行に処理する（通常のルーター・依存関係・
+  ミドルウェアをそのまま通る）。path は /api からの相対（/api/ 付きでもよい）
+- 読み取りに限る: GET と READ_ONLY_PATHS の POST だけ。エクスポートと batch 自身は不可
+- サブリクエストの失敗はその要素の status に入り、batch 自体は 200 のまま
+- 本文は JSON をそのまま埋め込む（パースし直さない）
+"""
+
+import asyncio
+import json
+import logging
+from urllib.parse import urlsplit
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
+
+from src.config import BATCH_MAX_REQUESTS
+from src.resilience import READ_ONLY_PATHS, mark_degraded
+from src.schemas import BatchItem, BatchRequest
+from src.utils import batch_uid, get_current_uid
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# サブリクエストに引き継ぐヘッダ / 応答に残すヘッダ
+FORWARD_HEADERS = {b"authorization", b"accept-language", b"user-agent"}
+RETURN_HEADERS = {b"x-degraded", b"age", b"retry-after"}
+
+
+@router.post("/batch")
+async def batch(
+    body: BatchRequest,
+    request: Request,
+    current_uid: str = Depends(get_current_uid),
+):
+    if not (1 <= len(body.requests) <= BATCH_MAX_REQUESTS):
+        raise HTTPException(status_code=400, detail=f"requests must contain 1 to {BATCH_MAX_REQUESTS} items")
+    prefix = request.url.path.removesuffix("/batch")
+
+    token = batch_uid.set(current_uid)
+    try:
+        results = await asyncio.gather(*(_dispatch(request, prefix, item) for item in body.requests))
+    finally:
+        batch_uid.reset(token)
+
+    parts = [
+        b'{"status":%d,"headers":%s,"body":%s}' % (status, json.dumps(headers).encode(), payload)
+        for status, headers, payload in results
+    ]
+    return Response(b'{"responses":[' + b",".join(parts) + b"]}", media_type="application/json")
+
+
+def _rejected(method: str, path: str, prefix: str) -> str | None:
+    if path == f"{prefix}/batch":
+        return "batch cannot be nested"
+    if method == "GET":
+        if path.endswith("/export"):
+            return "exports cannot be batched"
+        return None
+    if method == "POST" and path in READ_ONLY_PATHS:
+        return None
+    return "only read requests can be batched"
+
+
+def _error(status: int, detail: str) -> tuple[int, dict, bytes]:
+    return status, {}, json.dumps({"detail": detail}).encode()
+
+
+async def _dispatch(request: Request, prefix: str, item: BatchItem) -> tuple[int, dict, bytes]:
+    method = item.method.upper()
+    url = urlsplit(item.path)
+    if not url.path.startswith("/") or url.netloc:
+        return _error(400, "path must start with /")
+    path = url.path if url.path.startswith(f"{prefix}/") else prefix + url.path
+    if reason := _rejected(method, path, prefix):
+        return _error(400, reason)
+
+    content = b"" if item.body is None else json.dumps(item.body).encode()
+    headers = [(k, v) for k, v in request.scope["headers"] if k in FORWARD_HEADERS]
+    if content:
+        headers += [(b"content-type", b"application/json"), (b"content-length", str(len(content)).encode())]
+    scope = {
+        "type": "http",
+        "asgi": request.scope.get("asgi", {"version": "3.0"}),
+        "http_version": request.scope.get("http_version", "1.1"),
+        "method": method,
+        "scheme": request.scope.get("scheme", "http"),
+        "server": request.scope.get("server"),
+        "client": request.scope.get("client"),
+        "root_path": request.scope.get("root_path", ""),
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+    }
+
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": content, "more_body": False}
+        # 切断は起きない（応答を返し終えるまで待たせる）
+        await asyncio.Event().wait()
+
+    start: dict = {}
+    chunks: list[bytes] = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    try:
+        await request.app(scope, receive, send)
+    except Exception:
+        # ServerErrorMiddleware は 500 を送った上で投げ直す
+        logger.exception("Batch sub-request %s %s failed", method, path)
+        if not start:
+            return _error(500, "Internal Server Error")
+
+    response_headers = {
+        k.decode(): v.decode() for k, v in start.get("headers", []) if k.lower() in RETURN_HEADERS
+    }
+    if kinds := response_headers.get("x-degraded"):
+        # 劣化した読み取りが混ざっていれば batch の応答にも付ける
+        age = response_headers.get("age")
+        for kind in kinds.split(", "):
+            mark_degraded(kind, float(age) if age else None)
+
+    payload = b"".join(chunks)
+    content_type = next((v for k, v in start.get("headers", []) if k.lower() == b"content-type"), b"")
+    if not payload:
+        payload = b"null"
+    elif not content_type.startswith(b"application/json"):
+        payload = json.dumps(payload.decode(errors="replace")).encode()
+    return start.get("status", 500), response_headers, payload
@@ -0,0 +1,34 @@
+# src/api/leaderboard.py
+
+from fastapi import APIRouter, Depends
+from functools import lru_cache
+from typing import Optional
+
+from src.utils import get_current_uid
+from src.repositories import get_storage
+from src.services.leaderboard_service import LeaderboardService
+
+
+router = APIRouter()
+
+
+@lru_cache()
+def get_leaderboard_service() -> LeaderboardService:
+    storage = get_storage()
+    return LeaderboardService(
+        board=storage.leaderboard(),
+        point_repo=storage.points(),
+        room_repo=storage.rooms(),
+    )
+
+
+@router.get("/leaderboard")
+async def leaderboard(
+    room_id: Optional[str] = None,
+    limit: int = 10,
+    radius: int = 2,
+    current_uid: str = Depends(get_current_uid),
+    service: LeaderboardService = Depends(get_leaderboard_service),
+):
+    # room_id 無しなら全ルーム合計の残高で並べる
+    return await service.standings(current_uid, room_id=room_id, limit=limit, radius=radius)
@@ -1,29 +1,29 @@
 # src/api/misc_api.py
 
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from functools import lru_cache
 from datetime import datetime
+from typing import Optional
 
 from src.schemas import (
     SettlementCreate,
     PointRegisterRequest,
     PointInput,
 )
-from src.utils import get_current_uid
-from src.db import get_db, get_redis
+from src.utils import get_current_uid, get_causal_uid
+from src.config import EXPORT_BATCH_SIZE
+from src.idempotency import Idempotency, idempotency
 
-from src.repositories.misc_repo import (
-    PointRecordRepository,
-    SettlementRepository,
-    SettlementCacheRepository,
-)
-from src.repositories.room_repo import RoomRepository
-from src.repositories.round_cache_repo import RoundCacheRepository
+from src.repositories import get_storage
 
 from src.services.misc_service import (
     PointService,
     SettlementService,
 )
+from src.services.export_service import LedgerExportService, EXPORT_FORMATS
+from src.services.series_service import SeriesService
+from src.services.activity_service import ActivityService
 
 from src.ws import send_event, broadcast_event_to_room
 
@@ -35,22 +35,51 @@ router = APIRouter()
 
 @lru_cache()
 def get_point_service() -> PointService:
-    mongo = get_db()
-    cache = get_redis()
+    storage = get_storage()
     return PointService(
-        point_repo=PointRecordRepository(mongo),
-        room_repo=RoomRepository(mongo),
-        cache_repo=RoundCacheRepository(cache),
+        point_repo=storage.points(),
+        room_repo=storage.rooms(),
+        cache_repo=storage.round_cache(),
+        leaderboard=storage.leaderboard(),
     )
 
 @lru_cache()
 def get_settlement_service() -> SettlementService:
-    mongo = get_db()
-    cache = get_redis()
+    storage = get_storage()
     return SettlementService(
-        settle_repo=SettlementRepository(mongo),
-        cache_repo=SettlementCacheRepository(cache),
-        point_repo=PointRecordRepository(mongo),
+        settle_repo=storage.settlements(),
+        cache_repo=storage.settle_cache(),
+        point_repo=storage.points(),
+        room_repo=storage.rooms(),
+        leaderboard=storage.leaderboard(),
+    )
+
+
+@lru_cache()
+def get_series_service() -> SeriesService:
+    storage = get_storage()
+    return SeriesService(
+        point_repo=storage.points(),
+        room_repo=storage.rooms(),
+        cache_repo=storage.series_cache(),
+    )
+
+@lru_cache()
+def get_activity_service() -> ActivityService:
+    storage = get_storage()
+    return ActivityService(
+        point_repo=storage.points(),
+        settle_repo=storage.settlements(),
+    )
+
+@lru_cache()
+def get_export_service() -> LedgerExportService:
+    storage = get_storage()
+    return LedgerExportService(
+        point_repo=storage.points(),
+        settle_repo=storage.settlements(),
+        room_repo=storage.rooms(),
+        batch_size=EXPORT_BATCH_SIZE,
     )
 
 
@@ -61,9 +90,22 @@ def get_settlement_service() -> SettlementService:
 @router.get("/rooms/{room_id}/points/history")
 async def point_history(
     room_id: str,
+    include_archived: bool = False,
+    current_uid: str = Depends(get_causal_uid),
     service: PointService = Depends(get_point_service),
 ):
-    return await service.history(room_id)
+    return await service.history(room_id, current_uid, include_archived=include_archived)
+
+
+@router.get("/rooms/{room_id}/points/series")
+async def point_balance_series(
+    room_id: str,
+    points: int = 200,
+    method: str = "lttb",
+    current_uid: str = Depends(get_current_uid),
+    service: SeriesService = Depends(get_series_service),
+):
+    return await service.balance_series(room_id, points=points, method=method, uid=current_uid)
 
 
 
@@ -83,9 +125,12 @@ async def submit_point(
     data: PointInput,
     current_uid: str = Depends(get_current_uid),
     service: PointService = Depends(get_point_service),
+    idem: Idempotency = Depends(idempotency),
 ):
-    await service.submit_score(room_id, current_uid, data.value)
-    return {"ok": True}
+    async def submit():
+        await service.submit_score(room_id, current_uid, data.value)
+        return {"ok": True}
+    return await idem.run(submit)
 
 
 @router.post("/rooms/{room_id}/points/finalize")
@@ -98,15 +143,28 @@ async def finalize_point_round(
 
 
 
+@router.get("/rooms/{room_id}/points/{round_id}/status")
+async def point_round_status(
+    room_id: str,
+    round_id: str,
+    current_uid: str = Depends(get_current_uid),
+    service: PointService = Depends(get_point_service),
+):
+    return await service.round_status(room_id, round_id)
+
+
 @router.post("/rooms/{room_id}/points/{round_id}/approve")
 async def approve_point_record(
     room_id: str,
     round_id: str,
-    current_uid: str = Depends(get_current_uid),
+    current_uid: str = Depends(get_causal_uid),
     service: PointService = Depends(get_point_service),
+    idem: Idempotency = Depends(idempotency),
 ):
-    await service.approve(room_id, round_id, current_uid)
-    return {"ok": True}
+    async def approve():
+        await service.approve(room_id, round_id, current_uid)
+        return {"ok": True}
+    return await idem.run(approve)
 
 
 
@@ -114,10 +172,11 @@ async def approve_point_record(
 
 @router.get("/users/me/points/history")
 async def user_point_history(
-    current_uid: str = Depends(get_current_uid),
+    include_archived: bool = False,
+    current_uid: str = Depends(get_causal_uid),
     service: PointService = Depends(get_point_service), # ここを修正
 ):
-    return await service.point_repo.history_by_uid(current_uid) # ここを修正
+    return await service.point_repo.history_by_uid(current_uid, include_archived=include_archived) # ここを修正
 
 
 # ---- Settlement endpoints ----
@@ -138,11 +197,14 @@ async def request_settlement(
 async def approve_settlement_request(
     room_id: str,
     from_uid: str,
-    current_uid: str = Depends(get_current_uid),
+    current_uid: str = Depends(get_causal_uid),
     service: SettlementService = Depends(get_settlement_service),
+    idem: Idempotency = Depends(idempotency),
 ):
-    await service.approve_request(room_id, from_uid, current_uid)
-    return {"ok": True}
+    async def approve():
+        await service.approve_request(room_id, from_uid, current_uid)
+        return {"ok": True}
+    return await idem.run(approve)
 
 
 @router.post("/rooms/{room_id}/settle/request/{from_uid}/reject")
@@ -156,12 +218,74 @@ async def reject_settlement_request(
     return {"ok": True}
 
 
+@router.get("/users/me/settle/history")
+async def user_settlement_history(
+    current_uid: str = Depends(get_causal_uid),
+    service: SettlementService = Depends(get_settlement_service),
+):
+    return await service.history_by_uid(current_uid)
+
+
+@router.get("/users/me/activity")
+async def user_activity(
+    before: Optional[str] = None,
+    limit: int = 20,
+    current_uid: str = Depends(get_causal_uid),
+    service: ActivityService = Depends(get_activity_service),
+):
+    return await service.feed(current_uid, before=before, limit=limit)
+
+
 @router.get("/rooms/{room_id}/settle/history")
 async def settlement_history(
     room_id: str,
+    current_uid: str = Depends(get_causal_uid),
     service: SettlementService = Depends(get_settlement_service),
 ):
-    return await service.history(room_id)
+    return await service.history(room_id, current_uid)
+
 
+# ---- Ledger export ----
 
 
+def _export_response(chunks, fmt: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
+
+
+@router.get("/rooms/{room_id}/export")
+async def export_room_ledger(
+    room_id: str,
+    format: str = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    with_balance: bool = False,
+    current_uid: str = Depends(get_current_uid),
+    service: LedgerExportService = Depends(get_export_service),
+):
+    chunks = await service.export_room(
+        room_id, current_uid, format,
+        since=since, until=until, after=after, with_balance=with_balance,
+    )
+    return _export_response(chunks, format, f"ledger-{room_id}")
+
+
+@router.get("/users/me/export")
+async def export_user_ledger(
+    format: str = "csv",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    after: Optional[str] = None,
+    with_balance: bool = False,
+    current_uid: str = Depends(get_current_uid),
+    service: LedgerExportService = Depends(get_export_service),
+):
+    chunks = await service.export_user(
+        current_uid, format,
+        since=since, until=until, after=after, with_balance=with_balance,
+    )
+    return _export_response(chunks, format, f"ledger-{current_uid}")
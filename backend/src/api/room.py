@@ -1,29 +1,32 @@
 from fastapi import APIRouter, Depends, HTTPException
 from src.services.room_service import RoomService
-from src.repositories.room_repo import RoomRepository
-from src.repositories.misc_repo import PointRecordRepository
-from src.db import get_db ,get_redis
-from src.schemas import RoomCreate, RoomResponse, RoomUpdate, ApproveRejectBody
-from typing import List
-from src.utils import get_current_uid
+from src.repositories import get_storage
+from src.schemas import RoomCreate, RoomResponse, RoomUpdate, ApproveRejectBody, BulkApproveRejectBody
+from typing import List, Optional
+from src.utils import get_current_uid, get_causal_uid
+from src.idempotency import Idempotency, idempotency
 
 router = APIRouter()
 
-def get_room_service(db=Depends(get_db)):
-    return RoomService(RoomRepository(db), PointRecordRepository(db))
+def get_room_service():
+    storage = get_storage()
+    return RoomService(storage.rooms(), storage.points())
 
 @router.post("/rooms", response_model=dict)
 async def create_room(
     data: RoomCreate,
     current_uid: str = Depends(get_current_uid),
     service: RoomService = Depends(get_room_service),
+    idem: Idempotency = Depends(idempotency),
 ):
-    room_id = await service.create_room(current_uid, data.dict())
-    return {"room_id": room_id}
+    async def create():
+        room_id = await service.create_room(current_uid, data.dict())
+        return {"room_id": room_id}
+    return await idem.run(create)
 
 @router.get("/rooms", response_model=List[RoomResponse])
 async def list_rooms(
-    current_uid: str = Depends(get_current_uid),
+    current_uid: str = Depends(get_causal_uid),
     service: RoomService = Depends(get_room_service),
 ):
     return await service.list_user_rooms(current_uid)
@@ -32,12 +35,8 @@ async def list_rooms(
 async def get_presence(
     room_id: str,
     current_uid: str = Depends(get_current_uid),
-    redis=Depends(get_redis),
 ):
-    key = f"presence:{room_id}"
-    members = await redis.smembers(key)
-    # 文字列の set を配列にして返却
-    return list(members)
+    return await get_storage().presence().uids(room_id)
 
 @router.get("/rooms/all", response_model=List[RoomResponse])
 async def list_all_rooms(
@@ -45,6 +44,17 @@ async def list_all_rooms(
 ):
     # すべてのis_archived=Falseなルームを返す
     return await service.list_all_rooms()
+@router.get("/rooms/{room_id}/members")
+async def list_members(
+    room_id: str,
+    state: str = "member",
+    after: Optional[str] = None,
+    limit: int = 100,
+    current_uid: str = Depends(get_current_uid),
+    service: RoomService = Depends(get_room_service),
+):
+    return await service.list_members(room_id, state=state, after=after, limit=limit)
+
 @router.get("/rooms/{room_id}", response_model=RoomResponse)
 async def get_room(room_id: str, service: RoomService = Depends(get_room_service)):
     return await service.get_room(room_id)
@@ -91,7 +101,7 @@ async def cancel_join_request(
 async def approve_member(
     room_id: str,
     body: ApproveRejectBody,
-    current_uid: str = Depends(get_current_uid),
+    current_uid: str = Depends(get_causal_uid),
     service: RoomService = Depends(get_room_service)
 ):
     await service.approve_member(room_id, body.applicant_user_id, current_uid)
@@ -107,6 +117,32 @@ async def reject_member(
     await service.reject_member(room_id, body.applicant_user_id, current_uid)
     return {"ok": True}
 
+@router.post("/rooms/{room_id}/approve/bulk")
+async def approve_members(
+    room_id: str,
+    body: BulkApproveRejectBody,
+    current_uid: str = Depends(get_causal_uid),
+    service: RoomService = Depends(get_room_service)
+):
+    return await service.approve_members(room_id, body.applicant_user_ids, current_uid)
+
+@router.post("/rooms/{room_id}/reject/bulk")
+async def reject_members(
+    room_id: str,
+    body: BulkApproveRejectBody,
+    current_uid: str = Depends(get_current_uid),
+    service: RoomService = Depends(get_room_service)
+):
+    return await service.reject_members(room_id, body.applicant_user_ids, current_uid)
+
+@router.post("/rooms/{room_id}/reject/expired")
+async def reject_expired_members(
+    room_id: str,
+    current_uid: str = Depends(get_current_uid),
+    service: RoomService = Depends(get_room_service)
+):
+    return await service.reject_expired_members(room_id, current_uid)
+
 @router.post("/rooms/{room_id}/leave")
 async def leave_room(
     room_id: str,
@@ -1,19 +1,36 @@
 from fastapi import APIRouter, Depends, HTTPException
 from src.services.user_service import UserService
-from src.repositories.user_repo import UserRepository
-from src.repositories.room_repo import RoomRepository
-from src.db import get_db
-from src.schemas import UserCreate, UserUpdate, UserResponse
-from typing import List
-from src.utils import get_current_uid, get_current_external_id
+from src.repositories import get_storage
+from src.services.bootstrap_service import BootstrapService
+from src.services.profile_service import ProfileService
+from src.schemas import UserCreate, UserUpdate, UserResponse, ProfileBatchRequest, ProfileResponse
+from src.config import PROFILE_L2_TTL
+from typing import List, Dict
+from src.utils import get_current_uid, get_current_external_id, get_causal_uid
 from src.ws import active_connections
 
 router = APIRouter()
 
 
 
-def get_user_service(db=Depends(get_db)):
-    return UserService(UserRepository(db), RoomRepository(db))
+def get_profile_service():
+    storage = get_storage()
+    return ProfileService(storage.users(), storage.profile_cache(ttl=PROFILE_L2_TTL))
+
+def get_user_service(profiles=Depends(get_profile_service)):
+    storage = get_storage()
+    return UserService(storage.users(), storage.rooms(), profiles)
+
+def get_bootstrap_service(profiles=Depends(get_profile_service)):
+    storage = get_storage()
+    return BootstrapService(
+        storage.users(),
+        storage.rooms(),
+        storage.points(),
+        storage.settle_cache(),
+        storage.presence(),
+        profiles,
+    )
 
 @router.get("/users", response_model=List[UserResponse])
 async def list_users(
@@ -27,6 +44,16 @@ async def list_users(
             u["is_online"] = u["uid"] in active_connections
     return users
 
+@router.post("/users/profiles", response_model=Dict[str, ProfileResponse])
+async def get_profiles(
+    body: ProfileBatchRequest,
+    current_uid: str = Depends(get_current_uid),
+    service: UserService = Depends(get_user_service)
+):
+    if len(body.uids) > 500:
+        raise HTTPException(status_code=400, detail="Too many uids")
+    return await service.get_profiles(body.uids)
+
 @router.post("/users", response_model=UserResponse)
 async def create_user(
     user: UserCreate,
@@ -37,7 +64,7 @@ async def create_user(
 
 @router.get("/users/me", response_model=UserResponse)
 async def get_me(
-    current_uid: str = Depends(get_current_uid),   # ← ここ
+    current_uid: str = Depends(get_causal_uid),   # ← ここ
     service: UserService = Depends(get_user_service)
 ):
     return await service.get_user(current_uid)
@@ -45,10 +72,16 @@ async def get_me(
 @router.put("/users/me", response_model=dict)
 async def update_me(
     data: UserUpdate,
-    current_uid: str = Depends(get_current_uid),   # ← ここ
+    current_uid: str = Depends(get_causal_uid),   # ← ここ
     service: UserService = Depends(get_user_service)
 ):
     await service.update_display_name(current_uid, data.display_name)
     return {"ok": True}
 
-
+@router.get("/me/bootstrap")
+async def bootstrap(
+    # 並行にクエリを投げるので因果セッション（1本のセッションは並行利用不可）は張らない
+    current_uid: str = Depends(get_current_uid),
+    service: BootstrapService = Depends(get_bootstrap_service)
+):
+    return await service.bootstrap(current_uid)
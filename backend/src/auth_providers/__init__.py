@@ -0,0 +1,29 @@
+# src/auth_providers/__init__.py
+
+"""
+認証プロバイダ（AUTH_PROVIDER）のプラグイン。
+
+使うプロバイダのモジュールだけを初回利用時（起動時）に import する。
+Supabase 構成では google-auth / requests を読み込まない。
+
+各プロバイダは external_id(token) を持ち、トークンを検証して外部 ID を返す
+（検証に失敗したら例外を投げる）。
+"""
+
+import importlib
+from functools import lru_cache
+
+from src.config import AUTH_PROVIDER
+
+PROVIDERS = {
+    "supabase": "src.auth_providers.supabase",
+    "firebase": "src.auth_providers.firebase",
+}
+
+
+@lru_cache
+def get_provider():
+    path = PROVIDERS.get(AUTH_PROVIDER)
+    if path is None:
+        raise RuntimeError(f"Unknown AUTH_PROVIDER: {AUTH_PROVIDER}")
+    return importlib.import_module(path).Provider()
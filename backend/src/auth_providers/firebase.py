@@ -0,0 +1,27 @@
+# src/auth_providers/firebase.py
+
+from typing import Optional
+
+from google.auth.transport.requests import Request as GoogleRequest
+from google.oauth2 import id_token
+
+from src.config import FIREBASE_PROJECT_ID
+
+
+class Provider:
+    name = "Firebase"
+
+    def __init__(self):
+        if not FIREBASE_PROJECT_ID:
+            raise RuntimeError("FIREBASE_PROJECT_ID is required for Firebase auth")
+        # 公開鍵の取得に使う HTTP セッションは使い回す
+        self.request = GoogleRequest()
+
+    def external_id(self, token: str) -> Optional[str]:
+        id_info = id_token.verify_firebase_token(
+            token,
+            self.request,
+            audience=FIREBASE_PROJECT_ID
+        )
+        # Token によっては "user_id"、または "sub" にユーザー UID が入っている
+        return id_info.get("user_id") or id_info.get("sub")
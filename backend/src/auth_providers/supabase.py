@@ -0,0 +1,24 @@
+# src/auth_providers/supabase.py
+
+from typing import Optional
+
+from jose import jwt
+
+from src.config import SUPABASE_JWT_SECRET
+
+
+class Provider:
+    name = "Supabase"
+
+    def __init__(self):
+        if not SUPABASE_JWT_SECRET:
+            raise RuntimeError("SUPABASE_JWT_SECRET is required for Supabase auth")
+
+    def external_id(self, token: str) -> Optional[str]:
+        payload = jwt.decode(
+            token,
+            SUPABASE_JWT_SECRET,
+            algorithms=["HS256"],
+            audience="authenticated"
+        )
+        return payload.get("sub")
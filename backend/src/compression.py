@@ -0,0 +1,273 @@
+# src/compression.py
+
+"""
+レスポンスの圧縮（Accept-Encoding で zstd / br / gzip から選ぶ）。
+
+- COMPRESSION_MIN_SIZE バイト未満は圧縮しない（ヘッダ分と CPU が割に合わない）
+- 1回で返る本文はまとめて圧縮し、Content-Length を付け直す
+- ストリーミング（エクスポートなど）はチャンクごとに圧縮してフラッシュする（全体をためない）
+- 圧縮するのは JSON / テキスト系だけ。Content-Encoding が付いているものや Parquet は触らない
+- 圧縮器の準備コストを減らす: gzip は初期化済みの状態を copy()、zstd はコンテキストをプールして使い回す
+  （brotli には使い回す API が無いので都度作る）
+
+brotli / zstandard は任意依存。入っていなければその方式は選ばれない。
+"""
+
+import zlib
+from typing import Optional
+
+from src.config import (
+    COMPRESSION_BR_QUALITY,
+    COMPRESSION_ENCODINGS,
+    COMPRESSION_GZIP_LEVEL,
+    COMPRESSION_MIN_SIZE,
+    COMPRESSION_ZSTD_LEVEL,
+)
+
+try:
+    import brotli
+except ImportError:  # 任意依存
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # 任意依存
+    zstandard = None
+
+COMPRESSIBLE_TYPES = (
+    b"application/json",
+    b"application/x-ndjson",
+    b"application/javascript",
+    b"image/svg+xml",
+    b"text/",
+)
+# プールしておく zstd コンテキストの上限（同時に圧縮中のレスポンス数を超えた分は都度作って捨てる）
+ZSTD_POOL_SIZE = 32
+
+
+class GzipCodec:
+    name = "gzip"
+
+    def __init__(self, level: int):
+        self.level = level
+        # wbits=31 で gzip 形式。初期化済みの状態を copy() して使う（deflateInit とバッファ確保を省く）
+        self._template = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        c = self._template.copy()
+        return c.compress(data) + c.flush()
+
+    def stream(self) -> "_GzipStream":
+        return _GzipStream(self._template.copy())
+
+
+class _GzipStream:
+    def __init__(self, c):
+        self._c = c
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._c.flush()
+
+
+class BrotliCodec:
+    name = "br"
+
+    def __init__(self, quality: int):
+        self.quality = quality
+
+    def compress(self, data: bytes) -> bytes:
+        return brotli.compress(data, quality=self.quality)
+
+    def stream(self) -> "_BrotliStream":
+        return _BrotliStream(brotli.Compressor(quality=self.quality))
+
+
+class _BrotliStream:
+    def __init__(self, c):
+        self._c = c
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.process(data) + self._c.flush()
+
+    def finish(self) -> bytes:
+        return self._c.finish()
+
+
+class ZstdCodec:
+    name = "zstd"
+
+    def __init__(self, level: int):
+        self.level = level
+        self._pool: list = []
+
+    def _acquire(self):
+        return self._pool.pop() if self._pool else zstandard.ZstdCompressor(level=self.level)
+
+    def _release(self, cctx) -> None:
+        if len(self._pool) < ZSTD_POOL_SIZE:
+            self._pool.append(cctx)
+
+    def compress(self, data: bytes) -> bytes:
+        cctx = self._acquire()
+        try:
+            return cctx.compress(data)
+        finally:
+            self._release(cctx)
+
+    def stream(self) -> "_ZstdStream":
+        return _ZstdStream(self)
+
+
+class _ZstdStream:
+    def __init__(self, codec: ZstdCodec):
+        self._codec = codec
+        # コンテキストは1本のストリームが使い終わるまで占有する（途中で切断されたものはプールに戻さない）
+        self._cctx = codec._acquire()
+        self._c = self._cctx.compressobj()
+
+    def chunk(self, data: bytes) -> bytes:
+        return self._c.compress(data) + self._c.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        data = self._c.flush()
+        self._codec._release(self._cctx)
+        return data
+
+
+def available_codecs(
+    encodings: list[str] = COMPRESSION_ENCODINGS,
+    gzip_level: int = COMPRESSION_GZIP_LEVEL,
+    br_quality: int = COMPRESSION_BR_QUALITY,
+    zstd_level: int = COMPRESSION_ZSTD_LEVEL,
+) -> list:
+    """サーバー側の優先順に、使える圧縮方式を並べる"""
+    codecs = []
+    for name in encodings:
+        if name == "zstd" and zstandard is not None:
+            codecs.append(ZstdCodec(zstd_level))
+        elif name == "br" and brotli is not None:
+            codecs.append(BrotliCodec(br_quality))
+        elif name == "gzip":
+            codecs.append(GzipCodec(gzip_level))
+    return codecs
+
+
+def negotiate(accept_encoding: str, codecs: list):
+    """Accept-Encoding の q 値が最も高いもの（同点ならサーバー側の優先順）。無ければ None"""
+    weights: dict[str, float] = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip()] = q
+    best, best_q = None, 0.0
+    for codec in codecs:
+        q = weights.get(codec.name, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+class CompressionMiddleware:
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, codecs: Optional[list] = None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.codecs = available_codecs() if codecs is None else codecs
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        accept = dict(scope["headers"]).get(b"accept-encoding")
+        codec = negotiate(accept.decode("latin-1"), self.codecs) if accept else None
+        if codec is None:
+            return await self.app(scope, receive, send)
+        await self.app(scope, receive, _CompressingSend(send, codec, self.minimum_size))
+
+
+class _CompressingSend:
+    """http.response.start を本文の最初の1通まで止めておき、圧縮するかを決めてから送る"""
+
+    def __init__(self, send, codec, minimum_size: int):
+        self.send = send
+        self.codec = codec
+        self.minimum_size = minimum_size
+        self.start: Optional[dict] = None
+        self.passthrough = False
+        self.stream = None
+
+    async def __call__(self, message):
+        if self.passthrough:
+            return await self.send(message)
+
+        if message["type"] == "http.response.start":
+            if not _compressible(message):
+                self.passthrough = True
+                return await self.send(message)
+            self.start = message
+            return
+
+        if message["type"] != "http.response.body":
+            return await self.send(message)
+
+        body = message.get("body", b"")
+        more = message.get("more_body", False)
+
+        if self.stream is not None:
+            data = self.stream.chunk(body) if body else b""
+            if not more:
+                data += self.stream.finish()
+            if data or not more:
+                await self.send({"type": "http.response.body", "body": data, "more_body": more})
+            return
+
+        headers = [(k, v) for k, v in self.start.get("headers", []) if k.lower() != b"vary"]
+        headers.append((b"vary", _vary(self.start.get("headers", []))))
+        length = next((v for k, v in headers if k.lower() == b"content-length"), None)
+        size = len(body) if not more else int(length) if length is not None else None
+
+        if size is not None and size < self.minimum_size:
+            self.passthrough = True
+            await self.send({**self.start, "headers": headers})
+            return await self.send(message)
+
+        headers = [(k, v) for k, v in headers if k.lower() != b"content-length"]
+        headers.append((b"content-encoding", self.codec.name.encode()))
+        if not more:
+            data = self.codec.compress(body)
+            headers.append((b"content-length", str(len(data)).encode()))
+            await self.send({**self.start, "headers": headers})
+            return await self.send({"type": "http.response.body", "body": data, "more_body": False})
+
+        # ストリーミング: 長さは分からないので Content-Length を外し、チャンクごとに送る
+        self.stream = self.codec.stream()
+        await self.send({**self.start, "headers": headers})
+        await self.send({"type": "http.response.body", "body": self.stream.chunk(body), "more_body": True})
+
+
+def _compressible(start: dict) -> bool:
+    if start["status"] < 200 or start["status"] in (204, 304):
+        return False
+    content_type = b""
+    for key, value in start.get("headers", []):
+        key = key.lower()
+        if key == b"content-encoding":
+            return False
+        if key == b"content-type":
+            content_type = value.lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+def _vary(headers: list) -> bytes:
+    values = [v for k, v in headers if k.lower() == b"vary"]
+    if any(b"accept-encoding" in v.lower() or v.strip() == b"*" for v in values):
+        return b", ".join(values)
+    return b", ".join(values + [b"Accept-Encoding"])
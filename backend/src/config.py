@@ -15,9 +15,102 @@ AUTH_PROVIDER = os.getenv("AUTH_PROVIDER", "supabase")
 # 各プロバイダ個別の秘密鍵や設定も追加
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET", None)
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID", None)
+# 必須設定の確認は各プロバイダ（src/auth_providers）の読み込み時＝起動時に行う
 
-# 例: どちらも存在しない場合はエラー出すなど、ここで制御できる
-if AUTH_PROVIDER == "supabase" and not SUPABASE_JWT_SECRET:
-    raise RuntimeError("SUPABASE_JWT_SECRET is required for Supabase auth")
-if AUTH_PROVIDER == "firebase" and not FIREBASE_PROJECT_ID:
-    raise RuntimeError("FIREBASE_PROJECT_ID is required for Firebase auth")
+# リポジトリの実装（mongo or memory）。memory はプロセス内だけで完結する（テスト・ベンチマーク用）
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "mongo")
+
+# 台帳エクスポート: Motor カーソルの batch_size（= 1チャンクあたりのレコード数）
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# point_records のアーカイブ（hot → cold）。どちらも未設定なら無効
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS")) if os.getenv("ARCHIVE_AFTER_DAYS") else None
+ARCHIVE_KEEP_RECENT = int(os.getenv("ARCHIVE_KEEP_RECENT")) if os.getenv("ARCHIVE_KEEP_RECENT") else None
+ARCHIVE_BUCKET_SIZE = int(os.getenv("ARCHIVE_BUCKET_SIZE", "200"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+
+# レプリカセットでの読み取り振り分け（単体 mongod では無効のままにする）
+MONGO_READ_ROUTING = os.getenv("MONGO_READ_ROUTING", "0") == "1"
+# secondaryPreferred 時の許容遅延（ドライバの下限は 90 秒）
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "90"))
+# 個別上書き: "PointRecordRepository.history=primary,RoomRepository.get_by_id=secondaryPreferred"
+MONGO_READ_ROUTES = os.getenv("MONGO_READ_ROUTES", "")
+
+# Redis 接続形態: standalone / cluster / sentinel
+REDIS_MODE = os.getenv("REDIS_MODE", "standalone")
+# sentinel 用: "host1:26379,host2:26379" とマスター名
+REDIS_SENTINELS = os.getenv("REDIS_SENTINELS", "")
+REDIS_SENTINEL_MASTER = os.getenv("REDIS_SENTINEL_MASTER", "mymaster")
+# キー書式: legacy（従来書式）/ cluster（{room_id} ハッシュタグ付き）。
+# 既存デプロイのキー名を変えないよう既定は legacy。REDIS_MODE=cluster のときだけ cluster が既定
+REDIS_KEY_SCHEMA = os.getenv("REDIS_KEY_SCHEMA", "cluster" if REDIS_MODE == "cluster" else "legacy")
+
+# 同一引数の並行読み取りを1クエリにまとめる（single-flight）。完了後に結果を保持するミリ秒（0 で保持しない）
+SINGLE_FLIGHT_CACHE_MS = int(os.getenv("SINGLE_FLIGHT_CACHE_MS", "0"))
+
+# プロフィールキャッシュ: L1（プロセス内 LRU）の件数と TTL、L2（Redis hash）の TTL（秒）
+PROFILE_L1_SIZE = int(os.getenv("PROFILE_L1_SIZE", "10000"))
+PROFILE_L1_TTL = int(os.getenv("PROFILE_L1_TTL", "60"))
+PROFILE_L2_TTL = int(os.getenv("PROFILE_L2_TTL", "3600"))
+# 無効化のあと L2 への書き戻しを止めておく秒数（無効化の前に Mongo から読んだ古い値で上書きさせない）
+PROFILE_TOMBSTONE_TTL = int(os.getenv("PROFILE_TOMBSTONE_TTL", "10"))
+
+# Idempotency-Key: 完了レスポンスの保持期間 / 処理中ロックの期限 / 重複リクエストが処理完了を待つ上限（秒）
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = int(os.getenv("IDEMPOTENCY_LOCK_TTL", "30"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "5"))
+
+# ID 採番: 連番を鍵付き置換で並べ替える際の鍵と、プロセスが Mongo から一度に予約する連番の数
+# （ID_CHECKPOINT_STEP は旧名）
+ID_ALLOCATOR_SECRET = os.getenv("ID_ALLOCATOR_SECRET", JWT_SECRET)
+ID_BLOCK_SIZE = int(os.getenv("ID_BLOCK_SIZE", os.getenv("ID_CHECKPOINT_STEP", "1000")))
+
+# イベントループ遅延の監視: この時間以上ループが止まったら塞いでいるスタックをログに出す（0 で無効）
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "200"))
+LOOP_LAG_INTERVAL_MS = int(os.getenv("LOOP_LAG_INTERVAL_MS", "50"))
+
+# リクエスト単位のサンプリングプロファイル。X-Profile ヘッダの署名鍵（未設定なら署名ヘッダは無効）
+PROFILING_SECRET = os.getenv("PROFILING_SECRET", None)
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+
+# ルームを開いていないメンバーへの room_updated 通知の最短間隔（秒）。間のイベントは1通にまとめる
+ROOM_UPDATE_NOTICE_INTERVAL = float(os.getenv("ROOM_UPDATE_NOTICE_INTERVAL", "5"))
+# WebSocket の配送に使うルームのメンバー一覧をワーカー内で使い回す秒数（参加・退会では即座に捨てる）
+ROOM_MEMBER_CACHE_TTL = float(os.getenv("ROOM_MEMBER_CACHE_TTL", "30"))
+
+# 障害時に待ち続けないためのドライバのタイムアウト（ミリ秒）
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "10000"))
+REDIS_SOCKET_TIMEOUT_MS = int(os.getenv("REDIS_SOCKET_TIMEOUT_MS", "1000"))
+# サーキットブレーカー: 連続失敗でオープン / オープンしている秒数 / ホットパスの1操作の期限（ミリ秒）
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "10"))
+BREAKER_DEADLINE_MS = int(os.getenv("BREAKER_DEADLINE_MS", "2000"))
+# 劣化モードで返す直近の読み取り結果の保持件数（種類ごと）
+STALE_CACHE_SIZE = int(os.getenv("STALE_CACHE_SIZE", "10000"))
+
+# ジョブキュー（Redis Streams）: このプロセスのコンシューマー数（0 なら API プロセスでは処理しない）
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "4"))
+# 失敗したジョブの試行上限（超えたら jobs:dead へ）と、再試行までの初回待ち（ミリ秒、回ごとに倍）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_RETRY_DELAY_MS = int(os.getenv("JOB_RETRY_DELAY_MS", "2000"))
+JOB_STREAM_MAXLEN = int(os.getenv("JOB_STREAM_MAXLEN", "100000"))
+# 最古の未配送ジョブの待ちがこれを超えたら警告を出す（ミリ秒）
+JOB_LAG_WARN_MS = int(os.getenv("JOB_LAG_WARN_MS", "5000"))
+
+# POST /api/batch で1回に送れるサブリクエスト数
+BATCH_MAX_REQUESTS = int(os.getenv("BATCH_MAX_REQUESTS", "20"))
+
+# レスポンス圧縮: これ未満（バイト）は圧縮しない / サーバー側の優先順（入っていない任意依存は飛ばす）/ 各方式のレベル
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_ENCODINGS = [e.strip() for e in os.getenv("COMPRESSION_ENCODINGS", "zstd,br,gzip").split(",") if e.strip()]
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BR_QUALITY = int(os.getenv("COMPRESSION_BR_QUALITY", "5"))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv("COMPRESSION_ZSTD_LEVEL", "3"))
+
+# ランキング: GET /api/leaderboard の上位件数・前後人数の上限 / 整合ジョブの間隔（秒、0 で止める）/
+# 整合時に2回読む間隔（ミリ秒。この間に届く ZINCRBY を取り違えて二重に足さないため）
+LEADERBOARD_MAX_LIMIT = int(os.getenv("LEADERBOARD_MAX_LIMIT", "100"))
+LEADERBOARD_RECONCILE_SECONDS = int(os.getenv("LEADERBOARD_RECONCILE_SECONDS", "3600"))
+LEADERBOARD_SETTLE_MS = int(os.getenv("LEADERBOARD_SETTLE_MS", "2000"))
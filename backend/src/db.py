@@ -1,20 +1,206 @@
 # src/db.py
 
+import base64
 import os
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+import bson
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 import redis.asyncio as redis  # redis-py公式の非同期クライアント
 
-from .config import MONGODB_URI, MONGO_DB_NAME, REDIS_URI
+from .config import (
+    MONGODB_URI,
+    MONGO_DB_NAME,
+    REDIS_URI,
+    MONGO_READ_ROUTING,
+    MONGO_MAX_STALENESS_SECONDS,
+    MONGO_READ_ROUTES,
+    REDIS_MODE,
+    REDIS_SENTINELS,
+    REDIS_SENTINEL_MASTER,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_SOCKET_TIMEOUT_MS,
+    REDIS_SOCKET_TIMEOUT_MS,
+)
+from .redis_keys import keys
+from .resilience import OPEN, BackendUnavailable, mongo_breaker, redis_breaker
+
+# クライアントは import 時ではなく起動時（connect）に作る。
+# 起動前に get_db() / get_redis() が呼ばれた場合（スクリプトなど）はその場で作る
+_mongo_client: Optional[AsyncIOMotorClient] = None
+_db = None
+_redis_client = None
+
+
+def connect() -> None:
+    global _mongo_client, _db, _redis_client
+    if _mongo_client is None:
+        # ドライバ既定（サーバー選択 30 秒・ソケット無期限）だと障害時に待ちが積み上がる
+        _mongo_client = AsyncIOMotorClient(
+            MONGODB_URI,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            connectTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+        )
+        _db = _mongo_client[MONGO_DB_NAME]
+    if _redis_client is None:
+        _redis_client = _make_redis_client()
 
-# MongoDB
-_mongo_client = AsyncIOMotorClient(MONGODB_URI)
-db = _mongo_client[MONGO_DB_NAME]
 
-# Redis
-redis_client = redis.from_url(REDIS_URI, decode_responses=True)
+async def close() -> None:
+    global _mongo_client, _db, _redis_client
+    if _mongo_client is not None:
+        _mongo_client.close()
+    if _redis_client is not None:
+        # redis-py 5 で close() は aclose() に改名された
+        await (getattr(_redis_client, "aclose", None) or _redis_client.close)()
+    _mongo_client = _db = _redis_client = None
+
+
+def _make_redis_client():
+    timeouts = {
+        "socket_timeout": REDIS_SOCKET_TIMEOUT_MS / 1000,
+        "socket_connect_timeout": REDIS_SOCKET_TIMEOUT_MS / 1000,
+    }
+    if REDIS_MODE == "cluster":
+        from redis.asyncio.cluster import RedisCluster
+        return RedisCluster.from_url(REDIS_URI, decode_responses=True, **timeouts)
+    if REDIS_MODE == "sentinel":
+        from redis.asyncio.sentinel import Sentinel
+        nodes = []
+        for item in filter(None, (s.strip() for s in REDIS_SENTINELS.split(","))):
+            host, _, port = item.partition(":")
+            nodes.append((host, int(port or 26379)))
+        if not nodes:
+            raise RuntimeError("REDIS_SENTINELS is required for REDIS_MODE=sentinel")
+        return Sentinel(nodes, decode_responses=True, **timeouts).master_for(
+            REDIS_SENTINEL_MASTER, decode_responses=True, **timeouts
+        )
+    if REDIS_MODE != "standalone":
+        raise RuntimeError(f"Unknown REDIS_MODE: {REDIS_MODE}")
+    return redis.from_url(REDIS_URI, decode_responses=True, **timeouts)
+
 
 def get_db():
-    return db
+    if _db is None:
+        connect()
+    return _db
 
 def get_redis():
-    return redis_client
+    if _redis_client is None:
+        connect()
+    return _redis_client
+
+
+# ─── 読み取りの振り分け ───
+
+# 履歴・統計・一覧・エクスポート系はデフォルトで secondaryPreferred
+SECONDARY_READS = {
+    "UserRepository.list_all",
+    "RoomRepository.list_all",
+    "RoomRepository.list_rooms_for_user",
+    "PointRecordRepository.history",
+    "PointRecordRepository.history_by_uid",
+    "PointRecordRepository.iter_records",
+    "PointRecordRepository.sum_by_uid",
+    "PointRecordRepository.iter_running_totals",
+    "SettlementRepository.history",
+    "SettlementRepository.history_by_uid",
+    "SettlementRepository.iter_records",
+}
+
+_READ_MODES = {
+    "primary": lambda: Primary(),
+    "primaryPreferred": lambda: PrimaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+    "secondary": lambda: Secondary(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+    "secondaryPreferred": lambda: SecondaryPreferred(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+    "nearest": lambda: Nearest(max_staleness=MONGO_MAX_STALENESS_SECONDS),
+}
+
+
+def _parse_routes(spec: str) -> dict[str, str]:
+    routes = {name: "secondaryPreferred" for name in SECONDARY_READS}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        name, _, mode = item.partition("=")
+        if mode not in _READ_MODES:
+            raise RuntimeError(f"Unknown read preference in MONGO_READ_ROUTES: {item}")
+        routes[name.strip()] = mode
+    return routes
+
+
+_read_routes = _parse_routes(MONGO_READ_ROUTES) if MONGO_READ_ROUTING else {}
+_read_prefs = {name: _READ_MODES[mode]() for name, mode in _read_routes.items() if mode != "primary"}
+
+
+def reader(collection, route: str):
+    """route（"Repository.method"）に設定された read preference を付けたコレクションを返す"""
+    pref = _read_prefs.get(route)
+    return collection if pref is None else collection.with_options(read_preference=pref)
+
+
+# ─── 因果一貫セッション ───
+
+_session_var: ContextVar = ContextVar("mongo_session", default=None)
+
+
+def current_session():
+    """実行中のフローの因果一貫セッション（なければ None）"""
+    return _session_var.get()
+
+
+async def remember_causal_mark(uid: str, session) -> None:
+    """
+    セッションの operationTime / clusterTime を uid ごとに保存する。
+    次のリクエスト（別ワーカーでも）はここから進めるので、自分の書き込みが必ず見える。
+    """
+    if session is None or session.operation_time is None or redis_breaker.state == OPEN:
+        return
+    raw = bson.encode({"c": session.cluster_time, "o": session.operation_time})
+    try:
+        await redis_breaker.call(
+            get_redis().set,
+            keys.causal_mark(uid),
+            base64.b64encode(raw).decode(),
+            ex=MONGO_MAX_STALENESS_SECONDS * 2,
+        )
+    except BackendUnavailable:
+        # 印が残らなくても次の読み取りが古い可能性があるだけで済む
+        pass
+
+
+async def _causal_mark(uid: str) -> Optional[str]:
+    if redis_breaker.state == OPEN:
+        return None
+    try:
+        return await redis_breaker.call(get_redis().get, keys.causal_mark(uid))
+    except BackendUnavailable:
+        return None
+
+
+@asynccontextmanager
+async def causal_session(uid: Optional[str] = None):
+    """
+    causal_consistency=True のセッションを開き、current_session() から参照できるようにする。
+    uid を渡すとその利用者の直近の書き込み時刻まで進めてから読む。
+    """
+    if not MONGO_READ_ROUTING or mongo_breaker.state == OPEN:
+        # 単体構成では全て primary なので何もしない（障害中はセッションを張りに行かない）
+        yield None
+        return
+
+    get_db()
+    async with await _mongo_client.start_session(causal_consistency=True) as session:
+        if uid and (raw := await _causal_mark(uid)):
+            mark = bson.decode(base64.b64decode(raw))
+            session.advance_cluster_time(mark["c"])
+            session.advance_operation_time(mark["o"])
+        token = _session_var.set(session)
+        try:
+            yield session
+        finally:
+            _session_var.reset(token)
+            if uid:
+                await remember_causal_mark(uid, session)
@@ -0,0 +1,314 @@
+# src/events.py
+
+"""
+WebSocket で送受信するイベントの型定義。
+
+各イベントは整数コードと、フィールドの並び順を持つ。
+- json（既定）: 従来どおり {"type": ..., <フィールド>...} の JSON テキスト
+- msgpack（サブプロトコル satopon.msgpack.v1）: [code, 値1, 値2, ...] の配列。
+  キー名を毎フレーム送らない。並び順は GET /ws/schema で取得できる
+
+検証は生成時に1回だけ行い、エンコード結果はプロトコルごとにインスタンスへキャッシュする
+（ブロードキャストでは受信者数によらず1回だけエンコードされる）。
+"""
+
+import json
+from typing import Any, ClassVar, Dict, List, Optional
+
+from pydantic import BaseModel, PrivateAttr
+
+try:
+    import msgpack
+except ImportError:  # 任意依存。無ければ JSON のみ
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+MSGPACK_SUBPROTOCOL = "satopon.msgpack.v1"
+
+# broadcast_event_to_room の宛先: ルームを開いているメンバーだけ / 全メンバー
+VIEWERS = "viewers"
+MEMBERS = "members"
+
+
+class Event(BaseModel):
+    code: ClassVar[int]
+    type: ClassVar[str]
+    audience: ClassVar[str] = VIEWERS
+
+    _encoded: dict = PrivateAttr(default_factory=dict)
+
+    def to_dict(self) -> dict:
+        # 明示的に渡したフィールドだけ（None を渡したものは null のまま残す）
+        return {"type": self.type, **_dump(self, exclude_unset=True)}
+
+    def to_array(self) -> list:
+        values = _dump(self)
+        return [self.code, *(values[name] for name in _field_names(type(self)))]
+
+    def encode(self, protocol: str = JSON):
+        if (cached := self._encoded.get(protocol)) is not None:
+            return cached
+        if protocol == MSGPACK:
+            data = msgpack.packb(self.to_array(), default=_default)
+        else:
+            data = json.dumps(self.to_dict(), separators=(",", ":"), ensure_ascii=False, default=_default)
+        self._encoded[protocol] = data
+        return data
+
+
+def _dump(model: BaseModel, **kwargs) -> dict:
+    if hasattr(model, "model_dump"):
+        return model.model_dump(**kwargs)
+    return model.dict(**kwargs)
+
+
+def _field_names(cls) -> List[str]:
+    fields = getattr(cls, "model_fields", None) or cls.__fields__
+    return list(fields)
+
+
+def _default(value):
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+# ─── サーバー → クライアント ───
+
+class Pong(Event):
+    code: ClassVar[int] = 1
+    type: ClassVar[str] = "pong"
+
+
+class UserEntered(Event):
+    code: ClassVar[int] = 2
+    type: ClassVar[str] = "user_entered"
+    room_id: str
+    uid: str
+
+
+class UserLeft(Event):
+    code: ClassVar[int] = 3
+    type: ClassVar[str] = "user_left"
+    room_id: str
+    uid: str
+
+
+class JoinRequest(Event):
+    code: ClassVar[int] = 4
+    type: ClassVar[str] = "join_request"
+    audience: ClassVar[str] = MEMBERS
+    room_id: str
+    applicant_uid: str
+
+
+class JoinApproved(Event):
+    """単体承認は applicant_uid（本人宛ては省略）、一括承認は applicant_uids"""
+    code: ClassVar[int] = 5
+    type: ClassVar[str] = "join_approved"
+    audience: ClassVar[str] = MEMBERS
+    room_id: str
+    applicant_uid: Optional[str] = None
+    applicant_uids: Optional[List[str]] = None
+
+
+class JoinRejected(Event):
+    code: ClassVar[int] = 6
+    type: ClassVar[str] = "join_rejected"
+    audience: ClassVar[str] = MEMBERS
+    room_id: str
+    applicant_uid: Optional[str] = None
+    applicant_uids: Optional[List[str]] = None
+
+
+class JoinRequestCancelled(Event):
+    code: ClassVar[int] = 7
+    type: ClassVar[str] = "join_request_cancelled"
+    audience: ClassVar[str] = MEMBERS
+    room_id: str
+    user_id: str
+
+
+class PointRoundStarted(Event):
+    code: ClassVar[int] = 8
+    type: ClassVar[str] = "point_round_started"
+    room_id: str
+    round_id: str
+
+
+class PointSubmitted(Event):
+    code: ClassVar[int] = 9
+    type: ClassVar[str] = "point_submitted"
+    room_id: str
+    round_id: str
+    uid: str
+
+
+class PointRoundCancelled(Event):
+    code: ClassVar[int] = 10
+    type: ClassVar[str] = "point_round_cancelled"
+    room_id: str
+    round_id: Optional[str] = None
+    reason: str
+
+
+class PointFinalTable(Event):
+    code: ClassVar[int] = 11
+    type: ClassVar[str] = "point_final_table"
+    room_id: str
+    round_id: str
+    table: Dict[str, int]
+
+
+class PointApproved(Event):
+    code: ClassVar[int] = 12
+    type: ClassVar[str] = "point_approved"
+    room_id: str
+    round_id: str
+    uid: str
+
+
+class PointFullyApproved(Event):
+    code: ClassVar[int] = 13
+    type: ClassVar[str] = "point_fully_approved"
+    room_id: str
+    round_id: str
+    approved_by: List[str]
+
+
+class PointRoundStatus(Event):
+    code: ClassVar[int] = 14
+    type: ClassVar[str] = "point_round_status"
+    room_id: str
+    round_id: str
+    participants: List[str]
+    submitted: List[str]
+    sum: int
+    complete: bool
+    table: Optional[Dict[str, int]] = None
+    approvals: List[str]
+    ttl: int
+
+
+class SettleRequested(Event):
+    code: ClassVar[int] = 15
+    type: ClassVar[str] = "settle_requested"
+    room_id: str
+    from_uid: str
+    to_uid: str
+    amount: int
+
+
+class SettleCompleted(Event):
+    code: ClassVar[int] = 16
+    type: ClassVar[str] = "settle_completed"
+    room_id: str
+    from_uid: str
+    to_uid: str
+    amount: int
+
+
+class SettleRejected(Event):
+    code: ClassVar[int] = 17
+    type: ClassVar[str] = "settle_rejected"
+    room_id: str
+    from_uid: str
+    to_uid: str
+
+
+class RoomUpdated(Event):
+    """ルームを開いていないメンバー向け。間隔内にまとめたイベント数を count に入れる"""
+    code: ClassVar[int] = 18
+    type: ClassVar[str] = "room_updated"
+    room_id: str
+    count: int
+
+
+# ─── クライアント → サーバー ───
+
+class Ping(Event):
+    code: ClassVar[int] = 101
+    type: ClassVar[str] = "ping"
+
+
+class EnterRoom(Event):
+    code: ClassVar[int] = 102
+    type: ClassVar[str] = "enter_room"
+    room_id: str
+
+
+class LeaveRoom(Event):
+    code: ClassVar[int] = 103
+    type: ClassVar[str] = "leave_room"
+    room_id: str
+
+
+class CancelPointRound(Event):
+    code: ClassVar[int] = 104
+    type: ClassVar[str] = "cancel_point_round"
+    room_id: str
+
+
+EVENTS_BY_TYPE: Dict[str, type] = {cls.type: cls for cls in Event.__subclasses__()}
+EVENTS_BY_CODE: Dict[int, type] = {cls.code: cls for cls in Event.__subclasses__()}
+assert len(EVENTS_BY_CODE) == len(EVENTS_BY_TYPE), "duplicate event code"
+
+
+class RawEvent:
+    """型定義の無いイベント（移行中の dict 送信用）。msgpack ではキー付きの map で送る"""
+
+    audience = MEMBERS
+
+    def __init__(self, data: dict):
+        self.data = data
+        self._encoded: dict = {}
+
+    def encode(self, protocol: str = JSON):
+        if (cached := self._encoded.get(protocol)) is None:
+            if protocol == MSGPACK:
+                cached = msgpack.packb(self.data, default=_default)
+            else:
+                cached = json.dumps(self.data, separators=(",", ":"), ensure_ascii=False, default=_default)
+            self._encoded[protocol] = cached
+        return cached
+
+
+def as_event(event: Any):
+    if isinstance(event, (Event, RawEvent)):
+        return event
+    cls = EVENTS_BY_TYPE.get(event.get("type"))
+    if cls is None:
+        return RawEvent(event)
+    return cls(**{k: v for k, v in event.items() if k != "type"})
+
+
+def decode_client_message(data: bytes) -> Optional[dict]:
+    """msgpack の [code, ...] を従来の JSON と同じ dict 形にする"""
+    message = msgpack.unpackb(data)
+    if isinstance(message, dict):
+        return message
+    if not isinstance(message, list) or not message:
+        return None
+    cls = EVENTS_BY_CODE.get(message[0])
+    if cls is None:
+        return None
+    return {"type": cls.type, **dict(zip(_field_names(cls), message[1:]))}
+
+
+def negotiate(offered: List[str]) -> Optional[str]:
+    """クライアントが提示したサブプロトコルから採用するものを選ぶ（無ければ JSON）"""
+    if msgpack is not None and MSGPACK_SUBPROTOCOL in offered:
+        return MSGPACK_SUBPROTOCOL
+    return None
+
+
+def schema() -> dict:
+    """クライアント向けのコード表（msgpack 配列のフィールド順）"""
+    return {
+        "subprotocol": MSGPACK_SUBPROTOCOL,
+        "events": {
+            cls.code: {"type": cls.type, "fields": _field_names(cls)}
+            for cls in sorted(Event.__subclasses__(), key=lambda c: c.code)
+        },
+    }
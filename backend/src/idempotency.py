@@ -0,0 +1,111 @@
+# src/idempotency.py
+
+"""
+Idempotency-Key ヘッダ付きの更新リクエストを1回だけ実行する。
+
+1本目が処理中の間は同じキーを Redis 上でロックし、後続の重複は完了を待つ。
+完了したレスポンスは TTL 付きで保存し、以降の再送にはそのまま返す。
+キーは利用者ごとの名前空間で、同じキーを別の操作（メソッド・パス・ボディ）に
+使い回した場合は 422 にする。
+"""
+
+import asyncio
+import hashlib
+import json
+import secrets
+from typing import Any, Awaitable, Callable, Optional
+
+from fastapi import Depends, HTTPException, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from src.config import IDEMPOTENCY_LOCK_TTL, IDEMPOTENCY_TTL, IDEMPOTENCY_WAIT_SECONDS
+from src.db import get_redis
+from src.redis_keys import keys
+from src.utils import get_current_uid
+
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+POLL_INTERVAL = 0.05
+
+# 自分のロックのときだけ消す
+_RELEASE = """
+local v = redis.call('GET', KEYS[1])
+if v and cjson.decode(v)['token'] == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+class Idempotency:
+    def __init__(self, redis_client, uid: str, key: Optional[str], fingerprint: str):
+        self.redis = redis_client
+        self.uid = uid
+        self.key = key
+        self.fingerprint = fingerprint
+
+    async def run(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        fn を高々1回実行する。2xx の結果だけを保存し、
+        例外（HTTPException を含む）のときはロックを外して再送でやり直せるようにする。
+        """
+        if self.key is None:
+            return await fn()
+
+        rkey = keys.idempotency(self.uid, self.key)
+        token = secrets.token_hex(8)
+        pending = json.dumps({"state": "pending", "fp": self.fingerprint, "token": token})
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + IDEMPOTENCY_WAIT_SECONDS
+        while not await self.redis.set(rkey, pending, nx=True, ex=IDEMPOTENCY_LOCK_TTL):
+            raw = await self.redis.get(rkey)
+            if raw is None:
+                # ロックが外れた（1本目が失敗した）ので取り直す
+                continue
+            stored = json.loads(raw)
+            if stored["fp"] != self.fingerprint:
+                raise HTTPException(422, f"{HEADER} was already used for a different request")
+            if stored["state"] == "done":
+                return JSONResponse(
+                    stored["body"],
+                    status_code=stored["status"],
+                    headers={"Idempotent-Replayed": "true"},
+                )
+            if loop.time() >= deadline:
+                raise HTTPException(
+                    409,
+                    "A request with this Idempotency-Key is still in progress",
+                    headers={"Retry-After": "1"},
+                )
+            await asyncio.sleep(POLL_INTERVAL)
+
+        try:
+            result = await fn()
+        except BaseException:
+            await self.redis.eval(_RELEASE, 1, rkey, token)
+            raise
+
+        body = jsonable_encoder(result)
+        await self.redis.set(
+            rkey,
+            json.dumps({"state": "done", "fp": self.fingerprint, "status": 200, "body": body}),
+            ex=IDEMPOTENCY_TTL,
+        )
+        return body
+
+
+async def idempotency(
+    request: Request,
+    current_uid: str = Depends(get_current_uid),
+    redis=Depends(get_redis),
+) -> Idempotency:
+    key = request.headers.get(HEADER)
+    if key is not None and not (0 < len(key) <= MAX_KEY_LENGTH):
+        raise HTTPException(400, f"Invalid {HEADER}")
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.url.path.encode())
+    digest.update(await request.body())
+    return Idempotency(redis, current_uid, key, digest.hexdigest())
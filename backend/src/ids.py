@@ -0,0 +1,110 @@
+# src/ids.py
+
+"""
+ルーム ID・uid・ラウンド ID の採番。
+
+プロセスごとに Mongo（id_counters。STORAGE_BACKEND=memory ならメモリ）から連番の区間 [high - ID_BLOCK_SIZE, high) を
+$inc で予約し、その中から連番 n を払い出す。n は鍵付きの Feistel 置換（サイクルウォーク）で
+[0, 文字種^桁数) 上の別の値に1対1で写してから固定長の文字列にする。
+同じ n は必ず同じ ID、異なる n は必ず異なる ID になり、区間はプロセス間で重ならないので、
+DB に空きを問い合わせる必要がなく、同時作成でも衝突しない。
+連番は推測しにくい見た目になる（鍵を知らなければ順序は分からない）。
+
+予約は w=majority で書くので、フェイルオーバーでも払い出し済みの区間は巻き戻らない
+（再起動で使い残した区間は捨てる）。以前の Redis INCR 方式の高水位 high もそのまま引き継げる。
+旧方式のランダム ID とぶつかる可能性はユニークインデックスで検出し、呼び出し側で取り直す。
+"""
+
+import asyncio
+import hashlib
+import hmac
+import string
+
+from src.config import ID_ALLOCATOR_SECRET, ID_BLOCK_SIZE
+from src.repositories import get_storage
+
+ROOM_ALPHABET = string.ascii_uppercase + string.digits
+UID_ALPHABET = string.ascii_letters + string.digits
+ROUND_ALPHABET = string.ascii_uppercase + string.digits
+
+# 旧 ID との衝突時に取り直す回数
+MAX_ATTEMPTS = 5
+
+
+class FeistelPermutation:
+    """[0, size) 上の鍵付き全単射"""
+
+    ROUNDS = 4
+
+    def __init__(self, size: int, key: bytes):
+        self.size = size
+        self.key = key
+        self.half = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half) - 1
+
+    def _f(self, rnd: int, value: int) -> int:
+        digest = hmac.new(self.key, f"{rnd}:{value}".encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], "big") & self.mask
+
+    def _encrypt(self, x: int) -> int:
+        left, right = x >> self.half, x & self.mask
+        for rnd in range(self.ROUNDS):
+            left, right = right, left ^ self._f(rnd, right)
+        return (left << self.half) | right
+
+    def __call__(self, x: int) -> int:
+        if not (0 <= x < self.size):
+            raise ValueError("out of domain")
+        # 2^(2*half) は size の高々4倍なので、範囲内に戻るまでの反復は平均4回未満
+        y = self._encrypt(x)
+        while y >= self.size:
+            y = self._encrypt(y)
+        return y
+
+
+class IdAllocator:
+    def __init__(self, namespace: str, alphabet: str, length: int, block_size: int = ID_BLOCK_SIZE, store=None):
+        self.namespace = namespace
+        self.alphabet = alphabet
+        self.length = length
+        self.space = len(alphabet) ** length
+        self.block_size = block_size
+        # 省略時は get_storage() の id_counters を使う
+        self._store = store
+        key = hmac.new(ID_ALLOCATOR_SECRET.encode(), namespace.encode(), hashlib.sha256).digest()
+        self.permute = FeistelPermutation(self.space, key)
+        # このプロセスが予約済みの区間 [_next, _end)
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def counters(self):
+        return self._store if self._store is not None else get_storage().id_counters()
+
+    def encode(self, n: int) -> str:
+        base = len(self.alphabet)
+        chars = []
+        for _ in range(self.length):
+            n, r = divmod(n, base)
+            chars.append(self.alphabet[r])
+        return "".join(reversed(chars))
+
+    async def next(self) -> str:
+        return self.encode(self.permute(await self._next_index()))
+
+    async def _next_index(self) -> int:
+        async with self._lock:
+            if self._next >= self._end:
+                self._end = await self.counters.reserve(self.namespace, self.block_size)
+                self._next = self._end - self.block_size
+            n = self._next
+            self._next += 1
+        if n >= self.space:
+            raise RuntimeError(f"ID space exhausted for {self.namespace}")
+        return n
+
+
+room_ids = IdAllocator("room", ROOM_ALPHABET, 5)
+user_ids = IdAllocator("user", UID_ALPHABET, 8)
+round_ids = IdAllocator("round", ROUND_ALPHABET, 6)
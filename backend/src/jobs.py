@@ -0,0 +1,248 @@
+# src/jobs.py
+
+"""
+Redis Streams（コンシューマーグループ）による副作用ジョブのキュー。
+
+HTTP ハンドラは通知・集計の作り直し・キャッシュ無効化などを enqueue して即座に返し、
+各ワーカープロセス内の JOB_WORKER_CONCURRENCY 本のコンシューマーが順に処理する。
+
+- at-least-once: 処理が終わってから XACK する。落ちたコンシューマーの分は
+  未 ACK のまま残り、reclaim ループが XCLAIM で引き取ってやり直す（ハンドラは冪等に書く）
+- リトライ: 失敗したジョブは ACK せずに置き、JOB_RETRY_DELAY_MS × 2^(試行回数-1) 経ったら再実行
+- dead-letter: JOB_MAX_ATTEMPTS 回失敗したら jobs:dead に移して ACK する
+- lag: stats() で未配送の件数と最古の未配送ジョブの待ち時間（ms）を返す。
+  閾値を超えたらログにも出す（python -m src.worker stats で表示）
+- API と別にワーカーだけ動かすときは python -m src.worker work（API 側は JOB_WORKER_CONCURRENCY=0）
+
+WebSocket への送信はここに載せない（接続を持つプロセスでしか送れないので、
+ws.deliver_later が Pub/Sub で全ワーカーに流す）。ここに積むのはソケットを使わない副作用だけ。
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from typing import Awaitable, Callable, Optional
+
+from redis.exceptions import ResponseError
+
+from src.config import (
+    JOB_LAG_WARN_MS,
+    JOB_MAX_ATTEMPTS,
+    JOB_RETRY_DELAY_MS,
+    JOB_STREAM_MAXLEN,
+    JOB_WORKER_CONCURRENCY,
+    REDIS_SOCKET_TIMEOUT_MS,
+)
+from src.db import get_redis
+from src.redis_keys import keys
+from src.resilience import BackendUnavailable, redis_breaker
+
+logger = logging.getLogger(__name__)
+
+GROUP = "workers"
+# XREADGROUP の待ち（ミリ秒）。共有クライアントの socket_timeout より短くしないと、
+# 空のときに結果を待たずに TimeoutError になる
+BLOCK_MS = max(min(5000, REDIS_SOCKET_TIMEOUT_MS // 2), 100)
+
+
+class JobQueue:
+    def __init__(self, concurrency: int, max_attempts: int, retry_delay_ms: int, maxlen: int):
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay_ms = retry_delay_ms
+        self.maxlen = maxlen
+        self.handlers: dict[str, Callable[..., Awaitable]] = {}
+        self._consumer_prefix = f"{socket.gethostname()}-{os.getpid()}"
+
+    def handler(self, name: str):
+        """@jobs.handler("name") でジョブの処理関数を登録する。引数は enqueue のキーワード引数"""
+        def register(fn):
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    async def enqueue(self, name: str, **payload) -> Optional[str]:
+        if name not in self.handlers:
+            raise ValueError(f"Unknown job: {name}")
+        fields = {"name": name, "payload": json.dumps(payload, default=str)}
+        try:
+            return await redis_breaker.call(
+                get_redis().xadd, keys.jobs(), fields, maxlen=self.maxlen, approximate=True
+            )
+        except BackendUnavailable:
+            # キューに積めないときはその場で実行する（遅くはなるが副作用は失わない）
+            logger.warning("Job queue unavailable; running %s inline", name)
+            await self._run(name, payload)
+            return None
+
+    # ─── ワーカー ───
+
+    async def run(self):
+        """このプロセスのコンシューマーと reclaim ループを動かす（起動時にタスクとして走らせる）"""
+        redis_client = get_redis()
+        await self._ensure_group(redis_client)
+        consumers = [f"{self._consumer_prefix}-{i}" for i in range(self.concurrency)]
+        tasks = [asyncio.create_task(self._consume(redis_client, c)) for c in consumers]
+        tasks.append(asyncio.create_task(self._reclaim_forever(redis_client, consumers[0])))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 読み取り中のコンシューマーが止まってから消す（止まる前だと XREADGROUP が作り直す）
+            await asyncio.wait(tasks, timeout=5)
+            await self._forget_consumers(redis_client, consumers)
+
+    async def _ensure_group(self, redis_client) -> None:
+        try:
+            await redis_client.xgroup_create(keys.jobs(), GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _consume(self, redis_client, consumer: str) -> None:
+        while True:
+            try:
+                reply = await redis_client.xreadgroup(
+                    GROUP, consumer, {keys.jobs(): ">"}, count=1, block=BLOCK_MS
+                )
+                for _, messages in reply or []:
+                    for msg_id, fields in messages:
+                        await self._process(redis_client, msg_id, fields)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job consumer %s failed; retrying", consumer)
+                await asyncio.sleep(1)
+
+    async def _process(self, redis_client, msg_id: str, fields: dict) -> None:
+        name = fields.get("name")
+        try:
+            await self._run(name, json.loads(fields.get("payload") or "{}"))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # ACK しない。reclaim ループが間を空けて再実行する
+            logger.warning("Job %s (%s) failed: %r", name, msg_id, e)
+            await redis_client.hset(keys.job_errors(), msg_id, repr(e)[:500])
+            return
+        await redis_client.xack(keys.jobs(), GROUP, msg_id)
+        await redis_client.hdel(keys.job_errors(), msg_id)
+
+    async def _run(self, name: str, payload: dict) -> None:
+        fn = self.handlers.get(name)
+        if fn is None:
+            raise LookupError(f"No handler for job {name}")
+        await fn(**payload)
+
+    async def _reclaim_forever(self, redis_client, consumer: str) -> None:
+        last_report = 0.0
+        while True:
+            try:
+                await self.reclaim(redis_client, consumer)
+                if time.monotonic() - last_report >= 30:
+                    last_report = time.monotonic()
+                    stats = await self.stats(redis_client)
+                    if stats["lag_ms"] > JOB_LAG_WARN_MS:
+                        logger.warning("Job queue lag %d ms (%d undelivered, %d pending)",
+                                       stats["lag_ms"], stats["undelivered"], stats["pending"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job reclaim failed")
+            await asyncio.sleep(self.retry_delay_ms / 1000)
+
+    async def reclaim(self, redis_client, consumer: str) -> int:
+        """失敗・放置されたジョブを引き取って再実行し、上限を超えたものは dead-letter に移す"""
+        handled = 0
+        pending = await redis_client.xpending_range(keys.jobs(), GROUP, "-", "+", 100)
+        for entry in pending:
+            attempts = entry["times_delivered"]
+            backoff = self.retry_delay_ms * 2 ** (attempts - 1)
+            if entry["time_since_delivered"] < backoff:
+                continue
+            # XCLAIM は idle 時間を条件にするので、同時に引き取れるのは1つのコンシューマーだけ
+            claimed = await redis_client.xclaim(
+                keys.jobs(), GROUP, consumer, min_idle_time=backoff, message_ids=[entry["message_id"]]
+            )
+            for msg_id, fields in claimed:
+                if fields is None:
+                    # ストリームから消えていた（MAXLEN で切り詰められた）
+                    await redis_client.xack(keys.jobs(), GROUP, msg_id)
+                elif attempts >= self.max_attempts:
+                    await self._dead_letter(redis_client, msg_id, fields, attempts)
+                else:
+                    await self._process(redis_client, msg_id, fields)
+                handled += 1
+        return handled
+
+    async def _dead_letter(self, redis_client, msg_id: str, fields: dict, attempts: int) -> None:
+        error = await redis_client.hget(keys.job_errors(), msg_id)
+        await redis_client.xadd(
+            keys.jobs_dead(),
+            {**fields, "id": msg_id, "attempts": attempts, "error": error or ""},
+            maxlen=self.maxlen,
+            approximate=True,
+        )
+        await redis_client.xack(keys.jobs(), GROUP, msg_id)
+        await redis_client.hdel(keys.job_errors(), msg_id)
+        logger.error("Job %s (%s) moved to dead-letter after %d attempts: %s",
+                     fields.get("name"), msg_id, attempts, error)
+
+    async def _forget_consumers(self, redis_client, consumers: list[str]) -> None:
+        # 未 ACK が残っていないコンシューマーだけ消す（残っている分は他のプロセスが引き取る）
+        for consumer in consumers:
+            try:
+                if not await redis_client.xpending_range(
+                    keys.jobs(), GROUP, "-", "+", 1, consumername=consumer
+                ):
+                    await redis_client.xgroup_delconsumer(keys.jobs(), GROUP, consumer)
+            except Exception:
+                logger.warning("Could not remove job consumer %s", consumer)
+
+    # ─── 計測 ───
+
+    async def stats(self, redis_client=None) -> dict:
+        redis_client = redis_client or get_redis()
+        now_ms = int(time.time() * 1000)
+        group = next(
+            (g for g in await redis_client.xinfo_groups(keys.jobs()) if _str(g["name"]) == GROUP),
+            None,
+        )
+        if group is None:
+            return {"length": 0, "undelivered": 0, "pending": 0, "lag_ms": 0,
+                    "oldest_pending_ms": 0, "dead": 0}
+        # 最古の未配送ジョブ = last-delivered-id の次
+        after = await redis_client.xrange(
+            keys.jobs(), min="(" + _str(group["last-delivered-id"]), max="+", count=1
+        )
+        summary = await redis_client.xpending(keys.jobs(), GROUP)
+        undelivered = group.get("lag")
+        if undelivered is None:
+            # Redis 7 未満には lag が無い
+            undelivered = len(await redis_client.xrange(
+                keys.jobs(), min="(" + _str(group["last-delivered-id"]), max="+", count=10000
+            ))
+        return {
+            "length": await redis_client.xlen(keys.jobs()),
+            "undelivered": undelivered,
+            "pending": group["pending"],
+            "lag_ms": now_ms - _id_ms(after[0][0]) if after else 0,
+            "oldest_pending_ms": now_ms - _id_ms(summary["min"]) if summary.get("min") else 0,
+            "dead": await redis_client.xlen(keys.jobs_dead()),
+        }
+
+
+def _str(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _id_ms(msg_id) -> int:
+    return int(_str(msg_id).split("-")[0])
+
+
+jobs = JobQueue(JOB_WORKER_CONCURRENCY, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY_MS, JOB_STREAM_MAXLEN)
+
@@ -1,17 +1,40 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from src.api import user, room, misc
-from .config import MONGODB_URI, MONGO_DB_NAME
-from src.db import get_db
+from src.api import user, room, misc, batch, leaderboard
+from src.auth_providers import get_provider
+from src.db import connect, close, get_redis
 import os
 from src import ws
+from src.repositories import get_storage
+from src.services.archive_service import ArchiveService
+from src.services.profile_service import listen_invalidations
+from src.services.leaderboard_service import schedule_reconcile
+from src.profiling import ProfilingMiddleware, lag_monitor, profiler
+from src.resilience import BACKEND_ERRORS, DegradedModeMiddleware, backend_error_handler
+from src.compression import CompressionMiddleware
+from src.jobs import jobs
+from src.config import (
+    ARCHIVE_AFTER_DAYS,
+    ARCHIVE_KEEP_RECENT,
+    ARCHIVE_BUCKET_SIZE,
+    ARCHIVE_INTERVAL_SECONDS,
+    LOOP_LAG_THRESHOLD_MS,
+    JOB_WORKER_CONCURRENCY,
+    LEADERBOARD_RECONCILE_SECONDS,
+)
+import asyncio
+import logging
 
+logger = logging.getLogger(__name__)
 
       #allow_origins=["http://localhost","http://localhost:3000"],
 # FastAPI app設定など
 app = FastAPI()
 
+# Mongo / Redis 障害時: 書き込みは即 503、読み取りは直近のキャッシュ（X-Degraded）。
+# 503 にも CORS ヘッダが付くよう CORS より内側に置く
+app.add_middleware(DegradedModeMiddleware)
+
 # CORS
 app.add_middleware(
       CORSMiddleware,
@@ -19,12 +42,116 @@ app.add_middleware(
       allow_credentials=True,
       allow_methods=["*"],
       allow_headers=["*"],
+      expose_headers=["X-Degraded", "Age", "Retry-After"],
 )
+# 履歴・一覧の JSON とエクスポートを圧縮する（プロファイルには圧縮の時間も含める）
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ProfilingMiddleware)
+for error in BACKEND_ERRORS:
+    app.add_exception_handler(error, backend_error_handler)
 
 app.include_router(user.router, prefix="/api", tags=["user"])
 app.include_router(room.router, prefix="/api", tags=["room"])
 app.include_router(misc.router, prefix="/api", tags=["misc"])
+app.include_router(batch.router, prefix="/api", tags=["batch"])
+app.include_router(leaderboard.router, prefix="/api", tags=["leaderboard"])
 app.include_router(ws.router)
 
+
+@app.on_event("startup")
+async def connect_clients():
+    # 設定の確認と認証プロバイダの読み込み・DB クライアントの生成は import 時ではなくここで行う
+    get_provider()
+    connect()
+
+
+@app.on_event("startup")
+async def ensure_indexes():
+    storage = get_storage()
+    await storage.points().ensure_indexes()
+    await storage.settlements().ensure_indexes()
+    await storage.rooms().ensure_indexes()
+    await storage.users().ensure_indexes()
+
+
+async def _migrate_memberships():
+    # 途中で落ちたら（Mongo の障害など）間を置いてやり直す。終わるまで利用者単位の確認が続く
+    while True:
+        try:
+            await get_storage().rooms().members.migrate_all()
+            return
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Membership migration failed; retrying")
+            await asyncio.sleep(30)
+
+
+@app.on_event("startup")
+async def start_membership_migration():
+    # rooms の埋め込み配列 → room_members（未移行のルームは触れた時点でも移す）
+    app.state.membership_migration_task = asyncio.create_task(_migrate_memberships())
+
+
+@app.on_event("startup")
+async def start_archiver():
+    archiver = ArchiveService(
+        get_storage().points(),
+        get_redis(),
+        after_days=ARCHIVE_AFTER_DAYS,
+        keep_recent=ARCHIVE_KEEP_RECENT,
+        bucket_size=ARCHIVE_BUCKET_SIZE,
+        interval=ARCHIVE_INTERVAL_SECONDS,
+    )
+    if archiver.enabled:
+        app.state.archiver_task = asyncio.create_task(archiver.run_forever())
+
+
+@app.on_event("startup")
+async def start_profile_invalidation_listener():
+    app.state.profile_listener_task = asyncio.create_task(listen_invalidations(get_redis()))
+
+
+@app.on_event("startup")
+async def start_ws_delivery_listener():
+    # 他ワーカーの HTTP ハンドラが出したイベントを、このプロセスの WebSocket 接続に配る
+    app.state.ws_delivery_task = asyncio.create_task(ws.listen_deliveries(get_redis()))
+
+
+@app.on_event("startup")
+async def start_diagnostics():
+    profiler.install(asyncio.get_running_loop())
+    app.state.profiling_toggle_task = asyncio.create_task(profiler.watch_toggle(get_redis()))
+    if LOOP_LAG_THRESHOLD_MS > 0:
+        app.state.lag_monitor_task = asyncio.create_task(lag_monitor.run())
+
+
+@app.on_event("startup")
+async def start_job_worker():
+    # 通知・集計・キャッシュ無効化のジョブを処理する（0 なら別プロセスのワーカーに任せる）
+    if JOB_WORKER_CONCURRENCY > 0:
+        app.state.job_worker_task = asyncio.create_task(jobs.run())
+
+
+@app.on_event("startup")
+async def start_leaderboard_reconciler():
+    # ZINCRBY が届かなかった分などのずれを定期的に直す（ジョブとして積むのでワーカー側で走る）
+    if LEADERBOARD_RECONCILE_SECONDS > 0:
+        app.state.leaderboard_task = asyncio.create_task(
+            schedule_reconcile(get_redis(), LEADERBOARD_RECONCILE_SECONDS)
+        )
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for name in ("membership_migration_task", "archiver_task", "profile_listener_task", "ws_delivery_task", "profiling_toggle_task", "lag_monitor_task", "job_worker_task", "leaderboard_task"):
+        if task := getattr(app.state, name, None):
+            task.cancel()
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await close()
+
 # WebSocketやイベントも後述
 
@@ -29,9 +29,18 @@ class RoomModel(BaseModel):
     created_by: str
     created_at: datetime
     is_archived: bool = False
+    # 旧形式（埋め込み配列）。現在は room_members に移行済み
     members: List[MemberObj] = []
     pending_members: List[PendingMemberObj] = [] 
 
+class RoomMemberModel(BaseModel):
+    room_id: str
+    uid: str
+    state: str                 # "pending" | "member"
+    requested_at: Optional[datetime] = None
+    joined_at: Optional[datetime] = None
+    updated_at: datetime
+
 # --- PointRecord ---
 class PointObj(BaseModel):
     uid: str
@@ -0,0 +1,335 @@
+# src/profiling.py
+
+"""
+本番で「なんとなく遅い」を調べるための計測。
+
+- LoopLagMonitor: イベントループが閾値以上止まったら、別スレッドからループスレッドの
+  スタックを取ってログに出す（async の中に紛れた同期呼び出しを特定する）。
+- TaskProfiler: 指定したリクエスト（と、そこから作られたタスク）だけをサンプリングし、
+  CPU 上のスタックに加えて await 中のコルーチンチェーンも数えて flame graph に保存する。
+  有効化は署名付き X-Profile ヘッダ（/ws は profile クエリ）か、Redis の profiling:until。
+"""
+
+import asyncio
+import hashlib
+import hmac
+import html
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Optional
+
+from src.config import (
+    LOOP_LAG_INTERVAL_MS,
+    LOOP_LAG_THRESHOLD_MS,
+    PROFILE_DIR,
+    PROFILE_SAMPLE_INTERVAL_MS,
+    PROFILING_SECRET,
+)
+from src.redis_keys import keys
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+# 署名の有効期限の上限（秒）
+MAX_SIGNATURE_TTL = 3600
+
+
+# ─── イベントループ遅延 ───
+
+class LoopLagMonitor:
+    def __init__(self, threshold_ms: int, interval_ms: int):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval_ms / 1000
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._reported_beat = None
+        self._loop_tid = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        self._loop_tid = threading.get_ident()
+        self._beat = time.monotonic()
+        watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                self._beat = time.monotonic()
+                await asyncio.sleep(self.interval)
+                lag = time.monotonic() - self._beat - self.interval
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        # ループが止まっている最中にスタックを取れるのは別スレッドだけ
+        while not self._stop.wait(self.threshold / 2):
+            beat = self._beat
+            stalled = time.monotonic() - beat - self.interval
+            if stalled < self.threshold or self._reported_beat == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_tid)
+            if frame is None:
+                continue
+            self._reported_beat = beat
+            logger.warning(
+                "Event loop blocked for %.0f ms:\n%s",
+                stalled * 1000,
+                "".join(traceback.format_stack(frame)),
+            )
+
+
+# ─── リクエスト単位のサンプリングプロファイル ───
+
+_current_profile: ContextVar[Optional["_Profile"]] = ContextVar("current_profile", default=None)
+
+
+class _Profile:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.now()
+        self.id = f"{self.started:%Y%m%d-%H%M%S-%f}-{re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')[:60]}"
+        self.tasks: set[asyncio.Task] = set()
+        self.samples: Counter = Counter()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _await_chain(task: asyncio.Task) -> tuple:
+    """中断中のタスクが await しているコルーチンの連鎖（外側 → 内側）"""
+    stack = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(_frame_label(frame))
+        nxt = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+        if nxt is not None and not hasattr(nxt, "cr_frame") and not hasattr(nxt, "gi_frame") and not hasattr(nxt, "ag_frame"):
+            stack.append(f"<{type(nxt).__name__}>")
+            break
+        coro = nxt
+    return tuple(stack)
+
+
+class TaskProfiler:
+    def __init__(self, interval_ms: float, out_dir: str):
+        self.interval = interval_ms / 1000
+        self.out_dir = out_dir
+        self.enabled_until = 0.0
+        self._owners: dict[asyncio.Task, _Profile] = {}
+        self._active: set[_Profile] = set()
+        self._loop = None
+        self._loop_tid = None
+        self._thread = None
+        self._wake = threading.Event()
+
+    def install(self, loop: asyncio.AbstractEventLoop) -> None:
+        """タスク生成をフックして、プロファイル中のコンテキストで作られたタスクを紐付ける"""
+        self._loop = loop
+        self._loop_tid = threading.get_ident()
+        previous = loop.get_task_factory()
+
+        def factory(loop, coro, **kwargs):
+            if previous is not None:
+                task = previous(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            if (prof := _current_profile.get()) is not None:
+                self._track(task, prof)
+            return task
+
+        loop.set_task_factory(factory)
+
+    def _track(self, task: asyncio.Task, prof: _Profile) -> None:
+        self._owners[task] = prof
+        prof.tasks.add(task)
+        task.add_done_callback(self._untrack)
+
+    def _untrack(self, task: asyncio.Task) -> None:
+        if (prof := self._owners.pop(task, None)) is not None:
+            prof.tasks.discard(task)
+
+    @property
+    def toggled(self) -> bool:
+        return time.time() < self.enabled_until
+
+    @asynccontextmanager
+    async def profile(self, name: str):
+        if self._loop is None or _current_profile.get() is not None:
+            yield None
+            return
+        prof = _Profile(name)
+        token = _current_profile.set(prof)
+        task = asyncio.current_task()
+        self._owners[task] = prof
+        prof.tasks.add(task)
+        self._active.add(prof)
+        self._ensure_sampler()
+        try:
+            yield prof
+        finally:
+            self._active.discard(prof)
+            self._owners.pop(task, None)
+            prof.tasks.discard(task)
+            _current_profile.reset(token)
+            if prof.samples:
+                path = await asyncio.to_thread(self._write, prof)
+                logger.info("Profile for %s written to %s", name, path)
+
+    def _ensure_sampler(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample_loop, name="task-profiler", daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def _sample_loop(self) -> None:
+        while True:
+            if not self._active:
+                # 計測中のものが無い間は止まっておく
+                self._wake.clear()
+                if not self._active:
+                    self._wake.wait()
+            time.sleep(self.interval)
+            try:
+                self._sample()
+            except Exception:
+                # ループスレッドと競合して途中の状態を読むことがあるので、その回は捨てる
+                continue
+
+    def _sample(self) -> None:
+        running = asyncio.current_task(self._loop)
+        owner = self._owners.get(running) if running is not None else None
+        if owner is not None and (frame := sys._current_frames().get(self._loop_tid)) is not None:
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            owner.samples[("[cpu]",) + tuple(reversed(stack))] += 1
+        for prof in list(self._active):
+            for task in list(prof.tasks):
+                if task is running or task.done():
+                    continue
+                if chain := _await_chain(task):
+                    prof.samples[("[await]",) + chain] += 1
+
+    def _write(self, prof: _Profile) -> str:
+        os.makedirs(self.out_dir, exist_ok=True)
+        base = os.path.join(self.out_dir, prof.id)
+        with open(base + ".folded", "w") as f:
+            for stack, count in prof.samples.most_common():
+                f.write(";".join(stack) + f" {count}\n")
+        with open(base + ".svg", "w") as f:
+            f.write(render_flamegraph(prof.samples, f"{prof.name} @ {prof.started:%Y-%m-%d %H:%M:%S}"))
+        return base + ".svg"
+
+    async def watch_toggle(self, redis_client, interval: float = 5.0):
+        """profiling:until を定期的に読み、全ワーカーで同じ期限まで全リクエストを計測する"""
+        while True:
+            try:
+                raw = await redis_client.get(keys.profiling_until())
+                self.enabled_until = float(raw) if raw else 0.0
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Failed to read profiling toggle")
+            await asyncio.sleep(interval)
+
+
+def render_flamegraph(samples: Counter, title: str, width: int = 1200, row: int = 16) -> str:
+    """folded stacks から自己完結の SVG flame graph を作る"""
+    root: dict = {"n": 0, "c": {}}
+    for stack, count in samples.items():
+        root["n"] += count
+        node = root
+        for label in stack:
+            node = node["c"].setdefault(label, {"n": 0, "c": {}})
+            node["n"] += count
+
+    rects = []
+    depth_max = 0
+
+    def walk(node, x, depth):
+        nonlocal depth_max
+        depth_max = max(depth_max, depth)
+        for label, child in sorted(node["c"].items()):
+            w = child["n"] / root["n"] * width
+            if w >= 0.5:
+                rects.append((x, depth, w, label, child["n"]))
+                walk(child, x, depth + 1)
+            x += w
+
+    if root["n"]:
+        walk(root, 0.0, 0)
+    height = (depth_max + 2) * row + 24
+    out = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+        f'font-family="monospace" font-size="11">',
+        f'<text x="4" y="14">{html.escape(title)} ({root["n"]} samples)</text>',
+    ]
+    for x, depth, w, label, n in rects:
+        y = height - (depth + 1) * row
+        hue = int(hashlib.md5(label.encode()).hexdigest()[:2], 16) % 40 + 10
+        text = html.escape(label[: int(w / 7)]) if w > 21 else ""
+        out.append(
+            f'<g><title>{html.escape(label)} ({n} samples, {n / root["n"]:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + row - 4}">{text}</text></g>'
+        )
+    out.append("</svg>")
+    return "\n".join(out)
+
+
+def sign_profile_request(expires: int, secret: str = PROFILING_SECRET) -> str:
+    """X-Profile ヘッダ値（運用者が発行する）: "<期限 epoch>.<HMAC-SHA256>" """
+    mac = hmac.new(secret.encode(), str(expires).encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{mac}"
+
+
+def verify_profile_signature(value: Optional[str]) -> bool:
+    if not value or not PROFILING_SECRET:
+        return False
+    expires, _, _ = value.partition(".")
+    if not expires.isdigit():
+        return False
+    now = time.time()
+    if not (now < int(expires) <= now + MAX_SIGNATURE_TTL):
+        return False
+    return hmac.compare_digest(value, sign_profile_request(int(expires)))
+
+
+class ProfilingMiddleware:
+    """X-Profile ヘッダか profiling:until が有効な HTTP リクエストを計測する（純 ASGI なので同じタスク内で動く）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = dict(scope["headers"]).get(PROFILE_HEADER.encode())
+        if not (profiler.toggled or verify_profile_signature(header.decode() if header else None)):
+            return await self.app(scope, receive, send)
+
+        async with profiler.profile(f"{scope['method']} {scope['path']}") as prof:
+            async def send_with_id(message):
+                if prof is not None and message["type"] == "http.response.start":
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile-id", prof.id.encode())]
+                await send(message)
+            await self.app(scope, receive, send_with_id)
+
+
+lag_monitor = LoopLagMonitor(LOOP_LAG_THRESHOLD_MS, LOOP_LAG_INTERVAL_MS)
+profiler = TaskProfiler(PROFILE_SAMPLE_INTERVAL_MS, PROFILE_DIR)
@@ -0,0 +1,112 @@
+# src/redis_keys.py
+
+"""
+Redis のキー組み立てをここに集約する。
+
+ClusterKeySchema はルーム単位のキーに {room_id} のハッシュタグを付けるので、
+1ルームのキーは Redis Cluster 上で必ず同じスロットに載り、
+複数キーの DELETE / パイプラインが CROSSSLOT にならない。
+LegacyKeySchema は従来の書式で、単体 Redis / sentinel での既定。
+書式を切り替えるとルーム単位のキー（在室・ラウンド・精算リクエストなど）は引き継がれないので、
+既存のデプロイで cluster に変えるのはルームが空いている時間帯にする。
+"""
+
+from src.config import REDIS_KEY_SCHEMA
+
+
+class ClusterKeySchema:
+    def _tag(self, room_id: str) -> str:
+        return "{" + room_id + "}"
+
+    # ─── ポイントラウンド ───
+
+    def round(self, room_id: str) -> str:
+        return f"round:{self._tag(room_id)}"
+
+    def round_submissions(self, room_id: str) -> str:
+        return f"{self.round(room_id)}:subs"
+
+    def round_approvals(self, room_id: str) -> str:
+        return f"{self.round(room_id)}:apprs"
+
+    # ─── 在室 ───
+
+    def presence(self, room_id: str) -> str:
+        return f"presence:{self._tag(room_id)}"
+
+    def presence_pattern(self) -> str:
+        return "presence:*"
+
+    # ─── 精算リクエスト ───
+
+    def settle_request(self, room_id: str, from_uid: str, to_uid: str) -> str:
+        return f"settle:{self._tag(room_id)}:{from_uid}->{to_uid}"
+
+    def settle_inbox(self, to_uid: str) -> str:
+        """to_uid 宛ての精算リクエストキーの索引（score = 失効時刻）"""
+        return f"settle_inbox:{to_uid}"
+
+    # ─── キャッシュ / ジョブ ───
+
+    def series(self, room_id: str, version: str, variant: str) -> str:
+        return f"series:{self._tag(room_id)}:{version}:{variant}"
+
+    def profile(self, uid: str) -> str:
+        return f"profile:{uid}"
+
+    def profile_invalidations(self) -> str:
+        """プロフィール変更を他ワーカーの L1 に知らせる Pub/Sub チャンネル"""
+        return "profile:invalidate"
+
+    def ws_deliveries(self) -> str:
+        """deliver_later の内容を全ワーカーに流す Pub/Sub チャンネル"""
+        return "ws:deliver"
+
+    def idempotency(self, uid: str, key: str) -> str:
+        return f"idem:{uid}:{key}"
+
+    def profiling_until(self) -> str:
+        """全リクエストをプロファイルする期限（epoch 秒）。運用時に SET して使う"""
+        return "profiling:until"
+
+    def causal_mark(self, uid: str) -> str:
+        return f"causal:{uid}"
+
+    def archive_lock(self) -> str:
+        return "archive:lock"
+
+    # ─── ランキング（score = 残高） ───
+
+    def leaderboard(self, room_id: str | None = None) -> str:
+        """room_id 無しなら全ルーム合計"""
+        return "leaderboard:global" if room_id is None else f"leaderboard:{self._tag(room_id)}"
+
+    def leaderboard_lock(self) -> str:
+        return "leaderboard:lock"
+
+    def jobs(self) -> str:
+        return "jobs"
+
+    def jobs_dead(self) -> str:
+        """試行上限を超えたジョブ"""
+        return "jobs:dead"
+
+    def job_errors(self) -> str:
+        """メッセージ ID → 直近の失敗内容（dead-letter に添える）"""
+        return "jobs:errors"
+
+
+class LegacyKeySchema(ClusterKeySchema):
+    def _tag(self, room_id: str) -> str:
+        return room_id
+
+
+KEY_SCHEMAS = {
+    "cluster": ClusterKeySchema,
+    "legacy": LegacyKeySchema,
+}
+
+if REDIS_KEY_SCHEMA not in KEY_SCHEMAS:
+    raise RuntimeError(f"Unknown REDIS_KEY_SCHEMA: {REDIS_KEY_SCHEMA}")
+
+keys = KEY_SCHEMAS[REDIS_KEY_SCHEMA]()
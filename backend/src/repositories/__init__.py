@@ -0,0 +1,29 @@
+# src/repositories/__init__.py
+
+"""
+ストレージ（STORAGE_BACKEND）の切り替え。
+
+- mongo: Motor / redis-py（本番）
+- memory: プロセス内のメモリ（テスト・アプリ層のベンチマーク用。プロセスを越えて共有されない）
+
+サービスを組み立てる側は get_storage().rooms() のようにリポジトリを取り出す。
+使うバックエンドのモジュールだけを初回利用時に import する。
+"""
+
+import importlib
+from functools import lru_cache
+
+from src.config import STORAGE_BACKEND
+
+STORAGE_BACKENDS = {
+    "mongo": "src.repositories.mongo",
+    "memory": "src.repositories.memory",
+}
+
+
+@lru_cache
+def get_storage():
+    path = STORAGE_BACKENDS.get(STORAGE_BACKEND)
+    if path is None:
+        raise RuntimeError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return importlib.import_module(path).Storage()
@@ -0,0 +1,22 @@
+# src/repositories/id_counter_repo.py
+
+from pymongo import ReturnDocument
+from pymongo.write_concern import WriteConcern
+
+
+class IdCounterRepository:
+    """採番の高水位（id_counters）。src/ids.py がプロセスごとに区間を予約する"""
+
+    def __init__(self, db):
+        # フェイルオーバーで予約済みの区間が巻き戻らないよう majority で書く
+        self.collection = db.get_collection("id_counters", write_concern=WriteConcern("majority"))
+
+    async def reserve(self, namespace: str, size: int) -> int:
+        """[戻り値 - size, 戻り値) を呼び出し側に割り当てる"""
+        doc = await self.collection.find_one_and_update(
+            {"_id": namespace},
+            {"$inc": {"high": size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["high"]
@@ -0,0 +1,178 @@
+# src/repositories/interfaces.py
+
+"""
+サービス層から見たリポジトリのインターフェース（構造的部分型）。
+
+実装は2つ:
+- Motor / redis-py（user_repo, room_repo, misc_repo など。本番）
+- プロセス内のメモリ（memory.py。テスト・アプリ層のベンチマーク用）
+
+どちらを使うかは STORAGE_BACKEND で選び、get_storage() から取り出す。
+"""
+
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Protocol
+
+
+class Users(Protocol):
+    async def get_by_uid(self, uid: str) -> Optional[dict]: ...
+    async def get_many(self, uids: List[str]) -> List[dict]: ...
+    async def get_by_external_id(self, external_id: str) -> Optional[dict]: ...
+    async def uid_by_external_id(self, external_id: str) -> Optional[str]: ...
+    async def get_deleted_by_external_id(self, external_id: str) -> Optional[dict]: ...
+    async def restore(self, external_id: str, data: dict) -> None: ...
+    async def create(self, data: dict) -> str: ...
+    async def update_display_name(self, uid: str, display_name: str) -> bool: ...
+    async def list_all(self) -> List[dict]: ...
+    async def ensure_indexes(self) -> None: ...
+
+
+class Members(Protocol):
+    async def state_of(self, room_id: str, uid: str) -> Optional[str]: ...
+    async def is_member(self, room_id: str, uid: str) -> bool: ...
+    async def member_uids(self, room_id: str) -> List[str]: ...
+    async def count(self, room_id: str, state: str = ...) -> int: ...
+    async def list_page(
+        self, room_id: str, state: str = ..., after: Optional[str] = None, limit: int = 100
+    ) -> List[dict]: ...
+    async def room_ids_for_user(self, uid: str, state: str = ..., limit: int = 100) -> List[str]: ...
+    async def by_rooms(self, room_ids: List[str], limit: int = 10000) -> dict[str, dict[str, List[dict]]]: ...
+    async def summaries(self, room_ids: List[str], sample: int = 50) -> dict[str, dict]: ...
+    async def add_member(self, room_id: str, uid: str) -> None: ...
+    async def add_pending(self, room_id: str, uid: str) -> bool: ...
+    async def approve(self, room_id: str, uid: str) -> bool: ...
+    async def approve_many(self, room_id: str, uids: List[str]) -> List[str]: ...
+    async def remove_pending(self, room_id: str, uid: str) -> bool: ...
+    async def remove_pending_many(self, room_id: str, uids: List[str]) -> List[str]: ...
+    async def remove_expired_pending(self, room_id: str, requested_before: datetime) -> List[str]: ...
+    async def remove_member(self, room_id: str, uid: str) -> None: ...
+    async def clear(self, room_id: str) -> None: ...
+    async def migrate_all(self) -> int: ...
+
+
+class Rooms(Protocol):
+    members: Members
+
+    async def exists(self, room_id: str) -> bool: ...
+    async def create(self, data: dict, created_by: str) -> str: ...
+    async def get_by_id(self, room_id: str) -> Optional[dict]: ...
+    async def list_all(self) -> List[dict]: ...
+    async def update(self, room_id: str, updates: dict) -> bool: ...
+    async def with_members(self, rooms: List[dict]) -> List[dict]: ...
+    async def list_rooms_for_user(self, uid: str) -> List[dict]: ...
+    async def list_pending_for_user(self, uid: str) -> List[dict]: ...
+    async def add_member(self, room_id: str, uid: str) -> None: ...
+    async def add_pending_member(self, room_id: str, uid: str) -> bool: ...
+    async def approve_pending_member(self, room_id: str, uid: str) -> bool: ...
+    async def approve_pending_members(self, room_id: str, uids: List[str]) -> List[str]: ...
+    async def remove_pending_members(self, room_id: str, uids: List[str]) -> List[str]: ...
+    async def remove_expired_pending_members(self, room_id: str, requested_before: datetime) -> List[str]: ...
+    async def remove_pending_member(self, room_id: str, uid: str) -> bool: ...
+    async def remove_member(self, room_id: str, uid: str) -> None: ...
+    async def ensure_indexes(self) -> None: ...
+
+
+class PointRecords(Protocol):
+    async def create(self, data: dict) -> str: ...
+    async def history(self, room_id: str, include_archived: bool = False, limit: int = 100) -> List[dict]: ...
+    async def history_by_uid(self, uid: str, include_archived: bool = False, limit: int = 100) -> List[dict]: ...
+    def iter_records(
+        self, query: dict, batch_size: int = 500, include_archived: bool = False, descending: bool = False
+    ) -> AsyncIterator[dict]: ...
+    async def sum_by_uid(
+        self, query: dict, uid: Optional[str] = None, include_archived: bool = False
+    ) -> dict[str, int]: ...
+    async def room_balances(self, room_id: str) -> dict[str, int]: ...
+    async def balance_of(self, uid: str) -> int: ...
+    async def balances_for_rooms(self, uid: str, room_ids: List[str]) -> dict[str, int]: ...
+    async def latest_version(self, room_id: str) -> str: ...
+    def iter_running_totals(self, room_id: str, batch_size: int = 500) -> AsyncIterator[dict]: ...
+    async def archive_room(
+        self,
+        room_id: str,
+        cutoff: Optional[datetime] = None,
+        keep_recent: Optional[int] = None,
+        bucket_size: int = 200,
+    ) -> int: ...
+    async def room_ids(self) -> List[str]: ...
+    async def ensure_indexes(self) -> None: ...
+
+
+class Settlements(Protocol):
+    async def history(self, room_id: str) -> List[dict]: ...
+    async def history_by_uid(self, uid: str) -> List[dict]: ...
+    def iter_records(
+        self, query: dict, batch_size: int = 500, descending: bool = False
+    ) -> AsyncIterator[dict]: ...
+    async def ensure_indexes(self) -> None: ...
+
+
+class RoundCache(Protocol):
+    async def start(self, room_id: str, round_id: str, participants: list[str], ttl: int = 180) -> None: ...
+    async def get_round_id(self, room_id: str) -> str | None: ...
+    async def add_submission(self, room_id: str, uid: str, value: int, ttl: int = 180) -> str | None: ...
+    async def get_submissions(self, room_id: str) -> dict[str, int]: ...
+    async def add_approval(self, room_id: str, uid: str, ttl: int = 180) -> None: ...
+    async def get_approvals(self, room_id: str) -> set[str]: ...
+    async def get_participants(self, room_id: str) -> list[str]: ...
+    async def present_uids(self, room_id: str) -> list[str]: ...
+    async def status(self, room_id: str) -> dict | None: ...
+    async def clear(self, room_id: str) -> None: ...
+
+
+class Presence(Protocol):
+    async def add(self, room_id: str, uid: str) -> None: ...
+    async def remove(self, room_id: str, uid: str) -> None: ...
+    async def remove_everywhere(self, uid: str) -> None: ...
+    async def uids(self, room_id: str) -> list[str]: ...
+    async def counts(self, room_ids: list[str]) -> dict[str, int]: ...
+
+
+class IdCounters(Protocol):
+    async def reserve(self, namespace: str, size: int) -> int: ...
+
+
+class SettlementCache(Protocol):
+    async def cache_request(self, room_id: str, from_uid: str, to_uid: str, amount: int) -> None: ...
+    async def get_request(self, room_id: str, from_uid: str, to_uid: str) -> Optional[dict]: ...
+    async def clear_request(self, room_id: str, from_uid: str, to_uid: str) -> None: ...
+    async def pending_for(self, to_uid: str) -> List[dict]: ...
+
+
+class SeriesCache(Protocol):
+    async def get(self, room_id: str, version: str, variant: str) -> Optional[dict]: ...
+    async def set(self, room_id: str, version: str, variant: str, value: dict) -> None: ...
+
+
+class ProfileCache(Protocol):
+    async def get_many(self, uids: list[str]) -> dict[str, dict]: ...
+    async def set_many(self, profiles: list[dict]) -> None: ...
+    async def delete(self, uid: str) -> None: ...
+    async def publish_invalidation(self, uid: str) -> None: ...
+
+
+class Leaderboard(Protocol):
+    async def record(self, room_id: str, points: list[dict]) -> None: ...
+    async def adjust(self, deltas: dict[str, int], room_id: Optional[str] = None) -> None: ...
+    async def head(
+        self, uid: str, limit: int, room_id: Optional[str] = None
+    ) -> tuple[list[tuple[str, int]], Optional[int], Optional[int], int]: ...
+    async def page(self, start: int, stop: int, room_id: Optional[str] = None) -> list[tuple[str, int]]: ...
+    async def scores(self, room_id: Optional[str] = None) -> dict[str, int]: ...
+    async def scores_of(self, uids: list[str], room_id: Optional[str] = None) -> dict[str, int]: ...
+
+
+class Storage(Protocol):
+    """リポジトリ一式の取り出し口（STORAGE_BACKEND ごとに1つ）"""
+
+    def users(self) -> Users: ...
+    def rooms(self) -> Rooms: ...
+    def points(self) -> PointRecords: ...
+    def settlements(self) -> Settlements: ...
+    def round_cache(self) -> RoundCache: ...
+    def settle_cache(self) -> SettlementCache: ...
+    def series_cache(self) -> SeriesCache: ...
+    def profile_cache(self, ttl: int = 3600) -> ProfileCache: ...
+    def leaderboard(self) -> Leaderboard: ...
+    def presence(self) -> Presence: ...
+    def id_counters(self) -> IdCounters: ...
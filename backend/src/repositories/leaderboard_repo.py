@@ -0,0 +1,66 @@
+# src/repositories/leaderboard_repo.py
+
+from typing import Optional
+
+from src.redis_keys import keys
+
+
+def _entries(rows) -> list[tuple[str, int]]:
+    return [(uid, int(score)) for uid, score in rows]
+
+
+class LeaderboardRepository:
+    """
+    残高のランキング（sorted set, score = 残高）。全ルーム合計とルームごとの2種類。
+    ポイント記録の追加時に ZINCRBY で足し込み、ずれは reconcile ジョブが直す。
+    並びは ZREVRANGE の順（score 降順、同点は uid 降順）、順位は 0 始まり。
+    """
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def record(self, room_id: str, points: list[dict]) -> None:
+        """1件のポイント記録の増減をルームと全体の両方に足す"""
+        if not points:
+            return
+        # ルームと全体はスロットが違うので MULTI にはしない
+        pipe = self.redis.pipeline(transaction=False)
+        for p in points:
+            pipe.zincrby(keys.leaderboard(room_id), p["value"], p["uid"])
+            pipe.zincrby(keys.leaderboard(), p["value"], p["uid"])
+        await pipe.execute()
+
+    async def adjust(self, deltas: dict[str, int], room_id: Optional[str] = None) -> None:
+        if not deltas:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for uid, delta in deltas.items():
+            pipe.zincrby(keys.leaderboard(room_id), delta, uid)
+        await pipe.execute()
+
+    async def head(
+        self, uid: str, limit: int, room_id: Optional[str] = None
+    ) -> tuple[list[tuple[str, int]], Optional[int], Optional[int], int]:
+        """(上位 limit 件, uid の順位, uid の score, 全体の人数) を1往復で"""
+        key = keys.leaderboard(room_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.zrevrange(key, 0, limit - 1, withscores=True)
+        pipe.zrevrank(key, uid)
+        pipe.zscore(key, uid)
+        pipe.zcard(key)
+        top, rank, score, total = await pipe.execute()
+        return _entries(top), rank, None if score is None else int(score), total
+
+    async def page(self, start: int, stop: int, room_id: Optional[str] = None) -> list[tuple[str, int]]:
+        """順位 start〜stop（両端を含む）"""
+        return _entries(await self.redis.zrevrange(keys.leaderboard(room_id), start, stop, withscores=True))
+
+    async def scores(self, room_id: Optional[str] = None) -> dict[str, int]:
+        return {uid: int(score) async for uid, score in self.redis.zscan_iter(keys.leaderboard(room_id))}
+
+    async def scores_of(self, uids: list[str], room_id: Optional[str] = None) -> dict[str, int]:
+        """載っていない uid は 0"""
+        if not uids:
+            return {}
+        values = await self.redis.zmscore(keys.leaderboard(room_id), uids)
+        return {uid: int(v or 0) for uid, v in zip(uids, values)}
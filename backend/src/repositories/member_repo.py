@@ -0,0 +1,367 @@
+# src/repositories/member_repo.py
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from src.db import current_session, reader
+
+logger = logging.getLogger(__name__)
+
+MEMBER = "member"
+PENDING = "pending"
+
+# 移行済みを確認したルーム（プロセス内）。確認後は追加クエリ無しで済ませる
+_migrated: set[str] = set()
+# migrate_all を最後まで終えたか（以降は利用者単位の移行確認も要らない）
+_all_migrated = False
+# 退避名に rename したまま、この時間を過ぎても終わっていない移行は落ちたものとみなす
+MIGRATION_LEASE = timedelta(minutes=5)
+# 他のワーカーが移行中のルームに触れたとき、終わるのを待つ上限と確認の間隔（秒）
+MIGRATION_WAIT_SECONDS = 2.0
+MIGRATION_POLL_SECONDS = 0.05
+
+
+class MemberRepository:
+    """
+    ルームの参加者・参加申請を (room_id, uid) 1件ずつで持つ。
+    rooms.members / rooms.pending_members（埋め込み配列）からはオンラインで移行する:
+    配列が残っているルームは、最初に触れたとき（と起動時の一括処理）でこちらに移す。
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.room_members
+        self.rooms = db.rooms
+
+    # ─── 参照 ───
+
+    async def state_of(self, room_id: str, uid: str) -> Optional[str]:
+        await self.ensure_migrated(room_id)
+        doc = await self.collection.find_one(
+            {"room_id": room_id, "uid": uid}, projection={"state": 1}, session=current_session()
+        )
+        return doc["state"] if doc else None
+
+    async def is_member(self, room_id: str, uid: str) -> bool:
+        return await self.state_of(room_id, uid) == MEMBER
+
+    async def member_uids(self, room_id: str) -> List[str]:
+        await self.ensure_migrated(room_id)
+        cursor = self.collection.find(
+            {"room_id": room_id, "state": MEMBER}, projection={"uid": 1}, session=current_session()
+        )
+        return [doc["uid"] async for doc in cursor]
+
+    async def count(self, room_id: str, state: str = MEMBER) -> int:
+        await self.ensure_migrated(room_id)
+        return await self.collection.count_documents(
+            {"room_id": room_id, "state": state}, session=current_session()
+        )
+
+    async def list_page(
+        self, room_id: str, state: str = MEMBER, after: Optional[str] = None, limit: int = 100
+    ) -> List[dict]:
+        """uid 順のページ。after には前ページ最後の uid を渡す"""
+        await self.ensure_migrated(room_id)
+        query: dict = {"room_id": room_id, "state": state}
+        if after:
+            query["uid"] = {"$gt": after}
+        cursor = reader(self.collection, "MemberRepository.list_page").find(
+            query, projection={"_id": 0, "room_id": 0}, session=current_session()
+        ).sort("uid", 1).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def room_ids_for_user(self, uid: str, state: str = MEMBER, limit: int = 100) -> List[str]:
+        await self.ensure_migrated_for_user(uid)
+        cursor = reader(self.collection, "MemberRepository.room_ids_for_user").find(
+            {"uid": uid, "state": state}, projection={"room_id": 1}, session=current_session()
+        ).limit(limit)
+        return [doc["room_id"] async for doc in cursor]
+
+    async def by_rooms(self, room_ids: List[str], limit: int = 10000) -> dict[str, dict[str, List[dict]]]:
+        """複数ルームの members / pending_members を1クエリで（従来のレスポンス形に合わせる）"""
+        for room_id in room_ids:
+            await self.ensure_migrated(room_id)
+        out = {room_id: {"members": [], "pending_members": []} for room_id in room_ids}
+        cursor = reader(self.collection, "MemberRepository.by_rooms").find(
+            {"room_id": {"$in": room_ids}}, projection={"_id": 0}, session=current_session()
+        ).sort([("room_id", 1), ("state", 1), ("uid", 1)]).limit(limit)
+        async for doc in cursor:
+            if doc["state"] == MEMBER:
+                out[doc["room_id"]]["members"].append({"uid": doc["uid"], "joined_at": doc.get("joined_at")})
+            else:
+                out[doc["room_id"]]["pending_members"].append(
+                    {"uid": doc["uid"], "requested_at": doc.get("requested_at")}
+                )
+        return out
+
+    async def summaries(self, room_ids: List[str], sample: int = 50) -> dict[str, dict]:
+        """ルームごとの参加者数・申請一覧・先頭 sample 人の uid（起動画面用）"""
+        for room_id in room_ids:
+            await self.ensure_migrated(room_id)
+        pipeline = [
+            {"$match": {"room_id": {"$in": room_ids}}},
+            {"$sort": {"uid": 1}},
+            {"$group": {
+                "_id": "$room_id",
+                "member_count": {"$sum": {"$cond": [{"$eq": ["$state", MEMBER]}, 1, 0]}},
+                "members": {"$push": {"$cond": [{"$eq": ["$state", MEMBER]}, "$uid", "$$REMOVE"]}},
+                "pending_members": {"$push": {"$cond": [
+                    {"$eq": ["$state", PENDING]},
+                    {"uid": "$uid", "requested_at": "$requested_at"},
+                    "$$REMOVE",
+                ]}},
+            }},
+            {"$project": {
+                "member_count": 1,
+                "pending_members": 1,
+                "member_sample": {"$slice": ["$members", sample]},
+            }},
+        ]
+        out = {}
+        async for doc in self.collection.aggregate(pipeline, session=current_session()):
+            out[doc.pop("_id")] = doc
+        return out
+
+    # ─── 更新 ───
+
+    async def add_member(self, room_id: str, uid: str) -> None:
+        await self.ensure_migrated(room_id)
+        now = datetime.now()
+        await self.collection.update_one(
+            {"room_id": room_id, "uid": uid},
+            {"$set": {"state": MEMBER, "joined_at": now, "updated_at": now}},
+            upsert=True,
+            session=current_session(),
+        )
+
+    async def add_pending(self, room_id: str, uid: str) -> bool:
+        """申請を登録する。既に申請中・参加済みなら False（重複申請は作らない）"""
+        await self.ensure_migrated(room_id)
+        now = datetime.now()
+        try:
+            result = await self.collection.update_one(
+                {"room_id": room_id, "uid": uid},
+                {"$setOnInsert": {"state": PENDING, "requested_at": now, "updated_at": now}},
+                upsert=True,
+                session=current_session(),
+            )
+        except DuplicateKeyError:
+            # 同時申請で upsert が競合した
+            return False
+        return result.upserted_id is not None
+
+    async def approve(self, room_id: str, uid: str) -> bool:
+        await self.ensure_migrated(room_id)
+        now = datetime.now()
+        result = await self.collection.update_one(
+            {"room_id": room_id, "uid": uid, "state": PENDING},
+            {"$set": {"state": MEMBER, "joined_at": now, "updated_at": now}},
+            session=current_session(),
+        )
+        return result.modified_count == 1
+
+    async def approve_many(self, room_id: str, uids: List[str]) -> List[str]:
+        """この呼び出しで申請中 → 参加に変えた uid だけを返す（同時の一括承認で二重に通知しない）"""
+        await self.ensure_migrated(room_id)
+        now = datetime.now()
+        approved = []
+        for uid in dict.fromkeys(uids):
+            result = await self.collection.update_one(
+                {"room_id": room_id, "uid": uid, "state": PENDING},
+                {"$set": {"state": MEMBER, "joined_at": now, "updated_at": now}},
+                session=current_session(),
+            )
+            if result.modified_count == 1:
+                approved.append(uid)
+        return approved
+
+    async def remove_pending(self, room_id: str, uid: str) -> bool:
+        await self.ensure_migrated(room_id)
+        result = await self.collection.delete_one(
+            {"room_id": room_id, "uid": uid, "state": PENDING}, session=current_session()
+        )
+        return result.deleted_count == 1
+
+    async def remove_pending_many(self, room_id: str, uids: List[str]) -> List[str]:
+        return await self._delete_pending(room_id, {"uid": {"$in": uids}})
+
+    async def remove_expired_pending(self, room_id: str, requested_before: datetime) -> List[str]:
+        return await self._delete_pending(room_id, {"requested_at": {"$lt": requested_before}})
+
+    async def remove_member(self, room_id: str, uid: str) -> None:
+        await self.ensure_migrated(room_id)
+        await self.collection.delete_one(
+            {"room_id": room_id, "uid": uid, "state": MEMBER}, session=current_session()
+        )
+
+    async def clear(self, room_id: str) -> None:
+        """ルーム削除（アーカイブ）時に参加者・申請をまとめて消す"""
+        await self.collection.delete_many({"room_id": room_id}, session=current_session())
+
+    async def _pending_among(self, room_id: str, cond: dict) -> List[str]:
+        await self.ensure_migrated(room_id)
+        cursor = self.collection.find(
+            {"room_id": room_id, "state": PENDING, **cond}, projection={"uid": 1}, session=current_session()
+        )
+        return [doc["uid"] async for doc in cursor]
+
+    async def _delete_pending(self, room_id: str, cond: dict) -> List[str]:
+        # 同時に処理された分は二重に返り得るが、どちらも同じ結果（申請が消える）になる
+        pending = await self._pending_among(room_id, cond)
+        if pending:
+            await self.collection.delete_many(
+                {"room_id": room_id, "uid": {"$in": pending}, "state": PENDING},
+                session=current_session(),
+            )
+        return pending
+
+    # ─── 埋め込み配列からの移行 ───
+
+    async def ensure_migrated(self, room_id: str) -> None:
+        if room_id in _migrated:
+            return
+        await self.migrate_room(room_id)
+        # 他のワーカーが移行中なら少し待つ。待ちきれなければ記録せず、次に触れたときに確かめ直す
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + MIGRATION_WAIT_SECONDS
+        while await self._recover_interrupted(room_id):
+            if loop.time() >= deadline:
+                logger.warning("Membership migration of %s still in progress elsewhere", room_id)
+                return
+            await asyncio.sleep(MIGRATION_POLL_SECONDS)
+        _migrated.add(room_id)
+
+    async def ensure_migrated_for_user(self, uid: str) -> None:
+        """uid が埋め込み配列に残っているルームを先に移す（利用者からルームを引く読み取り用）"""
+        if _all_migrated:
+            return
+        cursor = self.rooms.find(
+            {"$or": [{"members.uid": uid}, {"pending_members.uid": uid}]},
+            projection={"room_id": 1},
+            session=current_session(),
+        )
+        for room_id in [doc["room_id"] async for doc in cursor]:
+            await self.ensure_migrated(room_id)
+
+    async def migrate_room(self, room_id: str) -> int:
+        # 配列を退避名に rename して取り出す。同時に走っても取り出せるのは1回だけ。
+        # 開始時刻はリースで、他のワーカーが進行中のものと落ちたものを見分けるのに使う
+        doc = await self.rooms.find_one_and_update(
+            {"room_id": room_id, "$or": [
+                {"members": {"$exists": True}},
+                {"pending_members": {"$exists": True}},
+            ]},
+            {
+                "$rename": {"members": "members_migrating", "pending_members": "pending_members_migrating"},
+                "$set": {"members_migrating_at": datetime.now()},
+            },
+            projection={"members": 1, "pending_members": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=current_session(),
+        )
+        if doc is None:
+            return 0
+        moved = 0
+        for m in doc.get("members") or []:
+            # 配列側は移行前の状態なので、既に新しい行があればそちらを優先する
+            await self.collection.update_one(
+                {"room_id": room_id, "uid": m["uid"]},
+                {"$setOnInsert": {
+                    "state": MEMBER,
+                    "joined_at": m.get("joined_at"),
+                    "updated_at": datetime.now(),
+                }},
+                upsert=True,
+                session=current_session(),
+            )
+            moved += 1
+        member_uids = {m["uid"] for m in doc.get("members") or []}
+        for m in doc.get("pending_members") or []:
+            if m["uid"] in member_uids:
+                continue
+            await self.collection.update_one(
+                {"room_id": room_id, "uid": m["uid"]},
+                {"$setOnInsert": {
+                    "state": PENDING,
+                    "requested_at": m.get("requested_at"),
+                    "updated_at": datetime.now(),
+                }},
+                upsert=True,
+                session=current_session(),
+            )
+            moved += 1
+        await self.rooms.update_one(
+            {"_id": doc["_id"]},
+            {"$unset": {"members_migrating": "", "pending_members_migrating": "", "members_migrating_at": ""}},
+            session=current_session(),
+        )
+        return moved
+
+    async def migrate_all(self) -> int:
+        """埋め込み配列が残っている全ルームを移行する（起動時に裏で実行。失敗したら呼び出し側がやり直す）"""
+        global _all_migrated
+        moved = 0
+        while True:
+            unfinished = 0
+            cursor = self.rooms.find(
+                {"$or": [
+                    {"members": {"$exists": True}},
+                    {"pending_members": {"$exists": True}},
+                    {"members_migrating": {"$exists": True}},
+                ]},
+                projection={"room_id": 1},
+            )
+            async for doc in cursor:
+                moved += await self.migrate_room(doc["room_id"])
+                if await self._recover_interrupted(doc["room_id"]):
+                    unfinished += 1
+                else:
+                    _migrated.add(doc["room_id"])
+            if not unfinished:
+                break
+            # 他のワーカーが移行中（かリース切れ待ち）のルームが残っている
+            await asyncio.sleep(MIGRATION_LEASE.total_seconds() / 5)
+        if moved:
+            logger.info("Migrated %d room memberships into room_members", moved)
+        _all_migrated = True
+        return moved
+
+    async def _recover_interrupted(self, room_id: str) -> bool:
+        """
+        rename 後・行の作成前に落ちたルームを、退避名の配列から戻して移し直す（リース切れのものだけ）。
+        まだリース内で移行中なら True
+        """
+        doc = await self.rooms.find_one_and_update(
+            {
+                "room_id": room_id,
+                "members_migrating": {"$exists": True},
+                # 時刻の無いものは以前の版が rename したまま落ちた分
+                "$or": [
+                    {"members_migrating_at": {"$lt": datetime.now() - MIGRATION_LEASE}},
+                    {"members_migrating_at": {"$exists": False}},
+                ],
+            },
+            {"$rename": {"members_migrating": "members", "pending_members_migrating": "pending_members"}},
+            projection={"_id": 1},
+        )
+        if doc is not None:
+            await self.migrate_room(room_id)
+            return False
+        in_progress = await self.rooms.find_one(
+            {"room_id": room_id, "members_migrating": {"$exists": True}}, projection={"_id": 1}
+        )
+        return in_progress is not None
+
+    async def ensure_indexes(self) -> None:
+        # ensure_migrated_for_user 用（配列が無くなったルームは索引に載らない）
+        await self.rooms.create_index("members.uid", sparse=True)
+        await self.rooms.create_index("pending_members.uid", sparse=True)
+        await self.collection.create_index([("room_id", 1), ("uid", 1)], unique=True)
+        await self.collection.create_index([("room_id", 1), ("state", 1), ("uid", 1)])
+        await self.collection.create_index([("uid", 1), ("state", 1)])
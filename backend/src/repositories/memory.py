@@ -0,0 +1,960 @@
+# src/repositories/memory.py
+
+"""
+プロセス内メモリのリポジトリ（STORAGE_BACKEND=memory）。
+
+Mongo / Redis 版と同じメソッド・同じ戻り値の形で、サーバー無しでサービス層を動かす
+（テストと、DB の待ち時間を除いたアプリ層だけのベンチマーク用）。
+
+- 索引は dict（uid / external_id / (room_id, uid) など）と、(created_at, _id) 昇順・uid 昇順に
+  bisect で挿入して保つリスト。Mongo でインデックスを引く操作はここでも全件走査しない
+- 残高はレコード追加時に足し込んでおく（room_balances / balance_of は集計しない）
+- キャッシュ系は Redis の EXPIRE と同じく、キー単位の期限（秒）を持つ。期限切れは触れたときに消す。
+  時計は Storage(clock=...) で差し替えられる（既定は time.monotonic）
+- cold tier は無い（archive_room は何もしない。include_archived は常に全件が対象）
+- 一意制約（users.uid / rooms.room_id / point_records の room_id+round_id）は DuplicateKeyError を投げる
+- 在室（presence）と採番の高水位もここに持つ
+- プロセスを越えて共有されない。ジョブキュー・WebSocket の配送・冪等キーは引き続き Redis を使う
+"""
+
+import asyncio
+import heapq
+import json
+import math
+import operator
+import time
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import datetime
+from typing import AsyncIterator, Callable, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from src.config import PROFILE_TOMBSTONE_TTL
+from src.repositories.member_repo import MEMBER, PENDING
+from src.repositories.misc_repo import _scope_value
+
+# ─── Mongo のクエリ（サービスが組み立てる範囲）の評価 ───
+
+_COMPARE = {"$lt": operator.lt, "$lte": operator.le, "$gt": operator.gt, "$gte": operator.ge}
+
+
+def matches(doc: dict, query: dict) -> bool:
+    """$and / $or / $nor、等値・$ne・$in・$nin・$exists・大小比較、"points.uid" のような配列内のパス"""
+    for key, cond in query.items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in cond):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in cond):
+                return False
+        elif not _match_field(_values(doc, key), cond):
+            return False
+    return True
+
+
+def _values(doc: dict, path: str) -> list:
+    values = [doc]
+    for part in path.split("."):
+        found = []
+        for v in values:
+            if isinstance(v, list):
+                found += [x[part] for x in v if isinstance(x, dict) and part in x]
+            elif isinstance(v, dict) and part in v:
+                found.append(v[part])
+        values = found
+    # 配列のフィールドは要素のどれかが一致すればよい
+    out = []
+    for v in values:
+        out += v if isinstance(v, list) else [v]
+    return out
+
+
+def _match_field(values: list, cond) -> bool:
+    if not (isinstance(cond, dict) and cond and all(k.startswith("$") for k in cond)):
+        return cond in values
+    for op, arg in cond.items():
+        if op == "$ne":
+            ok = arg not in values
+        elif op == "$in":
+            ok = any(v in arg for v in values)
+        elif op == "$nin":
+            ok = not any(v in arg for v in values)
+        elif op == "$exists":
+            ok = bool(values) == bool(arg)
+        elif op in _COMPARE:
+            ok = any(v is not None and _COMPARE[op](v, arg) for v in values)
+        else:
+            raise ValueError(f"Unsupported query operator in memory storage: {op}")
+        if not ok:
+            return False
+    return True
+
+
+class _Timeline:
+    """キー → (created_at, _id) 昇順のレコード列（Mongo の複合インデックス相当）"""
+
+    def __init__(self):
+        self._lists: dict = defaultdict(list)
+
+    def add(self, key, doc: dict) -> None:
+        # _id は一意なので doc 同士の比較にはならない
+        insort(self._lists[key], (doc["created_at"], doc["_id"], doc))
+
+    def scan(self, key, descending: bool = False) -> Iterable[dict]:
+        items = self._lists.get(key, ())
+        return (item[2] for item in (reversed(items) if descending else items))
+
+    def last(self, key) -> Optional[dict]:
+        items = self._lists.get(key)
+        return items[-1][2] if items else None
+
+    def keys(self) -> list:
+        return list(self._lists)
+
+
+async def _stream(docs: Iterable[dict], query: dict, batch_size: int) -> AsyncIterator[dict]:
+    # カーソルと同じく batch_size 件ごとにループへ制御を返す
+    n = 0
+    for doc in docs:
+        if not matches(doc, query):
+            continue
+        yield dict(doc)
+        n += 1
+        if n % batch_size == 0:
+            await asyncio.sleep(0)
+
+
+# ─── Mongo 側 ───
+
+class MemoryUserRepository:
+    def __init__(self):
+        self._by_uid: dict[str, dict] = {}
+        self._by_external_id: dict[str, str] = {}
+
+    def _active(self, uid: Optional[str]) -> Optional[dict]:
+        doc = self._by_uid.get(uid) if uid is not None else None
+        return doc if doc is not None and not doc["is_deleted"] else None
+
+    async def get_by_uid(self, uid: str) -> Optional[dict]:
+        doc = self._active(uid)
+        return dict(doc) if doc else None
+
+    async def get_many(self, uids: List[str]) -> List[dict]:
+        fields = ("_id", "uid", "display_name", "icon_url", "registered_at")
+        return [
+            {k: doc[k] for k in fields if k in doc}
+            for doc in map(self._active, dict.fromkeys(uids)) if doc
+        ]
+
+    async def get_by_external_id(self, external_id: str) -> Optional[dict]:
+        doc = self._active(self._by_external_id.get(external_id))
+        return dict(doc) if doc else None
+
+    async def uid_by_external_id(self, external_id: str) -> Optional[str]:
+        doc = self._active(self._by_external_id.get(external_id))
+        return doc["uid"] if doc else None
+
+    async def get_deleted_by_external_id(self, external_id: str) -> Optional[dict]:
+        doc = self._by_uid.get(self._by_external_id.get(external_id))
+        return dict(doc) if doc and doc["is_deleted"] else None
+
+    async def restore(self, external_id: str, data: dict) -> None:
+        doc = self._by_uid.get(self._by_external_id.get(external_id))
+        if doc is not None:
+            doc.update(data, is_deleted=False)
+
+    async def create(self, data: dict) -> str:
+        if data["uid"] in self._by_uid:
+            raise DuplicateKeyError(f"duplicate uid: {data['uid']}")
+        data["registered_at"] = datetime.now()
+        data["is_deleted"] = False
+        data.setdefault("_id", ObjectId())
+        self._by_uid[data["uid"]] = dict(data)
+        if data.get("external_id") is not None:
+            self._by_external_id[data["external_id"]] = data["uid"]
+        return data["uid"]
+
+    async def update_display_name(self, uid: str, display_name: str) -> bool:
+        doc = self._active(uid)
+        if doc is None or doc.get("display_name") == display_name:
+            return False
+        doc["display_name"] = display_name
+        return True
+
+    async def list_all(self) -> List[dict]:
+        return [dict(doc) for doc in self._by_uid.values() if not doc["is_deleted"]][:1000]
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+class MemoryMemberRepository:
+    def __init__(self):
+        self._rows: dict[tuple[str, str], dict] = {}
+        # (room_id, state) → uid 昇順 / (uid, state) → room_id（追加順）
+        self._uids: dict[tuple[str, str], list[str]] = defaultdict(list)
+        self._room_ids: dict[tuple[str, str], dict[str, None]] = defaultdict(dict)
+
+    def _put(self, room_id: str, uid: str, row: dict) -> None:
+        self._drop(room_id, uid)
+        self._rows[(room_id, uid)] = row
+        insort(self._uids[(room_id, row["state"])], uid)
+        self._room_ids[(uid, row["state"])][room_id] = None
+
+    def _drop(self, room_id: str, uid: str) -> Optional[dict]:
+        row = self._rows.pop((room_id, uid), None)
+        if row is not None:
+            uids = self._uids[(room_id, row["state"])]
+            del uids[bisect_right(uids, uid) - 1]
+            self._room_ids[(uid, row["state"])].pop(room_id, None)
+        return row
+
+    def _state_uids(self, room_id: str, state: str) -> list[str]:
+        return self._uids.get((room_id, state), [])
+
+    # ─── 参照 ───
+
+    async def state_of(self, room_id: str, uid: str) -> Optional[str]:
+        row = self._rows.get((room_id, uid))
+        return row["state"] if row else None
+
+    async def is_member(self, room_id: str, uid: str) -> bool:
+        return await self.state_of(room_id, uid) == MEMBER
+
+    async def member_uids(self, room_id: str) -> List[str]:
+        return list(self._state_uids(room_id, MEMBER))
+
+    async def count(self, room_id: str, state: str = MEMBER) -> int:
+        return len(self._state_uids(room_id, state))
+
+    async def list_page(
+        self, room_id: str, state: str = MEMBER, after: Optional[str] = None, limit: int = 100
+    ) -> List[dict]:
+        uids = self._state_uids(room_id, state)
+        start = bisect_right(uids, after) if after else 0
+        return [dict(self._rows[(room_id, uid)]) for uid in uids[start:start + limit]]
+
+    async def room_ids_for_user(self, uid: str, state: str = MEMBER, limit: int = 100) -> List[str]:
+        return list(self._room_ids.get((uid, state), {}))[:limit]
+
+    async def by_rooms(self, room_ids: List[str], limit: int = 10000) -> dict[str, dict[str, List[dict]]]:
+        out = {room_id: {"members": [], "pending_members": []} for room_id in room_ids}
+        for room_id in sorted(out):
+            for state, field, at in ((MEMBER, "members", "joined_at"), (PENDING, "pending_members", "requested_at")):
+                for uid in self._state_uids(room_id, state):
+                    if limit <= 0:
+                        return out
+                    out[room_id][field].append({"uid": uid, at: self._rows[(room_id, uid)].get(at)})
+                    limit -= 1
+        return out
+
+    async def summaries(self, room_ids: List[str], sample: int = 50) -> dict[str, dict]:
+        out = {}
+        for room_id in dict.fromkeys(room_ids):
+            members = self._state_uids(room_id, MEMBER)
+            pending = self._state_uids(room_id, PENDING)
+            if not members and not pending:
+                continue
+            out[room_id] = {
+                "member_count": len(members),
+                "pending_members": [
+                    {"uid": uid, "requested_at": self._rows[(room_id, uid)].get("requested_at")}
+                    for uid in pending
+                ],
+                "member_sample": members[:sample],
+            }
+        return out
+
+    # ─── 更新 ───
+
+    async def add_member(self, room_id: str, uid: str) -> None:
+        now = datetime.now()
+        row = {**self._rows.get((room_id, uid), {"uid": uid}), "state": MEMBER, "joined_at": now, "updated_at": now}
+        self._put(room_id, uid, row)
+
+    async def add_pending(self, room_id: str, uid: str) -> bool:
+        if (room_id, uid) in self._rows:
+            return False
+        now = datetime.now()
+        self._put(room_id, uid, {"uid": uid, "state": PENDING, "requested_at": now, "updated_at": now})
+        return True
+
+    async def approve(self, room_id: str, uid: str) -> bool:
+        return bool(await self.approve_many(room_id, [uid]))
+
+    async def approve_many(self, room_id: str, uids: List[str]) -> List[str]:
+        pending = [uid for uid in dict.fromkeys(uids) if await self.state_of(room_id, uid) == PENDING]
+        now = datetime.now()
+        for uid in pending:
+            row = self._rows[(room_id, uid)]
+            self._put(room_id, uid, {**row, "state": MEMBER, "joined_at": now, "updated_at": now})
+        return pending
+
+    async def remove_pending(self, room_id: str, uid: str) -> bool:
+        return bool(await self.remove_pending_many(room_id, [uid]))
+
+    async def remove_pending_many(self, room_id: str, uids: List[str]) -> List[str]:
+        pending = [uid for uid in dict.fromkeys(uids) if await self.state_of(room_id, uid) == PENDING]
+        for uid in pending:
+            self._drop(room_id, uid)
+        return pending
+
+    async def remove_expired_pending(self, room_id: str, requested_before: datetime) -> List[str]:
+        expired = [
+            uid for uid in self._state_uids(room_id, PENDING)
+            if (at := self._rows[(room_id, uid)].get("requested_at")) is not None and at < requested_before
+        ]
+        return await self.remove_pending_many(room_id, expired)
+
+    async def remove_member(self, room_id: str, uid: str) -> None:
+        if await self.state_of(room_id, uid) == MEMBER:
+            self._drop(room_id, uid)
+
+    async def clear(self, room_id: str) -> None:
+        for state in (MEMBER, PENDING):
+            for uid in list(self._state_uids(room_id, state)):
+                self._drop(room_id, uid)
+
+    # 埋め込み配列からの移行は無い
+    async def ensure_migrated(self, room_id: str) -> None:
+        pass
+
+    async def migrate_all(self) -> int:
+        return 0
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+class MemoryRoomRepository:
+    def __init__(self, members: MemoryMemberRepository):
+        self.members = members
+        # 有効なルームだけ（アーカイブしたものは外す。room_id は再利用され得る）
+        self._rooms: dict[str, dict] = {}
+
+    async def exists(self, room_id: str) -> bool:
+        return room_id in self._rooms
+
+    async def create(self, data: dict, created_by: str) -> str:
+        if data["room_id"] in self._rooms:
+            raise DuplicateKeyError(f"duplicate room_id: {data['room_id']}")
+        data["created_at"] = datetime.now()
+        data["is_archived"] = False
+        data.setdefault("_id", ObjectId())
+        self._rooms[data["room_id"]] = dict(data)
+        await self.members.add_member(data["room_id"], created_by)
+        return data["room_id"]
+
+    async def get_by_id(self, room_id: str) -> Optional[dict]:
+        doc = self._rooms.get(room_id)
+        return dict(doc) if doc else None
+
+    async def list_all(self) -> List[dict]:
+        return [dict(doc) for doc in self._rooms.values()][:1000]
+
+    async def update(self, room_id: str, updates: dict) -> bool:
+        doc = self._rooms.get(room_id)
+        if doc is None:
+            return False
+        changed = any(doc.get(k) != v for k, v in updates.items())
+        doc.update(updates)
+        if doc["is_archived"]:
+            del self._rooms[room_id]
+        return changed
+
+    async def with_members(self, rooms: List[dict]) -> List[dict]:
+        by_room = await self.members.by_rooms([r["room_id"] for r in rooms])
+        return [{**r, **by_room[r["room_id"]]} for r in rooms]
+
+    async def list_rooms_for_user(self, uid: str) -> List[dict]:
+        return self._rooms_in(await self.members.room_ids_for_user(uid))
+
+    async def list_pending_for_user(self, uid: str) -> List[dict]:
+        rooms = self._rooms_in(await self.members.room_ids_for_user(uid, state=PENDING))
+        return [{k: r[k] for k in ("_id", "room_id", "name", "color_id") if k in r} for r in rooms]
+
+    def _rooms_in(self, room_ids: List[str]) -> List[dict]:
+        return [dict(self._rooms[r]) for r in room_ids if r in self._rooms][:100]
+
+    async def add_member(self, room_id: str, uid: str):
+        await self.members.add_member(room_id, uid)
+
+    async def add_pending_member(self, room_id: str, uid: str) -> bool:
+        return await self.members.add_pending(room_id, uid)
+
+    async def approve_pending_member(self, room_id: str, uid: str) -> bool:
+        return await self.members.approve(room_id, uid)
+
+    async def approve_pending_members(self, room_id: str, uids: List[str]) -> List[str]:
+        return await self.members.approve_many(room_id, uids)
+
+    async def remove_pending_members(self, room_id: str, uids: List[str]) -> List[str]:
+        return await self.members.remove_pending_many(room_id, uids)
+
+    async def remove_expired_pending_members(self, room_id: str, requested_before: datetime) -> List[str]:
+        return await self.members.remove_expired_pending(room_id, requested_before)
+
+    async def remove_pending_member(self, room_id: str, uid: str) -> bool:
+        return await self.members.remove_pending(room_id, uid)
+
+    async def remove_member(self, room_id: str, uid: str):
+        await self.members.remove_member(room_id, uid)
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+class MemoryPointRecordRepository:
+    def __init__(self):
+        self._by_room = _Timeline()
+        self._by_uid = _Timeline()
+        self._all = _Timeline()
+        self._rounds: set[tuple[str, str]] = set()
+        # 追加時に足し込む残高: room_id → uid → 合計 / uid → 全ルーム合計
+        self._room_totals: dict[str, dict[str, int]] = defaultdict(dict)
+        self._uid_totals: dict[str, int] = defaultdict(int)
+
+    async def create(self, data: dict) -> str:
+        if (data["room_id"], data["round_id"]) in self._rounds:
+            raise DuplicateKeyError(f"duplicate round: {data['room_id']}/{data['round_id']}")
+        data.setdefault("created_at", datetime.now())
+        data.setdefault("is_deleted", False)
+        data.setdefault("_id", ObjectId())
+        doc = dict(data)
+        self._rounds.add((doc["room_id"], doc["round_id"]))
+        self._all.add(None, doc)
+        self._by_room.add(doc["room_id"], doc)
+        for uid in dict.fromkeys(p["uid"] for p in doc.get("points", [])):
+            self._by_uid.add(uid, doc)
+        if not doc["is_deleted"]:
+            totals = self._room_totals[doc["room_id"]]
+            for p in doc.get("points", []):
+                totals[p["uid"]] = totals.get(p["uid"], 0) + p["value"]
+                self._uid_totals[p["uid"]] += p["value"]
+        return doc["round_id"]
+
+    def _scan(self, query: dict, descending: bool = False) -> Iterable[dict]:
+        if (room_id := _scope_value(query, "room_id")) is not None:
+            return self._by_room.scan(room_id, descending)
+        if (uid := _scope_value(query, "points.uid")) is not None:
+            return self._by_uid.scan(uid, descending)
+        return self._all.scan(None, descending)
+
+    def _live(self, query: dict) -> dict:
+        return {"$and": [query, {"is_deleted": False}]}
+
+    async def history(self, room_id: str, include_archived: bool = False, limit: int = 100) -> List[dict]:
+        return await self._history({"room_id": room_id}, limit)
+
+    async def history_by_uid(self, uid: str, include_archived: bool = False, limit: int = 100) -> List[dict]:
+        return await self._history({"points.uid": uid}, limit)
+
+    async def _history(self, query: dict, limit: int) -> List[dict]:
+        items = []
+        async for doc in _stream(self._scan(query, descending=True), self._live(query), limit):
+            doc.pop("_id", None)
+            items.append(doc)
+            if len(items) == limit:
+                break
+        return items
+
+    async def iter_records(
+        self,
+        query: dict,
+        batch_size: int = 500,
+        include_archived: bool = False,
+        descending: bool = False,
+    ) -> AsyncIterator[dict]:
+        async for doc in _stream(self._scan(query, descending), self._live(query), batch_size):
+            yield doc
+
+    async def sum_by_uid(
+        self, query: dict, uid: Optional[str] = None, include_archived: bool = False
+    ) -> dict[str, int]:
+        totals: dict[str, int] = {}
+        for doc in self._scan(query):
+            if not doc["is_deleted"] and matches(doc, query):
+                for p in doc.get("points", []):
+                    if uid is None or p["uid"] == uid:
+                        totals[p["uid"]] = totals.get(p["uid"], 0) + p["value"]
+        return totals
+
+    async def room_balances(self, room_id: str) -> dict[str, int]:
+        return dict(self._room_totals.get(room_id, {}))
+
+    async def balance_of(self, uid: str) -> int:
+        return self._uid_totals.get(uid, 0)
+
+    async def balances_for_rooms(self, uid: str, room_ids: List[str]) -> dict[str, int]:
+        return {r: self._room_totals.get(r, {}).get(uid, 0) for r in room_ids}
+
+    async def latest_version(self, room_id: str) -> str:
+        for doc in self._by_room.scan(room_id, descending=True):
+            if not doc["is_deleted"]:
+                return str(doc["_id"])
+        return "0"
+
+    async def iter_running_totals(self, room_id: str, batch_size: int = 500) -> AsyncIterator[dict]:
+        rows: dict[str, list[dict]] = defaultdict(list)
+        running: dict[str, int] = defaultdict(int)
+        for doc in self._by_room.scan(room_id):
+            if doc["is_deleted"]:
+                continue
+            for p in doc.get("points", []):
+                running[p["uid"]] += p["value"]
+                rows[p["uid"]].append({
+                    "uid": p["uid"],
+                    "created_at": doc["created_at"],
+                    "round_id": doc["round_id"],
+                    "balance": running[p["uid"]],
+                })
+        n = 0
+        for uid in sorted(rows):
+            for row in rows[uid]:
+                yield row
+                n += 1
+                if n % batch_size == 0:
+                    await asyncio.sleep(0)
+
+    async def archive_room(
+        self,
+        room_id: str,
+        cutoff: Optional[datetime] = None,
+        keep_recent: Optional[int] = None,
+        bucket_size: int = 200,
+    ) -> int:
+        # cold tier は無い
+        return 0
+
+    async def room_ids(self) -> List[str]:
+        return self._by_room.keys()
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+class MemorySettlementRepository:
+    def __init__(self):
+        self._by_room = _Timeline()
+        self._by_from = _Timeline()
+        self._by_to = _Timeline()
+        self._all = _Timeline()
+
+    async def create(self, data: dict) -> str:
+        """精算の記録を追加する（Mongo 版には無い。テスト・ベンチマークの投入用）"""
+        data.setdefault("created_at", datetime.now())
+        data.setdefault("is_deleted", False)
+        data.setdefault("_id", ObjectId())
+        doc = dict(data)
+        self._all.add(None, doc)
+        self._by_room.add(doc["room_id"], doc)
+        self._by_from.add(doc["from_uid"], doc)
+        self._by_to.add(doc["to_uid"], doc)
+        return str(doc["_id"])
+
+    async def history(self, room_id: str) -> List[dict]:
+        return _with_settlement_ids(d for d in self._by_room.scan(room_id) if not d["is_deleted"])
+
+    async def history_by_uid(self, uid: str) -> List[dict]:
+        docs = heapq.merge(self._by_from.scan(uid), self._by_to.scan(uid), key=lambda d: (d["created_at"], d["_id"]))
+        seen: set = set()
+        unique = (d for d in docs if not d["is_deleted"] and not (d["_id"] in seen or seen.add(d["_id"])))
+        return _with_settlement_ids(unique)
+
+    async def iter_records(
+        self, query: dict, batch_size: int = 500, descending: bool = False
+    ) -> AsyncIterator[dict]:
+        if (room_id := _scope_value(query, "room_id")) is not None:
+            docs = self._by_room.scan(room_id, descending)
+        elif (uid := _scope_value(query, "from_uid")) is not None:
+            docs = self._by_from.scan(uid, descending)
+        elif (uid := _scope_value(query, "to_uid")) is not None:
+            docs = self._by_to.scan(uid, descending)
+        else:
+            docs = self._all.scan(None, descending)
+        async for doc in _stream(docs, {"$and": [query, {"is_deleted": False}]}, batch_size):
+            yield doc
+
+    async def ensure_indexes(self) -> None:
+        pass
+
+
+def _with_settlement_ids(docs: Iterable[dict], limit: int = 100) -> List[dict]:
+    items = []
+    for doc in docs:
+        item = dict(doc)
+        item["settlement_id"] = str(item.pop("_id"))
+        items.append(item)
+        if len(items) == limit:
+            break
+    return items
+
+
+# ─── Redis 側（期限付き） ───
+
+class _Expiring:
+    """キー単位の期限（秒）を持つ dict。期限切れは読み書きのたびに期限順のヒープから消す"""
+
+    def __init__(self, clock: Callable[[], float]):
+        self.clock = clock
+        self._data: dict = {}
+        self._deadlines: dict = {}
+        self._heap: list = []
+
+    def __len__(self) -> int:
+        self._sweep()
+        return len(self._data)
+
+    def get(self, key, default=None):
+        self._sweep()
+        return self._data.get(key, default)
+
+    def put(self, key, value, ttl: Optional[float] = None) -> None:
+        """ttl 無しなら既存の期限を保つ（HSET と同じ）"""
+        self._sweep()
+        self._data[key] = value
+        if ttl is not None:
+            self.expire(key, ttl)
+
+    def expire(self, key, ttl: float) -> None:
+        # 無いキーには何もしない（EXPIRE と同じ）
+        if key in self._data:
+            deadline = self.clock() + ttl
+            self._deadlines[key] = deadline
+            heapq.heappush(self._heap, (deadline, key))
+
+    def ttl(self, key) -> int:
+        """残り秒数。キーが無ければ -2、期限が無ければ -1（TTL と同じ）"""
+        self._sweep()
+        if key not in self._data:
+            return -2
+        if key not in self._deadlines:
+            return -1
+        return math.ceil(self._deadlines[key] - self.clock())
+
+    def delete(self, *keys) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+            self._deadlines.pop(key, None)
+
+    def _sweep(self) -> None:
+        now = self.clock()
+        while self._heap and self._heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._heap)
+            # 期限を延ばしたキーは古い方のエントリを読み捨てる
+            if self._deadlines.get(key) == deadline:
+                del self._data[key]
+                del self._deadlines[key]
+
+
+class MemoryPresenceRepository:
+    def __init__(self):
+        self._rooms: dict[str, set[str]] = defaultdict(set)
+
+    async def add(self, room_id: str, uid: str) -> None:
+        self._rooms[room_id].add(uid)
+
+    async def remove(self, room_id: str, uid: str) -> None:
+        self._rooms[room_id].discard(uid)
+
+    async def remove_everywhere(self, uid: str) -> None:
+        for uids in self._rooms.values():
+            uids.discard(uid)
+
+    async def uids(self, room_id: str) -> list[str]:
+        return list(self._rooms.get(room_id, ()))
+
+    async def counts(self, room_ids: list[str]) -> dict[str, int]:
+        return {room_id: len(self._rooms.get(room_id, ())) for room_id in room_ids}
+
+
+class MemoryIdCounterRepository:
+    def __init__(self):
+        self._high: dict[str, int] = defaultdict(int)
+
+    async def reserve(self, namespace: str, size: int) -> int:
+        self._high[namespace] += size
+        return self._high[namespace]
+
+
+class MemoryRoundCacheRepository:
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.monotonic,
+        presence: Optional[MemoryPresenceRepository] = None,
+    ):
+        self._store = _Expiring(clock)
+        # 在室ユーザー（Storage.presence() と共有する）
+        self.presence = presence or MemoryPresenceRepository()
+
+    async def start(self, room_id: str, round_id: str, participants: list[str], ttl: int = 180) -> None:
+        meta = self._store.get(("round", room_id)) or {}
+        self._store.put(("round", room_id), {**meta, "round_id": round_id, "participants": list(participants)})
+        for kind in ("round", "subs", "approvals"):
+            self._store.expire((kind, room_id), ttl)
+
+    async def get_round_id(self, room_id: str) -> str | None:
+        return (self._store.get(("round", room_id)) or {}).get("round_id")
+
+    async def add_submission(self, room_id: str, uid: str, value: int, ttl: int = 180) -> str | None:
+        subs = self._store.get(("subs", room_id))
+        if subs is None:
+            subs = {}
+            self._store.put(("subs", room_id), subs)
+        subs[uid] = int(value)
+        self._store.expire(("subs", room_id), ttl)
+        self._store.expire(("round", room_id), ttl)
+        return await self.get_round_id(room_id)
+
+    async def get_submissions(self, room_id: str) -> dict[str, int]:
+        return dict(self._store.get(("subs", room_id)) or {})
+
+    async def add_approval(self, room_id: str, uid: str, ttl: int = 180) -> None:
+        approvals = self._store.get(("approvals", room_id))
+        if approvals is None:
+            approvals = set()
+            self._store.put(("approvals", room_id), approvals)
+        approvals.add(uid)
+        self._store.expire(("approvals", room_id), ttl)
+        self._store.expire(("round", room_id), ttl)
+
+    async def get_approvals(self, room_id: str) -> set[str]:
+        return set(self._store.get(("approvals", room_id)) or ())
+
+    async def get_participants(self, room_id: str) -> list[str]:
+        return list((self._store.get(("round", room_id)) or {}).get("participants", []))
+
+    async def present_uids(self, room_id: str) -> list[str]:
+        return await self.presence.uids(room_id)
+
+    async def status(self, room_id: str) -> dict | None:
+        meta = self._store.get(("round", room_id))
+        if not meta or not meta.get("round_id"):
+            return None
+        participants = list(meta.get("participants", []))
+        values = await self.get_submissions(room_id)
+        complete = bool(participants) and len(values) == len(participants)
+        return {
+            "room_id":      room_id,
+            "round_id":     meta["round_id"],
+            "participants": participants,
+            "submitted":    sorted(values),
+            "sum":          sum(values.values()),
+            "complete":     complete,
+            "table":        values if complete else None,
+            "approvals":    sorted(await self.get_approvals(room_id)),
+            "ttl":          max(self._store.ttl(("round", room_id)), 0),
+        }
+
+    async def clear(self, room_id: str) -> None:
+        self._store.delete(("round", room_id), ("subs", room_id), ("approvals", room_id))
+
+
+class MemorySettlementCacheRepository:
+    TTL = 180
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self._store = _Expiring(clock)
+        # 受信者ごとの索引（作成順）。期限切れのキーは pending_for で落とす
+        self._inbox: dict[str, dict[tuple, None]] = defaultdict(dict)
+
+    async def cache_request(self, room_id: str, from_uid: str, to_uid: str, amount: int) -> None:
+        key = (room_id, from_uid, to_uid)
+        self._store.put(key, {
+            "room_id": room_id,
+            "from_uid": from_uid,
+            "to_uid": to_uid,
+            "amount": int(amount),
+        }, ttl=self.TTL)
+        inbox = self._inbox[to_uid]
+        inbox.pop(key, None)
+        inbox[key] = None
+
+    async def get_request(self, room_id: str, from_uid: str, to_uid: str):
+        req = self._store.get((room_id, from_uid, to_uid))
+        return dict(req) if req else None
+
+    async def clear_request(self, room_id: str, from_uid: str, to_uid: str) -> None:
+        key = (room_id, from_uid, to_uid)
+        self._store.delete(key)
+        self._inbox.get(to_uid, {}).pop(key, None)
+
+    async def pending_for(self, to_uid: str) -> List[dict]:
+        inbox = self._inbox.get(to_uid)
+        if not inbox:
+            return []
+        result = []
+        for key in list(inbox):
+            req = self._store.get(key)
+            if req is None:
+                del inbox[key]
+            else:
+                result.append(dict(req))
+        return result
+
+
+class MemorySeriesCacheRepository:
+    def __init__(self, clock: Callable[[], float] = time.monotonic, ttl: int = 600):
+        self._store = _Expiring(clock)
+        self.ttl = ttl
+
+    async def get(self, room_id: str, version: str, variant: str) -> Optional[dict]:
+        # Redis 版と同じく JSON で持つ（呼び出し側が書き換えても共有されない）
+        raw = self._store.get((room_id, version, variant))
+        return json.loads(raw) if raw else None
+
+    async def set(self, room_id: str, version: str, variant: str, value: dict) -> None:
+        self._store.put((room_id, version, variant), json.dumps(value), ttl=self.ttl)
+
+
+class MemoryProfileCacheRepository:
+    def __init__(self, store: _Expiring, ttl: int = 3600, tombstone_ttl: int = PROFILE_TOMBSTONE_TTL):
+        self._store = store
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+
+    async def get_many(self, uids: list[str]) -> dict[str, dict]:
+        found = {}
+        for uid in uids:
+            if (p := self._store.get(uid)) is not None and "uid" in p:
+                found[uid] = dict(p)
+        return found
+
+    async def set_many(self, profiles: list[dict]) -> None:
+        for p in profiles:
+            if "deleted" in self._store.get(p["uid"], {}):
+                continue
+            self._store.put(p["uid"], {
+                "uid": p["uid"],
+                "display_name": p["display_name"],
+                "icon_url": p.get("icon_url") or None,
+                "registered_at": p["registered_at"],
+            }, ttl=self.ttl)
+
+    async def delete(self, uid: str) -> None:
+        self._store.put(uid, {"deleted": True}, ttl=self.tombstone_ttl)
+
+    async def publish_invalidation(self, uid: str) -> None:
+        # 1プロセスで完結するので、他ワーカーの L1 は無い
+        pass
+
+
+class _SortedScores:
+    """sorted set 相当。(score, uid) 昇順のリストを持ち、ZREVRANGE の並びは末尾から読む"""
+
+    def __init__(self):
+        self._scores: dict[str, int] = {}
+        self._order: list[tuple[int, str]] = []
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def incr(self, uid: str, delta: int) -> None:
+        old = self._scores.get(uid)
+        if old is not None:
+            del self._order[bisect_left(self._order, (old, uid))]
+        score = (old or 0) + delta
+        self._scores[uid] = score
+        insort(self._order, (score, uid))
+
+    def score(self, uid: str) -> Optional[int]:
+        return self._scores.get(uid)
+
+    def rank(self, uid: str) -> Optional[int]:
+        if (score := self._scores.get(uid)) is None:
+            return None
+        return len(self._order) - 1 - bisect_left(self._order, (score, uid))
+
+    def page(self, start: int, stop: int) -> list[tuple[str, int]]:
+        n = len(self._order)
+        stop = min(stop, n - 1)
+        return [(uid, score) for score, uid in (self._order[n - 1 - i] for i in range(max(start, 0), stop + 1))]
+
+    def items(self) -> dict[str, int]:
+        return dict(self._scores)
+
+
+class MemoryLeaderboardRepository:
+    def __init__(self):
+        self._boards: dict[Optional[str], _SortedScores] = defaultdict(_SortedScores)
+
+    async def record(self, room_id: str, points: list[dict]) -> None:
+        for p in points:
+            self._boards[room_id].incr(p["uid"], p["value"])
+            self._boards[None].incr(p["uid"], p["value"])
+
+    async def adjust(self, deltas: dict[str, int], room_id: Optional[str] = None) -> None:
+        for uid, delta in deltas.items():
+            self._boards[room_id].incr(uid, delta)
+
+    async def head(
+        self, uid: str, limit: int, room_id: Optional[str] = None
+    ) -> tuple[list[tuple[str, int]], Optional[int], Optional[int], int]:
+        board = self._boards[room_id]
+        return board.page(0, limit - 1), board.rank(uid), board.score(uid), len(board)
+
+    async def page(self, start: int, stop: int, room_id: Optional[str] = None) -> list[tuple[str, int]]:
+        return self._boards[room_id].page(start, stop)
+
+    async def scores(self, room_id: Optional[str] = None) -> dict[str, int]:
+        return self._boards[room_id].items()
+
+    async def scores_of(self, uids: list[str], room_id: Optional[str] = None) -> dict[str, int]:
+        board = self._boards[room_id]
+        return {uid: board.score(uid) or 0 for uid in uids}
+
+
+class Storage:
+    """メモリ上のリポジトリ一式。同じ Storage から取り出したものは状態を共有する"""
+
+    def __init__(self, clock: Callable[[], float] = time.monotonic):
+        self.clock = clock
+        self._users = MemoryUserRepository()
+        self._rooms = MemoryRoomRepository(MemoryMemberRepository())
+        self._points = MemoryPointRecordRepository()
+        self._settlements = MemorySettlementRepository()
+        self._presence = MemoryPresenceRepository()
+        self._id_counters = MemoryIdCounterRepository()
+        self._round_cache = MemoryRoundCacheRepository(clock, self._presence)
+        self._settle_cache = MemorySettlementCacheRepository(clock)
+        self._series_cache = MemorySeriesCacheRepository(clock)
+        self._profiles = _Expiring(clock)
+        self._leaderboard = MemoryLeaderboardRepository()
+
+    def users(self) -> MemoryUserRepository:
+        return self._users
+
+    def rooms(self) -> MemoryRoomRepository:
+        return self._rooms
+
+    def points(self) -> MemoryPointRecordRepository:
+        return self._points
+
+    def settlements(self) -> MemorySettlementRepository:
+        return self._settlements
+
+    def round_cache(self) -> MemoryRoundCacheRepository:
+        return self._round_cache
+
+    def settle_cache(self) -> MemorySettlementCacheRepository:
+        return self._settle_cache
+
+    def series_cache(self) -> MemorySeriesCacheRepository:
+        return self._series_cache
+
+    def profile_cache(self, ttl: int = 3600) -> MemoryProfileCacheRepository:
+        return MemoryProfileCacheRepository(self._profiles, ttl=ttl)
+
+    def leaderboard(self) -> MemoryLeaderboardRepository:
+        return self._leaderboard
+
+    def presence(self) -> MemoryPresenceRepository:
+        return self._presence
+
+    def id_counters(self) -> MemoryIdCounterRepository:
+        return self._id_counters
@@ -1,53 +1,431 @@
 # src/repositories/misc_repo.py
 
 from motor.motor_asyncio import AsyncIOMotorDatabase
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from datetime import datetime
 from bson import ObjectId
+import json
+import time
 import redis.asyncio as redis
 
+from src.db import current_session, reader
+from src.redis_keys import keys
+from src.singleflight import flights, single_flight
+# ラウンドのキャッシュは round_cache_repo に一本化（旧 points:* 版は廃止）
+from src.repositories.round_cache_repo import RoundCacheRepository  # noqa: F401
+
+
+def _after(at: datetime, oid) -> dict:
+    """(created_at, _id) の並びで指定位置より後ろ"""
+    return {"$or": [
+        {"created_at": {"$gt": at}},
+        {"created_at": at, "_id": {"$gt": oid}},
+    ]}
+
+
+def _scope_value(query: dict, field: str):
+    """query（$and で包まれていてもよい）から field の等値条件を探す"""
+    if isinstance(query.get(field), str):
+        return query[field]
+    for sub in query.get("$and", []):
+        if (v := _scope_value(sub, field)) is not None:
+            return v
+    return None
+
 
 class PointRecordRepository:
+    """
+    point_records（hot）と point_records_archive（cold, ルームごとのバケット）の2層。
+    アーカイブ済み分の残高は point_balance_snapshots に繰り越して持つ。
+    """
+
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.point_records
+        self.archive = db.point_records_archive
+        self.snapshots = db.point_balance_snapshots
 
     async def create(self, data: dict) -> str:
         data.setdefault("created_at", datetime.now())
         data.setdefault("is_deleted", False)
-        await self.collection.insert_one(data)
+        await self.collection.insert_one(data, session=current_session())
+        self._invalidate(data["room_id"])
         return data["round_id"]
 
-    async def history(self, room_id: str) -> List[dict]:
-        cursor = self.collection.find(
-            {"room_id": room_id, "is_deleted": False}
+    def _invalidate(self, room_id: str) -> None:
+        # 書き込み前に始まった history を後続に共有しない
+        flights.invalidate(PointRecordRepository.history.__qualname__, self.collection.full_name, room_id)
+
+    @single_flight
+    async def history(self, room_id: str, include_archived: bool = False, limit: int = 100) -> List[dict]:
+        items = await self._history(
+            {"room_id": room_id, "is_deleted": False}, include_archived, limit,
+            route="PointRecordRepository.history",
         )
-        items = await cursor.to_list(length=100)
         for item in items:
             # ObjectId を取り除く
             item.pop("_id", None)
         return items
 
-    async def history_by_uid(self, uid: str) -> List[dict]:
-        cursor = self.collection.find({
-            "points.uid": uid,
-            "is_deleted": False,
-        })
-        items = await cursor.to_list(length=100)
+    async def history_by_uid(self, uid: str, include_archived: bool = False, limit: int = 100) -> List[dict]:
+        items = await self._history(
+            {"points.uid": uid, "is_deleted": False}, include_archived, limit,
+            route="PointRecordRepository.history_by_uid",
+        )
         # Mongo の _id は不要なので削除
         for item in items:
             item.pop("_id", None)
         return items
 
+    async def iter_records(
+        self,
+        query: dict,
+        batch_size: int = 500,
+        include_archived: bool = False,
+        descending: bool = False,
+    ) -> AsyncIterator[dict]:
+        """created_at, _id 順（既定は昇順）でカーソルから逐次取り出す（全件をメモリに載せない）"""
+        order = -1 if descending else 1
+        hot_query, archived_query = query, None
+        if include_archived:
+            hot_query, archived_query = await self._split_tiers(query)
+        route = "PointRecordRepository.iter_records"
+        cursor = (
+            reader(self.collection, route)
+            .find({**hot_query, "is_deleted": False}, session=current_session())
+            .sort([("created_at", order), ("_id", order)])
+            .batch_size(batch_size)
+        )
+        if archived_query is None:
+            async for doc in cursor:
+                yield doc
+            return
+        from src.utils import merge_sorted
+        merged = merge_sorted(
+            self._iter_archived(archived_query, route, batch_size=batch_size, order=order),
+            cursor,
+            key=lambda d: (d["created_at"], d["_id"]),
+            reverse=descending,
+        )
+        async for doc in merged:
+            yield doc
+
+    async def sum_by_uid(
+        self, query: dict, uid: Optional[str] = None, include_archived: bool = False
+    ) -> dict[str, int]:
+        """query に一致するレコードの uid ごとのポイント合計"""
+        return await self._sum(query, uid, include_archived, route="PointRecordRepository.sum_by_uid")
+
+    async def _sum(self, query: dict, uid: Optional[str], include_archived: bool, route: str) -> dict[str, int]:
+        archived_query = None
+        if include_archived:
+            query, archived_query = await self._split_tiers(query)
+        pipeline = [{"$match": {**query, "is_deleted": False}}]
+        if archived_query is not None:
+            pipeline.append(self._union_archived(archived_query))
+        pipeline.append({"$unwind": "$points"})
+        if uid is not None:
+            pipeline.append({"$match": {"points.uid": uid}})
+        pipeline.append({"$group": {"_id": "$points.uid", "total": {"$sum": "$points.value"}}})
+        cursor = reader(self.collection, route).aggregate(
+            pipeline, allowDiskUse=True, session=current_session()
+        )
+        return {doc["_id"]: doc["total"] async for doc in cursor}
+
+    async def room_balances(self, room_id: str) -> dict[str, int]:
+        """ルーム内の uid ごとの残高 = 繰越スナップショット + hot 側の合計"""
+        snap = await self.snapshots.find_one({"room_id": room_id}, session=current_session())
+        query: dict = {"room_id": room_id}
+        balances: dict[str, int] = {}
+        if snap:
+            query = {"$and": [query, _after(snap["through_at"], snap["through_id"])]}
+            balances = dict(snap.get("balances", {}))
+        sums = await self._sum(query, None, False, route="PointRecordRepository.room_balances")
+        for k, v in sums.items():
+            balances[k] = balances.get(k, 0) + v
+        return balances
+
+    async def balance_of(self, uid: str) -> int:
+        """全ルーム合計での uid の残高"""
+        snaps = await self.snapshots.find({"uids": uid}, session=current_session()).to_list(length=None)
+        total = sum(s.get("balances", {}).get(uid, 0) for s in snaps)
+        query: dict = {"points.uid": uid}
+        if snaps:
+            query = {"$and": [query, {"$or": [
+                {"room_id": {"$nin": [s["room_id"] for s in snaps]}},
+                *({"room_id": s["room_id"], **_after(s["through_at"], s["through_id"])} for s in snaps),
+            ]}]}
+        sums = await self._sum(query, uid, False, route="PointRecordRepository.balance_of")
+        return total + sums.get(uid, 0)
+
+    async def latest_version(self, room_id: str) -> str:
+        """ルームの最新レコードの _id。新しいラウンドが確定するたびに変わる"""
+        doc = await self.collection.find_one(
+            {"room_id": room_id, "is_deleted": False},
+            projection={"_id": 1},
+            sort=[("created_at", -1), ("_id", -1)],
+            session=current_session(),
+        )
+        if doc:
+            return str(doc["_id"])
+        snap = await self.snapshots.find_one(
+            {"room_id": room_id}, projection={"through_id": 1}, session=current_session()
+        )
+        return str(snap["through_id"]) if snap else "0"
+
+    async def iter_running_totals(self, room_id: str, batch_size: int = 500) -> AsyncIterator[dict]:
+        """
+        uid ごとの累積ポイントを ($setWindowFields で) 計算し、
+        uid, created_at 昇順で {uid, created_at, round_id, balance} を流す
+        """
+        query, archived_query = await self._split_tiers({"room_id": room_id})
+        pipeline = [{"$match": {**query, "is_deleted": False}}]
+        if archived_query is not None:
+            pipeline.append(self._union_archived(archived_query))
+        pipeline += [
+            {"$unwind": "$points"},
+            {"$project": {
+                "_id": 1,
+                "uid": "$points.uid",
+                "value": "$points.value",
+                "round_id": 1,
+                "created_at": 1,
+            }},
+            {"$setWindowFields": {
+                "partitionBy": "$uid",
+                "sortBy": {"created_at": 1, "_id": 1},
+                "output": {"balance": {
+                    "$sum": "$value",
+                    "window": {"documents": ["unbounded", "current"]},
+                }},
+            }},
+            {"$sort": {"uid": 1, "created_at": 1, "_id": 1}},
+            {"$project": {"_id": 0, "uid": 1, "created_at": 1, "round_id": 1, "balance": 1}},
+        ]
+        cursor = reader(self.collection, "PointRecordRepository.iter_running_totals").aggregate(
+            pipeline, allowDiskUse=True, batchSize=batch_size, session=current_session()
+        )
+        async for doc in cursor:
+            yield doc
+
+    # ─── アーカイブ（cold tier） ───
+
+    async def _split_tiers(self, query: dict) -> tuple[dict, Optional[dict]]:
+        """
+        query を hot 用 / cold 用に分ける。スナップショットの through を境界にするので、
+        archive_room の途中（バケット挿入後・hot 削除前）でも二重に数えない。
+        cold 側に該当がなければ None。
+        """
+        if (room_id := _scope_value(query, "room_id")) is not None:
+            snap_query = {"room_id": room_id}
+        elif (uid := _scope_value(query, "points.uid")) is not None:
+            snap_query = {"uids": uid}
+        else:
+            snap_query = {}
+        snaps = await self.snapshots.find(snap_query, session=current_session()).to_list(length=None)
+        if not snaps:
+            return query, None
+        hot = {"$or": [
+            {"room_id": {"$nin": [s["room_id"] for s in snaps]}},
+            *({"room_id": s["room_id"], **_after(s["through_at"], s["through_id"])} for s in snaps),
+        ]}
+        cold = {"$or": [
+            {"room_id": s["room_id"], "$nor": [_after(s["through_at"], s["through_id"])]}
+            for s in snaps
+        ]}
+        return {"$and": [query, hot]}, {"$and": [query, cold]}
+
+    async def _history(self, query: dict, include_archived: bool, limit: int, route: str) -> List[dict]:
+        """新しい順に limit 件。include_archived なら hot を先に読み、足りない分を cold の新しい順で続ける"""
+        hot_query, archived_query = await self._split_tiers(query) if include_archived else (query, None)
+        items = await reader(self.collection, route).find(
+            hot_query, session=current_session()
+        ).sort([("created_at", -1), ("_id", -1)]).to_list(length=limit)
+        if archived_query is not None and len(items) < limit:
+            items += [
+                doc async for doc in self._iter_archived(archived_query, route, limit=limit - len(items), order=-1)
+            ]
+        return items
+
+    def _archived_pipeline(self, query: dict) -> list[dict]:
+        prefilter = {}
+        if (room_id := _scope_value(query, "room_id")) is not None:
+            prefilter["room_id"] = room_id
+        if (uid := _scope_value(query, "points.uid")) is not None:
+            prefilter["uids"] = uid
+        return [
+            {"$match": prefilter},
+            {"$unwind": "$records"},
+            {"$replaceRoot": {"newRoot": "$records"}},
+            {"$match": {**query, "is_deleted": False}},
+        ]
+
+    def _union_archived(self, query: dict) -> dict:
+        return {"$unionWith": {"coll": self.archive.name, "pipeline": self._archived_pipeline(query)}}
+
+    async def _iter_archived(
+        self, query: dict, route: str, batch_size: int = 500, limit: int = 0, order: int = 1
+    ) -> AsyncIterator[dict]:
+        pipeline = self._archived_pipeline(query) + [{"$sort": {"created_at": order, "_id": order}}]
+        if limit:
+            pipeline.append({"$limit": limit})
+        cursor = reader(self.archive, route).aggregate(
+            pipeline, allowDiskUse=True, batchSize=batch_size, session=current_session()
+        )
+        async for doc in cursor:
+            yield doc
+
+    async def archive_room(
+        self,
+        room_id: str,
+        cutoff: Optional[datetime] = None,
+        keep_recent: Optional[int] = None,
+        bucket_size: int = 200,
+    ) -> int:
+        """
+        cutoff より古い / 直近 keep_recent 件より古いレコードを
+        bucket_size 件ずつバケットにまとめて cold 側へ移す。移した件数を返す。
+        途中で落ちても再実行で続きから処理できる（バケット _id は先頭レコードで決まる）。
+        """
+        eligible: list[dict] = []
+        if cutoff is not None:
+            eligible.append({"created_at": {"$lt": cutoff}})
+        if keep_recent is not None:
+            if keep_recent <= 0:
+                eligible.append({})
+            else:
+                boundary = await self.collection.find_one(
+                    {"room_id": room_id},
+                    projection={"created_at": 1},
+                    sort=[("created_at", -1), ("_id", -1)],
+                    skip=keep_recent - 1,
+                )
+                if boundary:
+                    eligible.append({"$or": [
+                        {"created_at": {"$lt": boundary["created_at"]}},
+                        {"created_at": boundary["created_at"], "_id": {"$lt": boundary["_id"]}},
+                    ]})
+        if not eligible:
+            return 0
+
+        snap = await self.snapshots.find_one({"room_id": room_id})
+        if snap:
+            # 前回スナップショット反映後に落ちて hot に残ったものを掃除
+            await self.collection.delete_many({
+                "room_id": room_id,
+                "$nor": [_after(snap["through_at"], snap["through_id"])],
+            })
+
+        moved = 0
+        while True:
+            conds: list[dict] = [{"room_id": room_id}, {"$or": eligible}]
+            if snap:
+                conds.append(_after(snap["through_at"], snap["through_id"]))
+            batch = await (
+                self.collection.find({"$and": conds})
+                .sort([("created_at", 1), ("_id", 1)])
+                .limit(bucket_size)
+                .to_list(length=bucket_size)
+            )
+            if not batch:
+                break
+
+            first, last = batch[0], batch[-1]
+            uids = sorted({p["uid"] for rec in batch for p in rec.get("points", [])})
+            bucket_id = f"{room_id}:{first['_id']}"
+            await self.archive.replace_one(
+                {"_id": bucket_id},
+                {
+                    "_id": bucket_id,
+                    "room_id": room_id,
+                    "start_at": first["created_at"],
+                    "end_at": last["created_at"],
+                    "count": len(batch),
+                    "uids": uids,
+                    "records": batch,
+                },
+                upsert=True,
+            )
+
+            inc: dict[str, int] = {}
+            for rec in batch:
+                if rec.get("is_deleted"):
+                    continue
+                for p in rec.get("points", []):
+                    inc[f"balances.{p['uid']}"] = inc.get(f"balances.{p['uid']}", 0) + p["value"]
+            update = {
+                "$set": {
+                    "through_at": last["created_at"],
+                    "through_id": last["_id"],
+                    "updated_at": datetime.now(),
+                },
+                "$addToSet": {"uids": {"$each": uids}},
+            }
+            if inc:
+                update["$inc"] = inc
+            # through が前回値のままの場合だけ反映（他ワーカーと競合したら打ち切る）
+            result = await self.snapshots.update_one(
+                {"room_id": room_id, "through_id": snap["through_id"] if snap else None},
+                update,
+                upsert=snap is None,
+            )
+            if snap and result.matched_count == 0:
+                break
+
+            await self.collection.delete_many({"_id": {"$in": [rec["_id"] for rec in batch]}})
+            snap = {"through_at": last["created_at"], "through_id": last["_id"]}
+            moved += len(batch)
+            self._invalidate(room_id)
+        return moved
+
+    async def balances_for_rooms(self, uid: str, room_ids: List[str]) -> dict[str, int]:
+        """uid のルーム別残高を、スナップショット1回 + 集計1回でまとめて求める"""
+        if not room_ids:
+            return {}
+        snaps = await self.snapshots.find(
+            {"room_id": {"$in": room_ids}}, session=current_session()
+        ).to_list(length=None)
+        balances = {r: 0 for r in room_ids}
+        for s in snaps:
+            balances[s["room_id"]] += s.get("balances", {}).get(uid, 0)
+        snapped = {s["room_id"]: s for s in snaps}
+        scope = {"$or": [
+            {"room_id": {"$in": [r for r in room_ids if r not in snapped]}},
+            *({"room_id": s["room_id"], **_after(s["through_at"], s["through_id"])} for s in snaps),
+        ]}
+        pipeline = [
+            {"$match": {"$and": [{"points.uid": uid, "is_deleted": False}, scope]}},
+            {"$unwind": "$points"},
+            {"$match": {"points.uid": uid}},
+            {"$group": {"_id": "$room_id", "total": {"$sum": "$points.value"}}},
+        ]
+        cursor = reader(self.collection, "PointRecordRepository.balances_for_rooms").aggregate(
+            pipeline, session=current_session()
+        )
+        async for doc in cursor:
+            balances[doc["_id"]] += doc["total"]
+        return balances
+
+    async def room_ids(self) -> List[str]:
+        return await self.collection.distinct("room_id")
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("room_id", 1), ("created_at", 1), ("_id", 1)])
+        await self.collection.create_index([("points.uid", 1), ("created_at", 1), ("_id", 1)])
+        await self.collection.create_index([("room_id", 1), ("round_id", 1)], unique=True)
+        await self.archive.create_index([("room_id", 1), ("start_at", 1)])
+        await self.archive.create_index([("uids", 1), ("start_at", 1)])
+        await self.snapshots.create_index("room_id", unique=True)
+        await self.snapshots.create_index("uids")
+
 
 class SettlementRepository:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.settlements
 
-
-
+    @single_flight
     async def history(self, room_id: str) -> List[dict]:
-        cursor = self.collection.find(
-            {"room_id": room_id, "is_deleted": False}
+        cursor = reader(self.collection, "SettlementRepository.history").find(
+            {"room_id": room_id, "is_deleted": False}, session=current_session()
         )
         items = await cursor.to_list(length=100)
         for item in items:
@@ -55,22 +433,60 @@ class SettlementRepository:
         return items
 
     async def history_by_uid(self, uid: str) -> List[dict]:
-        cursor = self.collection.find({
+        cursor = reader(self.collection, "SettlementRepository.history_by_uid").find({
             "$or": [{"from_uid": uid}, {"to_uid": uid}],
             "is_deleted": False
-        })
+        }, session=current_session())
         items = await cursor.to_list(length=100)
         for item in items:
             item["settlement_id"] = str(item.pop("_id"))
         return items
 
+    async def iter_records(
+        self, query: dict, batch_size: int = 500, descending: bool = False
+    ) -> AsyncIterator[dict]:
+        order = -1 if descending else 1
+        cursor = (
+            reader(self.collection, "SettlementRepository.iter_records")
+            .find({**query, "is_deleted": False}, session=current_session())
+            .sort([("created_at", order), ("_id", order)])
+            .batch_size(batch_size)
+        )
+        async for doc in cursor:
+            yield doc
+
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index([("room_id", 1), ("created_at", 1), ("_id", 1)])
+        await self.collection.create_index([("from_uid", 1), ("created_at", 1), ("_id", 1)])
+        await self.collection.create_index([("to_uid", 1), ("created_at", 1), ("_id", 1)])
+
+
+class SeriesCacheRepository:
+    """累積ポイント系列のキャッシュ。キーに room の version を含めるので明示的な無効化は不要"""
+
+    def __init__(self, redis_client: redis.Redis, ttl: int = 600):
+        self.redis = redis_client
+        self.ttl = ttl
+
+    def _key(self, room_id: str, version: str, variant: str) -> str:
+        return keys.series(room_id, version, variant)
+
+    async def get(self, room_id: str, version: str, variant: str) -> Optional[dict]:
+        raw = await self.redis.get(self._key(room_id, version, variant))
+        return json.loads(raw) if raw else None
+
+    async def set(self, room_id: str, version: str, variant: str, value: dict) -> None:
+        await self.redis.set(self._key(room_id, version, variant), json.dumps(value), ex=self.ttl)
+
 
 class SettlementCacheRepository:
+    TTL = 180
+
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
 
     def _key(self, room_id: str, from_uid: str, to_uid: str) -> str:
-        return f"settle:{room_id}:{from_uid}->{to_uid}"
+        return keys.settle_request(room_id, from_uid, to_uid)
 
     async def cache_request(self, room_id: str, from_uid: str, to_uid: str, amount: int) -> None:
         k = self._key(room_id, from_uid, to_uid)
@@ -80,7 +496,11 @@ class SettlementCacheRepository:
             "to_uid": to_uid,
             "amount": amount,
         })
-        await self.redis.expire(k, 180)
+        await self.redis.expire(k, self.TTL)
+        # 受信者ごとの索引（SCAN せずに自分宛てを引けるように）
+        inbox = keys.settle_inbox(to_uid)
+        await self.redis.zadd(inbox, {k: time.time() + self.TTL})
+        await self.redis.expire(inbox, self.TTL)
 
     async def get_request(self, room_id: str, from_uid: str, to_uid: str):
         k = self._key(room_id, from_uid, to_uid)
@@ -97,49 +517,25 @@ class SettlementCacheRepository:
     async def clear_request(self, room_id: str, from_uid: str, to_uid: str) -> None:
         k = self._key(room_id, from_uid, to_uid)
         await self.redis.delete(k)
+        await self.redis.zrem(keys.settle_inbox(to_uid), k)
 
-
-class RoundCacheRepository:
-    def __init__(self, redis_client: redis.Redis):
-        self.redis = redis_client
-
-    def _prefix(self, room_id: str) -> str:
-        return f"points:{room_id}"
-
-    async def start(self, room_id: str, round_id: str, participants: list[str]) -> None:
-        """
-        participants: ラウンド開始時に在室していたユーザーUIDリスト
-        """
-        p = self._prefix(room_id)
-        # round_id と開始時参加者を保存
-        await self.redis.hset(p, mapping={
-           "round_id":    round_id,
-            "participants": ",".join(participants),
-        })
-        await self.redis.delete(f"{p}:submissions", f"{p}:approvals")
-    async def get_round_id(self, room_id: str) -> Optional[str]:
-        val = await self.redis.hget(self._prefix(room_id), "round_id")
-        return val.decode() if val else None
-
-    async def add_submission(self, room_id: str, uid: str, value: int) -> Optional[str]:
-        p = self._prefix(room_id)
-        round_id = await self.get_round_id(room_id)
-        if not round_id:
-            return None
-        await self.redis.hset(f"{p}:submissions", uid, value)
-        return round_id
-
-    async def get_submissions(self, room_id: str) -> dict[str, int]:
-        data = await self.redis.hgetall(f"{self._prefix(room_id)}:submissions")
-        return {k.decode(): int(v) for k, v in data.items()}
-
-    async def add_approval(self, room_id: str, uid: str) -> None:
-        await self.redis.sadd(f"{self._prefix(room_id)}:approvals", uid)
-
-    async def get_approvals(self, room_id: str) -> List[str]:
-        members = await self.redis.smembers(f"{self._prefix(room_id)}:approvals")
-        return [m.decode() for m in members]
-
-    async def clear(self, room_id: str) -> None:
-        p = self._prefix(room_id)
-        await self.redis.delete(p, f"{p}:submissions", f"{p}:approvals")
+    async def pending_for(self, to_uid: str) -> List[dict]:
+        """to_uid 宛ての未処理リクエストを索引 + 1パイプラインで取得"""
+        inbox = keys.settle_inbox(to_uid)
+        await self.redis.zremrangebyscore(inbox, "-inf", time.time())
+        request_keys = await self.redis.zrange(inbox, 0, -1)
+        if not request_keys:
+            return []
+        pipe = self.redis.pipeline(transaction=False)
+        for k in request_keys:
+            pipe.hgetall(k)
+        result = []
+        for data in await pipe.execute():
+            if data and "amount" in data:
+                result.append({
+                    "room_id": data["room_id"],
+                    "from_uid": data["from_uid"],
+                    "to_uid": data["to_uid"],
+                    "amount": int(data["amount"]),
+                })
+        return result
@@ -0,0 +1,53 @@
+# src/repositories/mongo.py
+
+from src.db import get_db, get_redis
+from src.repositories.id_counter_repo import IdCounterRepository
+from src.repositories.leaderboard_repo import LeaderboardRepository
+from src.repositories.misc_repo import (
+    PointRecordRepository,
+    SeriesCacheRepository,
+    SettlementCacheRepository,
+    SettlementRepository,
+)
+from src.repositories.presence_repo import PresenceRepository
+from src.repositories.profile_cache_repo import ProfileCacheRepository
+from src.repositories.room_repo import RoomRepository
+from src.repositories.round_cache_repo import RoundCacheRepository
+from src.repositories.user_repo import UserRepository
+
+
+class Storage:
+    """Mongo / Redis のリポジトリ。呼ぶたびに作る（クライアントは db.py 側で共有）"""
+
+    def users(self) -> UserRepository:
+        return UserRepository(get_db())
+
+    def rooms(self) -> RoomRepository:
+        return RoomRepository(get_db())
+
+    def points(self) -> PointRecordRepository:
+        return PointRecordRepository(get_db())
+
+    def settlements(self) -> SettlementRepository:
+        return SettlementRepository(get_db())
+
+    def round_cache(self) -> RoundCacheRepository:
+        return RoundCacheRepository(get_redis())
+
+    def settle_cache(self) -> SettlementCacheRepository:
+        return SettlementCacheRepository(get_redis())
+
+    def series_cache(self) -> SeriesCacheRepository:
+        return SeriesCacheRepository(get_redis())
+
+    def profile_cache(self, ttl: int = 3600) -> ProfileCacheRepository:
+        return ProfileCacheRepository(get_redis(), ttl=ttl)
+
+    def leaderboard(self) -> LeaderboardRepository:
+        return LeaderboardRepository(get_redis())
+
+    def presence(self) -> PresenceRepository:
+        return PresenceRepository(get_redis())
+
+    def id_counters(self) -> IdCounterRepository:
+        return IdCounterRepository(get_db())
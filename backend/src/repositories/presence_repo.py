@@ -0,0 +1,33 @@
+# src/repositories/presence_repo.py
+
+from src.redis_keys import keys
+
+
+class PresenceRepository:
+    """在室ユーザー（WebSocket の enter_room / leave_room で更新するルームごとの集合）"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def add(self, room_id: str, uid: str) -> None:
+        await self.redis.sadd(keys.presence(room_id), uid)
+
+    async def remove(self, room_id: str, uid: str) -> None:
+        await self.redis.srem(keys.presence(room_id), uid)
+
+    async def remove_everywhere(self, uid: str) -> None:
+        """切断時にすべての presence:* から外す"""
+        for key in await self.redis.keys(keys.presence_pattern()):
+            await self.redis.srem(key, uid)
+
+    async def uids(self, room_id: str) -> list[str]:
+        return list(await self.redis.smembers(keys.presence(room_id)))
+
+    async def counts(self, room_ids: list[str]) -> dict[str, int]:
+        """ルームごとの在室人数（パイプライン1本）"""
+        if not room_ids:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for room_id in room_ids:
+            pipe.scard(keys.presence(room_id))
+        return dict(zip(room_ids, await pipe.execute()))
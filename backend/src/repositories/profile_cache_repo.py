@@ -0,0 +1,70 @@
+# src/repositories/profile_cache_repo.py
+
+from datetime import datetime
+
+from src.config import PROFILE_TOMBSTONE_TTL
+from src.redis_keys import keys
+
+# 無効化の印（deleted フィールド）が立っている間は書き戻さない
+_SET_UNLESS_DELETED = """
+if redis.call('HEXISTS', KEYS[1], 'deleted') == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV, 2))
+redis.call('EXPIRE', KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class ProfileCacheRepository:
+    """
+    公開プロフィール（uid, display_name, icon_url, registered_at）の Redis hash キャッシュ。
+    delete は中身を消して deleted の印だけを tombstone_ttl 秒残し、その間の set_many は何もしない。
+    """
+
+    def __init__(self, redis_client, ttl: int = 3600, tombstone_ttl: int = PROFILE_TOMBSTONE_TTL):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.tombstone_ttl = tombstone_ttl
+
+    async def get_many(self, uids: list[str]) -> dict[str, dict]:
+        if not uids:
+            return {}
+        pipe = self.redis.pipeline(transaction=False)
+        for uid in uids:
+            pipe.hgetall(keys.profile(uid))
+        found = {}
+        for uid, data in zip(uids, await pipe.execute()):
+            if data and "uid" in data:
+                found[uid] = {
+                    "uid": data["uid"],
+                    "display_name": data["display_name"],
+                    "icon_url": data.get("icon_url") or None,
+                    "registered_at": datetime.fromisoformat(data["registered_at"]),
+                }
+        return found
+
+    async def set_many(self, profiles: list[dict]) -> None:
+        if not profiles:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for p in profiles:
+            pipe.eval(
+                _SET_UNLESS_DELETED, 1, keys.profile(p["uid"]), self.ttl,
+                "uid", p["uid"],
+                "display_name", p["display_name"],
+                "icon_url", p.get("icon_url") or "",
+                "registered_at", p["registered_at"].isoformat(),
+            )
+        await pipe.execute()
+
+    async def delete(self, uid: str) -> None:
+        k = keys.profile(uid)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(k)
+        pipe.hset(k, "deleted", "1")
+        pipe.expire(k, self.tombstone_ttl)
+        await pipe.execute()
+
+    async def publish_invalidation(self, uid: str) -> None:
+        await self.redis.publish(keys.profile_invalidations(), uid)
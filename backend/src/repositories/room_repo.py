@@ -1,79 +1,133 @@
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional, List
 from datetime import datetime
+from src.db import current_session, reader
+from src.singleflight import flights, single_flight
+from src.repositories.member_repo import MemberRepository
+
+# 参加者は room_members 側。移行前の埋め込み配列はルーム取得時に返さない
+_WITHOUT_MEMBERS = {
+    "members": 0,
+    "pending_members": 0,
+    "members_migrating": 0,
+    "pending_members_migrating": 0,
+}
 
 class RoomRepository:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.rooms
+        self.members = MemberRepository(db)
+
+    def _invalidate(self, room_id: str) -> None:
+        # 書き込み前に始まった get_by_id を後続に共有しない
+        flights.invalidate(RoomRepository.get_by_id.__qualname__, self.collection.full_name, room_id)
 
     async def exists(self, room_id: str) -> bool:
-        doc = await self.collection.find_one({"room_id": room_id, "is_archived": False})
+        doc = await self.collection.find_one(
+            {"room_id": room_id, "is_archived": False}, projection={"_id": 1}, session=current_session()
+        )
         return doc is not None
 
-    async def create(self, data: dict) -> str:
+    async def create(self, data: dict, created_by: str) -> str:
         data["created_at"] = datetime.now()
         data["is_archived"] = False
-        await self.collection.insert_one(data)
+        await self.collection.insert_one(data, session=current_session())
+        await self.members.add_member(data["room_id"], created_by)
         return data["room_id"]
 
+    @single_flight
     async def get_by_id(self, room_id: str) -> Optional[dict]:
-        doc = await self.collection.find_one({"room_id": room_id, "is_archived": False})
-        if doc is not None and "pending_members" not in doc:
-            doc["pending_members"] = []
-        return doc
+        return await self.collection.find_one(
+            {"room_id": room_id, "is_archived": False},
+            projection=_WITHOUT_MEMBERS,
+            session=current_session(),
+        )
 
     async def list_all(self) -> List[dict]:
-        cursor = self.collection.find({"is_archived": False})
+        cursor = reader(self.collection, "RoomRepository.list_all").find(
+            {"is_archived": False}, projection=_WITHOUT_MEMBERS, session=current_session()
+        )
         return await cursor.to_list(length=1000)
 
     async def update(self, room_id: str, updates: dict) -> bool:
         result = await self.collection.update_one(
-            {"room_id": room_id, "is_archived": False}, {"$set": updates}
+            {"room_id": room_id, "is_archived": False}, {"$set": updates},
+            session=current_session(),
         )
+        self._invalidate(room_id)
         return result.modified_count == 1
 
+    async def with_members(self, rooms: List[dict]) -> List[dict]:
+        """従来のレスポンス形（members / pending_members 付き）に組み立てる"""
+        by_room = await self.members.by_rooms([r["room_id"] for r in rooms])
+        return [{**r, **by_room[r["room_id"]]} for r in rooms]
+
     async def list_rooms_for_user(self, uid: str) -> List[dict]:
-        cursor = self.collection.find({"members.uid": uid, "is_archived": False})
-        return await cursor.to_list(length=100)
+        return await self._rooms_in(await self.members.room_ids_for_user(uid), "RoomRepository.list_rooms_for_user")
 
-    async def add_member(self, room_id: str, uid: str):
-        await self.collection.update_one(
-            {"room_id": room_id, "is_archived": False, "members.uid": {"$ne": uid}},
-            {"$push": {"members": {"uid": uid, "joined_at": datetime.now()}}}
+    async def list_pending_for_user(self, uid: str) -> List[dict]:
+        """uid が参加申請中のルーム"""
+        room_ids = await self.members.room_ids_for_user(uid, state="pending")
+        cursor = self.collection.find(
+            {"room_id": {"$in": room_ids}, "is_archived": False},
+            projection={"room_id": 1, "name": 1, "color_id": 1},
+            session=current_session(),
         )
-    async def add_pending_member(self, room_id: str, uid: str):
-        await self.collection.update_one(
-            {"room_id": room_id, "is_archived": False},
-            {"$push": {"pending_members": {"uid": uid, "requested_at": datetime.now()}}}
+        return await cursor.to_list(length=100)
+
+    async def _rooms_in(self, room_ids: List[str], route: str) -> List[dict]:
+        cursor = reader(self.collection, route).find(
+            {"room_id": {"$in": room_ids}, "is_archived": False},
+            projection=_WITHOUT_MEMBERS,
+            session=current_session(),
         )
+        return await cursor.to_list(length=100)
+
+    # ─── 参加者（room_members に委譲。get_by_id のキャッシュも捨てる） ───
+
+    async def add_member(self, room_id: str, uid: str):
+        await self.members.add_member(room_id, uid)
+        self._invalidate(room_id)
+
+    async def add_pending_member(self, room_id: str, uid: str) -> bool:
+        ok = await self.members.add_pending(room_id, uid)
+        self._invalidate(room_id)
+        return ok
 
     async def approve_pending_member(self, room_id: str, uid: str) -> bool:
-        result = await self.collection.update_one(
-            {
-                "room_id": room_id,
-                "is_archived": False,
-                "pending_members.uid": uid  # まだpendingな場合だけpull/push
-            },
-            {
-                "$pull": {"pending_members": {"uid": uid}},
-                "$push": {"members": {"uid": uid, "joined_at": datetime.now()}}
-            }
-        )
-        return result.modified_count == 1
+        ok = await self.members.approve(room_id, uid)
+        self._invalidate(room_id)
+        return ok
+
+    async def approve_pending_members(self, room_id: str, uids: List[str]) -> List[str]:
+        """pending の uids をまとめて参加者にする。実際に移った uid を返す"""
+        approved = await self.members.approve_many(room_id, uids)
+        self._invalidate(room_id)
+        return approved
+
+    async def remove_pending_members(self, room_id: str, uids: List[str]) -> List[str]:
+        removed = await self.members.remove_pending_many(room_id, uids)
+        self._invalidate(room_id)
+        return removed
+
+    async def remove_expired_pending_members(self, room_id: str, requested_before: datetime) -> List[str]:
+        removed = await self.members.remove_expired_pending(room_id, requested_before)
+        self._invalidate(room_id)
+        return removed
+
     # remove_pending_member
     async def remove_pending_member(self, room_id: str, uid: str) -> bool:
-        result = await self.collection.update_one(
-            {
-                "room_id": room_id,
-                "is_archived": False,
-                "pending_members.uid": uid  # まだpendingな場合だけpull
-            },
-            {"$pull": {"pending_members": {"uid": uid}}}
-        )
-        return result.modified_count == 1
+        ok = await self.members.remove_pending(room_id, uid)
+        self._invalidate(room_id)
+        return ok
 
     async def remove_member(self, room_id: str, uid: str):
-        await self.collection.update_one(
-            {"room_id": room_id, "is_archived": False},
-            {"$pull": {"members": {"uid": uid}}}
+        await self.members.remove_member(room_id, uid)
+        self._invalidate(room_id)
+
+    async def ensure_indexes(self) -> None:
+        # アーカイブ済みルームの room_id は再利用され得るので、有効なルームだけで一意
+        await self.collection.create_index(
+            "room_id", unique=True, partialFilterExpression={"is_archived": False}
         )
+        await self.members.ensure_indexes()
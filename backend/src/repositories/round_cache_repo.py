@@ -1,17 +1,20 @@
 # src/repositories/round_cache_repo.py
 
+from src.redis_keys import keys
+
+
 class RoundCacheRepository:
     def __init__(self, redis):
         self.redis = redis
 
     def _round_key(self, room_id: str) -> str:
-        return f"round:{room_id}"
+        return keys.round(room_id)
 
     def _subs_key(self, room_id: str) -> str:
-        return f"{self._round_key(room_id)}:subs"
+        return keys.round_submissions(room_id)
 
     def _approvals_key(self, room_id: str) -> str:
-        return f"{self._round_key(room_id)}:apprs"
+        return keys.round_approvals(room_id)
 
     async def start(
         self,
@@ -67,8 +70,41 @@ class RoundCacheRepository:
             return []
         return raw.split(",")
 
+    async def present_uids(self, room_id: str) -> list[str]:
+        # 在室ユーザー（WebSocket の enter / leave で更新される集合）
+        return list(await self.redis.smembers(keys.presence(room_id)))
+
+    async def status(self, room_id: str) -> dict | None:
+        """
+        進行中ラウンドのスナップショットを1回のパイプラインで読む。
+        全員の提出が揃うまでは誰が出したかだけを返し、値（table）は揃ってから含める。
+        """
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(self._round_key(room_id))
+        pipe.hgetall(self._subs_key(room_id))
+        pipe.smembers(self._approvals_key(room_id))
+        pipe.ttl(self._round_key(room_id))
+        meta, subs, approvals, ttl = await pipe.execute()
+        if not meta or not meta.get("round_id"):
+            return None
+
+        participants = meta["participants"].split(",") if meta.get("participants") else []
+        values = {k: int(v) for k, v in subs.items()}
+        complete = bool(participants) and len(values) == len(participants)
+        return {
+            "room_id":      room_id,
+            "round_id":     meta["round_id"],
+            "participants": participants,
+            "submitted":    sorted(values),
+            "sum":          sum(values.values()),
+            "complete":     complete,
+            "table":        values if complete else None,
+            "approvals":    sorted(approvals),
+            "ttl":          max(ttl, 0),
+        }
+
     async def clear(self, room_id: str) -> None:
-        # ラウンド関連キーをすべて削除
+        # ラウンド関連キーをすべて削除（同一ハッシュタグなので Cluster でも1スロット）
         await self.redis.delete(
             self._round_key(room_id),
             self._subs_key(room_id),
@@ -2,32 +2,66 @@ from src.models import UserModel
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from typing import Optional, List
 from datetime import datetime
+from src.db import current_session, reader
 
 class UserRepository:
     def __init__(self, db: AsyncIOMotorDatabase):
         self.collection = db.users
 
     async def get_by_uid(self, uid: str) -> Optional[dict]:
-        return await self.collection.find_one({"uid": uid, "is_deleted": False})
+        return await self.collection.find_one({"uid": uid, "is_deleted": False}, session=current_session())
+
+    async def get_many(self, uids: List[str]) -> List[dict]:
+        cursor = self.collection.find(
+            {"uid": {"$in": uids}, "is_deleted": False},
+            projection={"uid": 1, "display_name": 1, "icon_url": 1, "registered_at": 1},
+            session=current_session(),
+        )
+        return await cursor.to_list(length=len(uids))
 
     async def get_by_external_id(self, external_id: str) -> Optional[dict]:
-        return await self.collection.find_one({"external_id": external_id, "is_deleted": False})
+        return await self.collection.find_one(
+            {"external_id": external_id, "is_deleted": False}, session=current_session()
+        )
+
+    async def uid_by_external_id(self, external_id: str) -> Optional[str]:
+        doc = await self.collection.find_one(
+            {"external_id": external_id, "is_deleted": False}, projection={"uid": 1}
+        )
+        return doc["uid"] if doc else None
+
+    async def get_deleted_by_external_id(self, external_id: str) -> Optional[dict]:
+        return await self.collection.find_one(
+            {"external_id": external_id, "is_deleted": True}, session=current_session()
+        )
+
+    async def restore(self, external_id: str, data: dict) -> None:
+        """論理削除されたユーザーを data で上書きして戻す"""
+        await self.collection.update_one(
+            {"external_id": external_id},
+            {"$set": {**data, "is_deleted": False}},
+            session=current_session(),
+        )
 
     async def create(self, data: dict) -> str:
         data["registered_at"] = datetime.now()
         data["is_deleted"] = False
-        await self.collection.insert_one(data)
+        await self.collection.insert_one(data, session=current_session())
         return data["uid"]
 
     async def update_display_name(self, uid: str, display_name: str) -> bool:
         result = await self.collection.update_one(
             {"uid": uid, "is_deleted": False},
-            {"$set": {"display_name": display_name}}
+            {"$set": {"display_name": display_name}},
+            session=current_session(),
         )
         return result.modified_count == 1
 
     async def list_all(self) -> List[dict]:
-        cursor = self.collection.find({"is_deleted": False})
+        cursor = reader(self.collection, "UserRepository.list_all").find(
+            {"is_deleted": False}, session=current_session()
+        )
         return await cursor.to_list(length=1000)
 
-
+    async def ensure_indexes(self) -> None:
+        await self.collection.create_index("uid", unique=True)
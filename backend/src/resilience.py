@@ -0,0 +1,254 @@
+# src/resilience.py
+
+"""
+Mongo / Redis の部分障害で待ちが積み上がらないようにする。
+
+- CircuitBreaker: バックエンドごと。タイムアウト・接続エラーが続いたらオープンし、
+  BREAKER_RESET_SECONDS の間は問い合わせずに即 503（Retry-After 付き）にする。
+  経過後は1件だけ通して試し（ハーフオープン）、成功すれば閉じる。
+- StaleCache: ホットな読み取り（ルーム・起動画面・認証の uid など）の直近の結果。
+  バックエンドが使えない間だけこれを返し、レスポンスに X-Degraded: stale と Age を付ける。
+- DegradedModeMiddleware: ブレーカーがオープン中の書き込みを、ハンドラに入る前に 503 で断る。
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from pymongo.errors import ConnectionFailure, ExecutionTimeout
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from src.config import (
+    BREAKER_DEADLINE_MS,
+    BREAKER_FAILURE_THRESHOLD,
+    BREAKER_RESET_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class BackendUnavailable(HTTPException):
+    def __init__(self, backend: str, retry_after: float):
+        retry = max(1, math.ceil(retry_after))
+        super().__init__(
+            status_code=503,
+            detail=f"{backend} is temporarily unavailable; retry after {retry}s",
+            headers={"Retry-After": str(retry)},
+        )
+        self.backend = backend
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        errors: tuple,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+        deadline_ms: int = BREAKER_DEADLINE_MS,
+    ):
+        self.name = name
+        self.errors = errors + (asyncio.TimeoutError,)
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.deadline = deadline_ms / 1000
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return CLOSED
+        if time.monotonic() - self.opened_at < self.reset_seconds:
+            return OPEN
+        return HALF_OPEN
+
+    @property
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 1
+        return self.opened_at + self.reset_seconds - time.monotonic()
+
+    def is_failure(self, exc: BaseException) -> bool:
+        return isinstance(exc, self.errors)
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("%s circuit closed", self.name)
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                logger.warning("%s circuit opened after %d failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+
+    def _allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    async def call(self, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+        """fn(*args, **kwargs) を期限付きで実行する。オープン中・失敗時は BackendUnavailable"""
+        if not self._allow():
+            raise BackendUnavailable(self.name, self.retry_after)
+        try:
+            result = await asyncio.wait_for(fn(*args, **kwargs), self.deadline)
+        except BaseException as e:
+            if self.is_failure(e):
+                self.record_failure()
+                raise BackendUnavailable(self.name, self.retry_after) from e
+            # 重複キーなど、バックエンドに届いた上でのエラーは成否に数えない
+            self._probing = False
+            raise
+        self.record_success()
+        return result
+
+
+mongo_breaker = CircuitBreaker("MongoDB", (ConnectionFailure, ExecutionTimeout))
+redis_breaker = CircuitBreaker("Redis", (RedisConnectionError, RedisTimeoutError))
+BREAKERS = (mongo_breaker, redis_breaker)
+BACKEND_ERRORS = tuple({e for b in BREAKERS for e in b.errors if e is not asyncio.TimeoutError})
+
+
+def breaker_for(exc: BaseException) -> Optional[CircuitBreaker]:
+    for breaker in BREAKERS:
+        if breaker.is_failure(exc):
+            return breaker
+    return None
+
+
+# ─── 劣化モードの読み取り ───
+
+# リクエストごとの印（ミドルウェアが入れ物を用意し、ハンドラ側で書き込む）
+_degraded: ContextVar[Optional[dict]] = ContextVar("degraded", default=None)
+
+
+def mark_degraded(kind: str, age: Optional[float] = None) -> None:
+    """kind: "stale"（古いキャッシュを返した） / "partial"（一部を省いた）"""
+    if (holder := _degraded.get()) is None:
+        return
+    holder.setdefault("kinds", set()).add(kind)
+    if age is not None:
+        holder["age"] = max(holder.get("age", 0), age)
+
+
+class StaleCache:
+    """
+    キーごとに直近の成功結果を1つ持つ LRU。バックエンドが使えない間だけ返す。
+    max_age を指定したら、その秒数以内の結果はバックエンドに問い合わせずに返す（pop で捨てる）
+    """
+
+    def __init__(self, name: str, size: int, max_age: float = 0):
+        self.name = name
+        self.size = size
+        self.max_age = max_age
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._pops = 0
+
+    async def fetch(self, key: Hashable, breaker: CircuitBreaker, fn: Callable[..., Awaitable], *args) -> Any:
+        if self.max_age and (hit := self._data.get(key)) is not None and time.time() - hit[0] < self.max_age:
+            self._data.move_to_end(key)
+            return hit[1]
+        pops = self._pops
+        try:
+            value = await breaker.call(fn, *args)
+        except BackendUnavailable:
+            hit = self._data.get(key)
+            if hit is None:
+                raise
+            stored_at, value = hit
+            mark_degraded("stale", time.time() - stored_at)
+            return value
+        if self.max_age and pops != self._pops:
+            # 読んでいる間に pop された（書き込み前の値かもしれない）ので使い回さない
+            return value
+        self._data[key] = (time.time(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+        return value
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+        self._pops += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+# ─── ミドルウェア / 例外ハンドラ ───
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# POST だが読み取りだけのもの（batch のサブリクエストも読み取りに限る）
+READ_ONLY_PATHS = {"/api/users/profiles", "/api/batch"}
+
+
+class DegradedModeMiddleware:
+    """オープン中のブレーカーがあれば書き込みを即 503 にし、劣化した読み取りにはヘッダを付ける"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        if scope["method"] in WRITE_METHODS and scope["path"] not in READ_ONLY_PATHS:
+            if open_breakers := [b for b in BREAKERS if b.state == OPEN]:
+                retry = max(1, math.ceil(max(b.retry_after for b in open_breakers)))
+                names = ", ".join(b.name for b in open_breakers)
+                response = JSONResponse(
+                    {"detail": f"{names} is temporarily unavailable; retry after {retry}s"},
+                    status_code=503,
+                    headers={"Retry-After": str(retry)},
+                )
+                return await response(scope, receive, send)
+
+        holder: dict = {}
+        token = _degraded.set(holder)
+
+        async def send_with_marker(message):
+            if message["type"] == "http.response.start" and holder.get("kinds"):
+                headers = list(message.get("headers", []))
+                headers.append((b"x-degraded", ", ".join(sorted(holder["kinds"])).encode()))
+                if "age" in holder:
+                    headers.append((b"age", str(int(holder["age"])).encode()))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_marker)
+        finally:
+            _degraded.reset(token)
+
+
+async def backend_error_handler(request, exc: Exception):
+    """ブレーカーを通らなかった呼び出しの接続エラー・タイムアウトも数えて 503 にする"""
+    breaker = breaker_for(exc)
+    breaker.record_failure()
+    retry = max(1, math.ceil(breaker.retry_after))
+    return JSONResponse(
+        {"detail": f"{breaker.name} is temporarily unavailable; retry after {retry}s"},
+        status_code=503,
+        headers={"Retry-After": str(retry)},
+    )
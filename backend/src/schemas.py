@@ -1,7 +1,7 @@
 # src/schemas.py
 
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Any, List, Optional
 from datetime import datetime
 
 # --- User ---
@@ -20,6 +20,15 @@ class UserResponse(BaseModel):
 class UserUpdate(BaseModel):
     display_name: str
 
+class ProfileBatchRequest(BaseModel):
+    uids: List[str]
+
+class ProfileResponse(BaseModel):
+    uid: str
+    display_name: str
+    icon_url: Optional[str]
+    registered_at: datetime
+
 # --- Room ---
 class RoomCreate(BaseModel):
     name: str
@@ -45,6 +54,9 @@ class RoomResponse(BaseModel):
 class ApproveRejectBody(BaseModel):
     applicant_user_id: str
 
+class BulkApproveRejectBody(BaseModel):
+    applicant_user_ids: List[str]
+
 # --- Point ---
 class PointInput(BaseModel):
     uid: str
@@ -75,3 +87,12 @@ class SettlementHistoryResponse(BaseModel):
     created_at: datetime
     approved_at: Optional[datetime]
     is_deleted: bool
+
+# --- Batch ---
+class BatchItem(BaseModel):
+    method: str = "GET"
+    path: str
+    body: Optional[Any] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
@@ -0,0 +1,96 @@
+# src/services/activity_service.py
+
+from typing import Optional
+
+from fastapi import HTTPException
+
+from src.repositories.interfaces import PointRecords, Settlements
+from src.utils import merge_sorted, encode_cursor, decode_cursor
+
+MAX_ACTIVITY_PAGE = 100
+
+
+class ActivityService:
+    """ポイント記録と精算をまたいだ、利用者ごとの新しい順アクティビティ"""
+
+    def __init__(self, point_repo: PointRecords, settle_repo: Settlements):
+        self.point_repo = point_repo
+        self.settle_repo = settle_repo
+
+    async def feed(self, uid: str, before: Optional[str] = None, limit: int = 20) -> dict:
+        if not (1 <= limit <= MAX_ACTIVITY_PAGE):
+            raise HTTPException(400, f"limit must be between 1 and {MAX_ACTIVITY_PAGE}")
+
+        conds: dict = {}
+        if before:
+            ts, oid = decode_cursor(before)
+            conds = {"$or": [
+                {"created_at": {"$lt": ts}},
+                {"created_at": ts, "_id": {"$lt": oid}},
+            ]}
+
+        def scoped(q: dict) -> dict:
+            return {"$and": [q, conds]} if conds else q
+
+        # 1ページ分 + 次ページ判定用の1件だけ取れれば十分
+        batch = limit + 1
+        # $or だと from_uid / to_uid 各インデックスが順序付きで使えないので、別カーソルにして合流する
+        streams = [
+            _tag("point", self.point_repo.iter_records(
+                scoped({"points.uid": uid}), batch, include_archived=True, descending=True)),
+            _tag("settlement", self.settle_repo.iter_records(
+                scoped({"from_uid": uid}), batch, descending=True)),
+            _tag("settlement", self.settle_repo.iter_records(
+                scoped({"to_uid": uid, "from_uid": {"$ne": uid}}), batch, descending=True)),
+        ]
+        merged = merge_sorted(
+            *streams,
+            key=lambda t: (t[1]["created_at"], t[1]["_id"]),
+            reverse=True,
+        )
+
+        items: list[dict] = []
+        has_more = False
+        try:
+            async for kind, doc in merged:
+                if len(items) == limit:
+                    has_more = True
+                    break
+                items.append(_to_item(kind, doc, uid))
+        finally:
+            await merged.aclose()
+
+        return {
+            "items": [item for item, _ in items],
+            "next_before": items[-1][1] if has_more else None,
+        }
+
+
+async def _tag(kind: str, it):
+    async for doc in it:
+        yield kind, doc
+
+
+def _to_item(kind: str, doc: dict, uid: str) -> tuple[dict, str]:
+    cursor = encode_cursor(doc["created_at"], doc["_id"])
+    if kind == "point":
+        item = {
+            "kind": "point",
+            "room_id": doc["room_id"],
+            "round_id": doc["round_id"],
+            "created_at": doc["created_at"],
+            "value": sum(p["value"] for p in doc.get("points", []) if p["uid"] == uid),
+            "points": doc.get("points", []),
+        }
+    else:
+        item = {
+            "kind": "settlement",
+            "room_id": doc["room_id"],
+            "settlement_id": str(doc["_id"]),
+            "created_at": doc["created_at"],
+            "from_uid": doc["from_uid"],
+            "to_uid": doc["to_uid"],
+            "amount": doc["amount"],
+            "approved": doc.get("approved", False),
+        }
+    return item, cursor
@@ -0,0 +1,67 @@
+# src/services/archive_service.py
+
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from src.redis_keys import keys
+from src.repositories.interfaces import PointRecords
+
+logger = logging.getLogger(__name__)
+
+
+class ArchiveService:
+    """point_records の古いレコードを定期的に cold tier へ移すジョブ"""
+
+    def __init__(
+        self,
+        point_repo: PointRecords,
+        redis_client,
+        after_days: Optional[int] = None,
+        keep_recent: Optional[int] = None,
+        bucket_size: int = 200,
+        interval: int = 3600,
+    ):
+        self.point_repo = point_repo
+        self.redis = redis_client
+        self.after_days = after_days
+        self.keep_recent = keep_recent
+        self.bucket_size = bucket_size
+        self.interval = interval
+
+    @property
+    def enabled(self) -> bool:
+        return self.after_days is not None or self.keep_recent is not None
+
+    async def run_once(self) -> int:
+        # 複数ワーカーで同時に走らせない
+        if not await self.redis.set(keys.archive_lock(), "1", nx=True, ex=self.interval):
+            return 0
+        try:
+            cutoff = None
+            if self.after_days is not None:
+                cutoff = datetime.now() - timedelta(days=self.after_days)
+            moved = 0
+            for room_id in await self.point_repo.room_ids():
+                moved += await self.point_repo.archive_room(
+                    room_id,
+                    cutoff=cutoff,
+                    keep_recent=self.keep_recent,
+                    bucket_size=self.bucket_size,
+                )
+            if moved:
+                logger.info("Archived %d point records", moved)
+            return moved
+        finally:
+            await self.redis.delete(keys.archive_lock())
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Point record archival failed")
+            await asyncio.sleep(self.interval)
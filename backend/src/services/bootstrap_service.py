@@ -0,0 +1,106 @@
+# src/services/bootstrap_service.py
+
+import asyncio
+
+from fastapi import HTTPException
+
+from src.config import STALE_CACHE_SIZE
+from src.resilience import BackendUnavailable, StaleCache, mark_degraded, mongo_breaker, redis_breaker
+from src.repositories.interfaces import PointRecords, Presence, Rooms, SettlementCache, Users
+from src.services.profile_service import ProfileService
+
+# Mongo 障害中に返す直近の起動画面（ルーム・残高・プロフィール）
+_stale_bootstraps = StaleCache("bootstrap", STALE_CACHE_SIZE)
+
+
+class BootstrapService:
+    """
+    アプリ起動時に必要なものを1リクエストでまとめて返す。
+    ルーム単位のループで問い合わせず、$in 集計と Redis パイプライン1本で済ませる。
+    """
+
+    def __init__(
+        self,
+        user_repo: Users,
+        room_repo: Rooms,
+        point_repo: PointRecords,
+        settle_cache: SettlementCache,
+        presence: Presence,
+        profiles: ProfileService,
+    ):
+        self.user_repo = user_repo
+        self.room_repo = room_repo
+        self.point_repo = point_repo
+        self.settle_cache = settle_cache
+        self.presence = presence
+        self.profiles = profiles
+
+    async def bootstrap(self, uid: str) -> dict:
+        data = await _stale_bootstraps.fetch(uid, mongo_breaker, self._bootstrap, uid)
+        if data is None:
+            raise HTTPException(404, "User not found")
+        return data
+
+    async def _bootstrap(self, uid: str) -> dict | None:
+        user, rooms, applications, settle_requests = await asyncio.gather(
+            self.user_repo.get_by_uid(uid),
+            self.room_repo.list_rooms_for_user(uid),
+            self.room_repo.list_pending_for_user(uid),
+            self._redis_or(self.settle_cache.pending_for(uid), []),
+        )
+        if not user:
+            return None
+
+        room_ids = [r["room_id"] for r in rooms]
+        balances, online, summaries = await asyncio.gather(
+            self.point_repo.balances_for_rooms(uid, room_ids),
+            self._redis_or(self.presence.counts(room_ids), {}),
+            self.room_repo.members.summaries(room_ids),
+        )
+        empty = {"member_count": 0, "pending_members": [], "member_sample": []}
+        summaries = {room_id: summaries.get(room_id, empty) for room_id in room_ids}
+        # 大人数のルームでも全員分は引かず、先頭の一部と申請者だけ
+        profiles = await self.profiles.get_many([
+            m
+            for s in summaries.values()
+            for m in s["member_sample"] + [p["uid"] for p in s["pending_members"]]
+        ])
+
+        return {
+            "user": {
+                "uid": user["uid"],
+                "display_name": user["display_name"],
+                "icon_url": user.get("icon_url"),
+                "registered_at": user["registered_at"],
+            },
+            "rooms": [
+                {
+                    "room_id": r["room_id"],
+                    "name": r["name"],
+                    "description": r.get("description"),
+                    "color_id": r["color_id"],
+                    "created_by": r["created_by"],
+                    "member_count": summaries[r["room_id"]]["member_count"],
+                    "balance": balances.get(r["room_id"], 0),
+                    "online_count": online.get(r["room_id"], 0),
+                    "pending_members": summaries[r["room_id"]]["pending_members"],
+                }
+                for r in rooms
+            ],
+            "pending_applications": [
+                {"room_id": r["room_id"], "name": r.get("name"), "color_id": r.get("color_id")}
+                for r in applications
+            ],
+            "settle_requests": settle_requests,
+            # ルーム画面で使うメンバーの表示名・アイコン
+            "profiles": profiles,
+        }
+
+    async def _redis_or(self, aw, fallback):
+        """Redis だけが落ちている間は在室数・精算リクエストを省いて返す"""
+        try:
+            return await redis_breaker.call(lambda: aw)
+        except BackendUnavailable:
+            aw.close()
+            mark_degraded("partial")
+            return fallback
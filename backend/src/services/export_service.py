@@ -0,0 +1,295 @@
+# src/services/export_service.py
+
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from fastapi import HTTPException
+
+from src.repositories.interfaces import PointRecords, Rooms, Settlements
+from src.utils import merge_sorted, encode_cursor, decode_cursor
+
+LEDGER_COLUMNS = [
+    "kind",              # "point" | "settlement"
+    "room_id",
+    "ref_id",            # round_id / settlement_id
+    "created_at",
+    "uid",
+    "counterparty_uid",  # settlement の to_uid
+    "value",
+    "balance",           # running balance（with_balance=False のときは空）
+    "cursor",            # この行まで受信済みなら after= に渡して再開できる
+]
+
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def _range_query(
+    since: Optional[datetime],
+    until: Optional[datetime],
+    after: Optional[str],
+) -> list[dict]:
+    conds: list[dict] = []
+    if since:
+        conds.append({"created_at": {"$gte": since}})
+    if until:
+        conds.append({"created_at": {"$lt": until}})
+    if after:
+        ts, oid = decode_cursor(after)
+        conds.append({"$or": [
+            {"created_at": {"$gt": ts}},
+            {"created_at": ts, "_id": {"$gt": oid}},
+        ]})
+    return conds
+
+
+def _opening_query(since: Optional[datetime], after: Optional[str]) -> Optional[dict]:
+    """running balance の期首残高用: 出力開始位置（cursor / since）より前のレコード"""
+    if after:
+        ts, oid = decode_cursor(after)
+        return {"$or": [
+            {"created_at": {"$lt": ts}},
+            {"created_at": ts, "_id": {"$lte": oid}},
+        ]}
+    if since:
+        return {"created_at": {"$lt": since}}
+    return None
+
+
+def _and(*conds: dict) -> dict:
+    conds = [c for c in conds if c]
+    if not conds:
+        return {}
+    if len(conds) == 1:
+        return conds[0]
+    return {"$and": conds}
+
+
+class LedgerExportService:
+    def __init__(
+        self,
+        point_repo: PointRecords,
+        settle_repo: Settlements,
+        room_repo: Rooms,
+        batch_size: int = 500,
+    ):
+        self.point_repo = point_repo
+        self.settle_repo = settle_repo
+        self.room_repo = room_repo
+        self.batch_size = batch_size
+
+    # ─── ユースケースメソッド ───
+
+    async def export_room(
+        self,
+        room_id: str,
+        current_uid: str,
+        fmt: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after: Optional[str] = None,
+        with_balance: bool = False,
+    ) -> AsyncIterator[bytes]:
+        room = await self.room_repo.get_by_id(room_id)
+        if not room:
+            raise HTTPException(404, "Room not found")
+        if not await self.room_repo.members.is_member(room_id, current_uid):
+            raise HTTPException(403, "No permission")
+        return self._export(
+            scope_points={"room_id": room_id},
+            scope_settles={"room_id": room_id},
+            uid=None,
+            fmt=fmt, since=since, until=until, after=after, with_balance=with_balance,
+        )
+
+    async def export_user(
+        self,
+        uid: str,
+        fmt: str,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        after: Optional[str] = None,
+        with_balance: bool = False,
+    ) -> AsyncIterator[bytes]:
+        return self._export(
+            scope_points={"points.uid": uid},
+            scope_settles={"$or": [{"from_uid": uid}, {"to_uid": uid}]},
+            uid=uid,
+            fmt=fmt, since=since, until=until, after=after, with_balance=with_balance,
+        )
+
+    # ─── 内部ユーティリティ ───
+
+    def _export(self, scope_points, scope_settles, uid, fmt, since, until, after, with_balance):
+        if fmt not in EXPORT_FORMATS:
+            raise HTTPException(400, f"Unsupported format: {fmt}")
+        if fmt == "parquet":
+            _require_pyarrow()
+        # cursor 不正はストリーム開始前に 400 を返したいのでここで検証
+        conds = _range_query(since, until, after)
+        batches = self._row_batches(scope_points, scope_settles, uid, conds, since, after, with_balance)
+        if fmt == "csv":
+            return _csv_chunks(batches)
+        if fmt == "jsonl":
+            return _jsonl_chunks(batches)
+        return _parquet_chunks(batches)
+
+    async def _row_batches(self, scope_points, scope_settles, uid, conds, since, after, with_balance):
+        balances: dict[str, int] = {}
+        opening = _opening_query(since, after)
+        if with_balance and opening:
+            balances = await self.point_repo.sum_by_uid(
+                _and(scope_points, opening), uid=uid, include_archived=True
+            )
+
+        points = self.point_repo.iter_records(
+            _and(scope_points, *conds), self.batch_size, include_archived=True
+        )
+        settles = self.settle_repo.iter_records(_and(scope_settles, *conds), self.batch_size)
+        tagged = merge_sorted(
+            _tag("point", points),
+            _tag("settlement", settles),
+            key=lambda t: (t[1]["created_at"], t[1]["_id"]),
+        )
+
+        batch: list[dict] = []
+        records = 0
+        async for kind, doc in tagged:
+            cursor = encode_cursor(doc["created_at"], doc["_id"])
+            if kind == "point":
+                for p in doc.get("points", []):
+                    if uid is not None and p["uid"] != uid:
+                        continue
+                    balance = None
+                    if with_balance:
+                        balance = balances.get(p["uid"], 0) + p["value"]
+                        balances[p["uid"]] = balance
+                    batch.append({
+                        "kind": "point",
+                        "room_id": doc["room_id"],
+                        "ref_id": doc["round_id"],
+                        "created_at": doc["created_at"],
+                        "uid": p["uid"],
+                        "counterparty_uid": None,
+                        "value": p["value"],
+                        "balance": balance,
+                        "cursor": cursor,
+                    })
+            else:
+                # settlements コレクションは記録のみ。残高は SATO- の point record 側で動く
+                batch.append({
+                    "kind": "settlement",
+                    "room_id": doc["room_id"],
+                    "ref_id": str(doc["_id"]),
+                    "created_at": doc["created_at"],
+                    "uid": doc["from_uid"],
+                    "counterparty_uid": doc["to_uid"],
+                    "value": doc["amount"],
+                    "balance": None,
+                    "cursor": cursor,
+                })
+            records += 1
+            if records >= self.batch_size:
+                yield batch
+                batch, records = [], 0
+        if batch:
+            yield batch
+
+
+async def _tag(kind: str, it: AsyncIterator[dict]):
+    async for doc in it:
+        yield kind, doc
+
+
+# ─── シリアライザ（バッチ単位でエンコードして即 yield） ───
+
+async def _csv_chunks(batches) -> AsyncIterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(LEDGER_COLUMNS)
+    async for batch in batches:
+        for row in batch:
+            writer.writerow([
+                row["created_at"].isoformat() if col == "created_at"
+                else ("" if row[col] is None else row[col])
+                for col in LEDGER_COLUMNS
+            ])
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+async def _jsonl_chunks(batches) -> AsyncIterator[bytes]:
+    async for batch in batches:
+        yield "".join(
+            json.dumps({**row, "created_at": row["created_at"].isoformat()}, ensure_ascii=False) + "\n"
+            for row in batch
+        ).encode()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(501, "Parquet export requires the optional 'pyarrow' package")
+
+
+class _ChunkSink(io.RawIOBase):
+    """ParquetWriter の書き込み先。書かれたバイト列を drain() で取り出す"""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._buf += b
+        self._pos += len(b)
+        return len(b)
+
+    def tell(self):
+        return self._pos
+
+    def drain(self) -> bytes:
+        out = bytes(self._buf)
+        self._buf.clear()
+        return out
+
+
+async def _parquet_chunks(batches) -> AsyncIterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ("kind", pa.string()),
+        ("room_id", pa.string()),
+        ("ref_id", pa.string()),
+        ("created_at", pa.timestamp("us")),
+        ("uid", pa.string()),
+        ("counterparty_uid", pa.string()),
+        ("value", pa.int64()),
+        ("balance", pa.int64()),
+        ("cursor", pa.string()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        async for batch in batches:
+            # 1バッチ = 1 row group
+            writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+            if chunk := sink.drain():
+                yield chunk
+    finally:
+        writer.close()
+    if chunk := sink.drain():
+        yield chunk
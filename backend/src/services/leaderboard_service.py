@@ -0,0 +1,148 @@
+# src/services/leaderboard_service.py
+
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Optional
+
+from fastapi import HTTPException
+
+from src.config import LEADERBOARD_MAX_LIMIT, LEADERBOARD_SETTLE_MS
+from src.jobs import jobs
+from src.redis_keys import keys
+from src.repositories import get_storage
+from src.repositories.interfaces import Leaderboard, PointRecords, Rooms
+from src.resilience import BackendUnavailable, redis_breaker
+
+logger = logging.getLogger(__name__)
+
+
+async def record_points(board: Optional[Leaderboard], room_id: str, points: list[dict]) -> None:
+    """
+    ポイント記録の追加直後に呼ぶ。Redis に届かなければ記録は成功のまま、ずれは整合ジョブが直す。
+    （ジョブにすると at-least-once の再実行で二重に足されるので、その場で1回だけ送る）
+    """
+    if board is None:
+        return
+    try:
+        await redis_breaker.call(board.record, room_id, points)
+    except BackendUnavailable:
+        logger.warning("Leaderboard update skipped for %s; left to reconciliation", room_id)
+
+
+def _ranked(entries: list[tuple[str, int]], start: int) -> list[dict]:
+    return [{"rank": start + i + 1, "uid": uid, "score": score} for i, (uid, score) in enumerate(entries)]
+
+
+def _deltas(truth: dict[str, int], board: dict[str, int]) -> dict[str, int]:
+    deltas = {uid: truth.get(uid, 0) - board.get(uid, 0) for uid in truth.keys() | board.keys()}
+    return {uid: d for uid, d in deltas.items() if d}
+
+
+def _stable(first: dict[str, int], second: dict[str, int]) -> dict[str, int]:
+    # 2回とも同じずれのものだけ直す。片方にしか無いのは ZINCRBY の途中を見ただけかもしれない
+    return {uid: d for uid, d in second.items() if first.get(uid) == d}
+
+
+class LeaderboardService:
+    """残高ランキング（全ルーム合計 / ルーム内）"""
+
+    def __init__(
+        self,
+        board: Leaderboard,
+        point_repo: PointRecords,
+        room_repo: Rooms,
+        settle_ms: int = LEADERBOARD_SETTLE_MS,
+    ):
+        self.board = board
+        self.point_repo = point_repo
+        self.room_repo = room_repo
+        self.settle_ms = settle_ms
+
+    async def standings(
+        self, uid: str, room_id: Optional[str] = None, limit: int = 10, radius: int = 2
+    ) -> dict:
+        """上位 limit 人・自分の順位・自分の前後 radius 人（sorted set の O(log N) 操作だけで返す）"""
+        if not (1 <= limit <= LEADERBOARD_MAX_LIMIT):
+            raise HTTPException(400, f"limit must be between 1 and {LEADERBOARD_MAX_LIMIT}")
+        if not (0 <= radius <= LEADERBOARD_MAX_LIMIT):
+            raise HTTPException(400, f"radius must be between 0 and {LEADERBOARD_MAX_LIMIT}")
+        if room_id is not None and not await self.room_repo.members.is_member(room_id, uid):
+            raise HTTPException(403, "Not a member of this room")
+
+        top, rank, score, total = await self.board.head(uid, limit, room_id)
+        me = None
+        around: list[dict] = []
+        if rank is not None:
+            me = {"rank": rank + 1, "uid": uid, "score": score}
+            start, stop = max(rank - radius, 0), rank + radius
+            # 上位の中に収まるならもう1往復しない
+            entries = top[start:stop + 1] if stop < len(top) or len(top) == total else (
+                await self.board.page(start, stop, room_id)
+            )
+            around = _ranked(entries, start)
+        return {
+            "scope": room_id or "global",
+            "total": total,
+            "top": _ranked(top, 0),
+            "me": me,
+            "around": around,
+        }
+
+    # ─── 整合 ───
+
+    async def reconcile(self) -> int:
+        """
+        sorted set を point_records（スナップショット込みの残高）に合わせる。直した uid の数を返す。
+        全ルームを1回読んでから settle_ms 待ち、ずれがあったものだけ読み直して
+        2回とも同じずれだったものを ZINCRBY で埋める。
+        """
+        room_drift: dict[str, dict[str, int]] = {}
+        global_truth: dict[str, int] = defaultdict(int)
+        for room_id in await self.point_repo.room_ids():
+            truth = await self.point_repo.room_balances(room_id)
+            for uid, v in truth.items():
+                global_truth[uid] += v
+            if drift := _deltas(truth, await self.board.scores(room_id)):
+                room_drift[room_id] = drift
+        global_drift = _deltas(global_truth, await self.board.scores())
+        if not room_drift and not global_drift:
+            return 0
+
+        await asyncio.sleep(self.settle_ms / 1000)
+
+        fixed = 0
+        for room_id, first in room_drift.items():
+            truth = await self.point_repo.room_balances(room_id)
+            deltas = _stable(first, _deltas(truth, await self.board.scores_of(list(first), room_id)))
+            await self.board.adjust(deltas, room_id)
+            fixed += len(deltas)
+        if global_drift:
+            # 全ルームの合計は読んだ時刻がルームごとにずれるので、疑わしい uid だけ1人ずつ確かめる
+            suspects = list(global_drift)
+            truth = {uid: await self.point_repo.balance_of(uid) for uid in suspects}
+            deltas = _stable(global_drift, _deltas(truth, await self.board.scores_of(suspects)))
+            await self.board.adjust(deltas)
+            fixed += len(deltas)
+        if fixed:
+            logger.info("Leaderboard reconciled %d entries", fixed)
+        return fixed
+
+
+@jobs.handler("leaderboard.reconcile")
+async def reconcile_leaderboard():
+    storage = get_storage()
+    await LeaderboardService(storage.leaderboard(), storage.points(), storage.rooms()).reconcile()
+
+
+async def schedule_reconcile(redis_client, interval: int):
+    """interval 秒ごとに整合ジョブを1つ積む（ロックの期限で、ワーカーが何台あっても間隔ごとに1回）"""
+    while True:
+        try:
+            if await redis_client.set(keys.leaderboard_lock(), "1", nx=True, ex=interval):
+                await jobs.enqueue("leaderboard.reconcile")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Leaderboard reconciliation scheduling failed")
+        await asyncio.sleep(interval)
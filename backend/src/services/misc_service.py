@@ -2,106 +2,107 @@
 
 import asyncio
 from datetime import datetime
+from typing import Optional
 from fastapi import HTTPException
 
-from src.repositories.misc_repo import (
-    PointRecordRepository,
-    SettlementRepository,
-    SettlementCacheRepository,
-    RoundCacheRepository,
+from src.repositories.interfaces import (
+    Leaderboard,
+    PointRecords,
+    Rooms,
+    RoundCache,
+    SettlementCache,
+    Settlements,
+)
+from src.ids import round_ids
+from src.ws import broadcast_event_to_room, deliver_later, send_event, to_room, to_users
+from src.jobs import jobs
+from src.services.leaderboard_service import record_points
+from src.events import (
+    PointApproved,
+    PointFinalTable,
+    PointFullyApproved,
+    PointRoundCancelled,
+    PointRoundStarted,
+    PointSubmitted,
+    SettleCompleted,
+    SettleRejected,
+    SettleRequested,
 )
-from src.repositories.room_repo import RoomRepository
-from src.ws import broadcast_event_to_room, send_event
 
-def _make_round_id(prefix: str, length: int = 6) -> str:
-    import random, string
-    chars = string.ascii_uppercase + string.digits
-    rnd = ''.join(random.choices(chars, k=length))
-    return f"{prefix}-{rnd}"
+async def _make_round_id(prefix: str) -> str:
+    return f"{prefix}-{await round_ids.next()}"
 
 
 class PointService:
     def __init__(
         self,
-        point_repo: PointRecordRepository,
-        room_repo: RoomRepository,
-        cache_repo,  # RoundCacheRepository
+        point_repo: PointRecords,
+        room_repo: Rooms,
+        cache_repo: RoundCache,
+        leaderboard: Optional[Leaderboard] = None,
     ):
         self.point_repo = point_repo
         self.room_repo = room_repo
         self.cache = cache_repo
+        self.leaderboard = leaderboard
         self._timeout_tasks: dict[str, asyncio.Task] = {}
 
     # ─── ユースケースメソッド ───
 
-    async def history(self, room_id: str):
-        return await self.point_repo.history(room_id)
+    async def history(self, room_id: str, uid: str, include_archived: bool = False):
+        await _require_member(self.room_repo, room_id, uid)
+        return await self.point_repo.history(room_id, include_archived=include_archived)
+
 
 
+    async def round_status(self, room_id: str, round_id: str):
+        status = await self.cache.status(room_id)
+        if not status or status["round_id"] != round_id:
+            raise HTTPException(404, "Round not found or already finished")
+        return status
 
     async def start_round(self, room_id: str):
         room = await self.room_repo.get_by_id(room_id)
         if not room:
              raise HTTPException(404, "Room not found")
  
-        # ——— 在室ユーザー一覧を Redis から取得 ———
-        presence_key = f"presence:{room_id}"
-        participants = await self.cache.redis.smembers(presence_key)
-        participants = list(participants)
+        # ——— 在室ユーザー一覧を取得 ———
+        participants = await self.cache.present_uids(room_id)
         if len(participants) < 2:
             raise HTTPException(400, "Need 2+ users to start round")
 
         # キャッシュ初期化・新ラウンドID生成
         await self.cache.clear(room_id)
-        round_id = _make_round_id("PON")
+        round_id = await _make_round_id("PON")
         await self.cache.start(room_id, round_id, participants)
         if task := self._timeout_tasks.get(room_id):
             task.cancel()
         self._timeout_tasks[room_id] = asyncio.create_task(self._watch_timeout(room_id))
 
-        await broadcast_event_to_room(room_id, {
-            "type": "point_round_started",
-            "room_id": room_id,
-            "round_id": round_id,
-        })
+        await broadcast_event_to_room(room_id, PointRoundStarted(room_id=room_id, round_id=round_id))
 
     async def submit_score(self, room_id: str, uid: str, value: int):
         round_id = await self.cache.add_submission(room_id, uid, value)
         if not round_id:
             raise HTTPException(400, "No active round")
 
-        await broadcast_event_to_room(room_id, {
-            "type": "point_submitted",
-            "room_id": room_id,
-            "round_id": round_id,
-            "uid": uid,
-        })
+        await broadcast_event_to_room(room_id, PointSubmitted(room_id=room_id, round_id=round_id, uid=uid))
 
         subs = await self.cache.get_submissions(room_id)
-        round_meta_key = self.cache._round_key(room_id)
-        meta = await self.cache.redis.hgetall(round_meta_key)
-        start_participants = meta.get("participants", "").split(",")
+        start_participants = await self.cache.get_participants(room_id)
         if len(subs) == len(start_participants):# タイマー取消
             if task := self._timeout_tasks.pop(room_id, None):
                 task.cancel()
 
             total = sum(subs.values())
             if total != 0:
-                await broadcast_event_to_room(room_id, {
-                    "type": "point_round_cancelled",
-                    "room_id": room_id,
-                    "round_id": round_id,
-                    "reason": "Sum is not zero",
-                })
+                await broadcast_event_to_room(room_id, PointRoundCancelled(
+                    room_id=room_id, round_id=round_id, reason="Sum is not zero"
+                ))
                 await self.cache.clear(room_id)
             else:
                 # 最終表通知のみ（DB登録は approve 時にまとめて）
-                await broadcast_event_to_room(room_id, {
-                    "type": "point_final_table",
-                    "room_id": room_id,
-                    "round_id": round_id,
-                    "table": subs,
-                })
+                await broadcast_event_to_room(room_id, PointFinalTable(room_id=room_id, round_id=round_id, table=subs))
 
     async def finalize_round(self, room_id: str):
         subs = await self.cache.get_submissions(room_id)
@@ -114,12 +115,7 @@ class PointService:
             await self.cancel_round(room_id, reason="Sum is not zero")
             raise HTTPException(400, "Sum is not zero")
 
-        await broadcast_event_to_room(room_id, {
-            "type": "point_final_table",
-            "room_id": room_id,
-            "round_id": round_id,
-            "table": subs,
-        })
+        await broadcast_event_to_room(room_id, PointFinalTable(room_id=room_id, round_id=round_id, table=subs))
         return {"round_id": round_id, "table": subs}
 
     async def approve(self, room_id: str, round_id: str, current_uid: str):
@@ -129,31 +125,29 @@ class PointService:
         participants = await self.cache.get_participants(room_id)
         members = set(participants)
 
-        await broadcast_event_to_room(room_id, {
-            "type": "point_approved",
-            "room_id": room_id,
-            "round_id": round_id,
-            "uid": current_uid,
-        })
+        approved = to_room(room_id, PointApproved(room_id=room_id, round_id=round_id, uid=current_uid))
 
         # 全員承認なら DB 永続化
         if approvals | {current_uid} == members:
             subs = await self.cache.get_submissions(room_id)
+            points = [{"uid": k, "value": v} for k, v in subs.items()]
             await self.point_repo.create({
                 "room_id": room_id,
                 "round_id": round_id,
-                "points": [{"uid": k, "value": v} for k, v in subs.items()],
+                "points": points,
                 "approved_by": list(members),
                 "created_at": datetime.now(),
                 "is_deleted": False,
             })
+            await record_points(self.leaderboard, room_id, points)
             await self.cache.clear(room_id)
-            await broadcast_event_to_room(room_id, {
-                "type": "point_fully_approved",
-                "room_id": room_id,
-                "round_id": round_id,
-                "approved_by": list(members),
-            })
+            # 承認 → 全員承認の順で届くよう1つのジョブにまとめる
+            await deliver_later(approved, to_room(room_id, PointFullyApproved(
+                room_id=room_id, round_id=round_id, approved_by=list(members)
+            )))
+            await jobs.enqueue("series.refresh", room_id=room_id)
+        else:
+            await deliver_later(approved)
 
 
     async def cancel_round(self, room_id: str, reason: str):
@@ -161,12 +155,7 @@ class PointService:
         if task := self._timeout_tasks.pop(room_id, None):
             task.cancel()
 
-        await broadcast_event_to_room(room_id, {
-            "type": "point_round_cancelled",
-            "room_id": room_id,
-            "round_id": round_id,
-            "reason": reason,
-        })
+        await broadcast_event_to_room(room_id, PointRoundCancelled(room_id=room_id, round_id=round_id, reason=reason))
         await self.cache.clear(room_id)
 
     # ─── 内部ユーティリティ ───
@@ -182,13 +171,17 @@ class PointService:
 class SettlementService:
     def __init__(
         self,
-        settle_repo: SettlementRepository,
-        cache_repo: SettlementCacheRepository,
-        point_repo: PointRecordRepository,
+        settle_repo: Settlements,
+        cache_repo: SettlementCache,
+        point_repo: PointRecords,
+        room_repo: Rooms,
+        leaderboard: Optional[Leaderboard] = None,
     ):
         self.settle_repo = settle_repo
         self.cache = cache_repo
         self.point_repo = point_repo
+        self.room_repo = room_repo
+        self.leaderboard = leaderboard
 
 
     async def request(self, room_id: str, from_uid: str, to_uid: str, amount: int):
@@ -201,13 +194,9 @@ class SettlementService:
         await self.cache.cache_request(room_id, from_uid, to_uid, amount)
 
         # 3) 通知
-        await send_event(to_uid, {
-            "type": "settle_requested",
-            "room_id": room_id,
-            "from_uid": from_uid,
-            "to_uid": to_uid,
-            "amount": amount,
-        })
+        await send_event(to_uid, SettleRequested(
+            room_id=room_id, from_uid=from_uid, to_uid=to_uid, amount=amount
+        ))
 
     async def approve_request(self, room_id: str, from_uid: str, to_uid: str):
         # キャッシュ取得
@@ -220,42 +209,36 @@ class SettlementService:
         await self._validate_balances(from_uid, to_uid, amount)
 
         # 永続化（PointRecord に２エントリ）
-        round_id = _make_round_id("SATO")
+        round_id = await _make_round_id("SATO")
+        points = [
+            {"uid": from_uid,   "value": amount},
+            {"uid": to_uid,     "value": -amount},
+        ]
         await self.point_repo.create({
             "room_id": room_id,
             "round_id": round_id,
-            "points": [
-                {"uid": from_uid,   "value": amount},
-                {"uid": to_uid,     "value": -amount},
-            ],
+            "points": points,
             "approved_by": [from_uid, to_uid],
             "created_at": datetime.now(),
             "is_deleted": False,
         })
+        await record_points(self.leaderboard, room_id, points)
 
         await self.cache.clear_request(room_id, from_uid, to_uid)
-        await broadcast_event_to_room(room_id, {
-            "type": "settle_completed",
-            "room_id": room_id,
-            "from_uid": from_uid,
-            "to_uid": to_uid,
-            "amount": amount,
-        })
+        await deliver_later(to_room(room_id, SettleCompleted(
+            room_id=room_id, from_uid=from_uid, to_uid=to_uid, amount=amount
+        )))
+        await jobs.enqueue("series.refresh", room_id=room_id)
 
         return round_id
 
     async def reject_request(self, room_id: str, from_uid: str, to_uid: str):
         await self.cache.clear_request(room_id, from_uid, to_uid)
-        payload = {
-            "type": "settle_rejected",
-            "room_id": room_id,
-            "from_uid": from_uid,
-            "to_uid": to_uid,
-        }
-        await send_event(from_uid, payload)
-        await broadcast_event_to_room(room_id, payload)
+        payload = SettleRejected(room_id=room_id, from_uid=from_uid, to_uid=to_uid)
+        await deliver_later(to_users([from_uid], payload), to_room(room_id, payload))
 
-    async def history(self, room_id: str):
+    async def history(self, room_id: str, uid: str):
+        await _require_member(self.room_repo, room_id, uid)
         return await self.settle_repo.history(room_id)
 
     async def history_by_uid(self, uid: str):
@@ -273,10 +256,9 @@ class SettlementService:
             raise HTTPException(400, "受信側の残高制限を超えます")
 
     async def _get_balance(self, uid: str) -> int:
-        hist = await self.point_repo.history_by_uid(uid)
-        return sum(
-            p["value"]
-            for rec in hist
-            for p in rec["points"]
-            if p["uid"] == uid
-        )
+        return await self.point_repo.balance_of(uid)
+
+
+async def _require_member(room_repo: Rooms, room_id: str, uid: str) -> None:
+    if not await room_repo.members.is_member(room_id, uid):
+        raise HTTPException(403, "Not a member of this room")
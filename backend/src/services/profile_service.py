@@ -0,0 +1,152 @@
+# src/services/profile_service.py
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from src.config import PROFILE_L1_SIZE, PROFILE_L1_TTL
+from src.jobs import jobs
+from src.redis_keys import keys
+from src.resilience import BackendUnavailable, mark_degraded, mongo_breaker, redis_breaker
+from src.repositories import get_storage
+from src.repositories.interfaces import ProfileCache, Users
+
+logger = logging.getLogger(__name__)
+
+
+class _LRU:
+    def __init__(self, size: int, ttl: float):
+        self.size = size
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+    def get(self, key: str) -> Optional[dict]:
+        hit = self._data.get(key)
+        if hit is None or hit[0] <= time.monotonic():
+            # 期限切れも追い出されるまでは残す（障害中に get_stale で返す）
+            return None
+        self._data.move_to_end(key)
+        return dict(hit[1])
+
+    def get_stale(self, key: str) -> Optional[tuple[dict, float]]:
+        """期限切れでも返す。(値, 経過秒)"""
+        hit = self._data.get(key)
+        if hit is None:
+            return None
+        return dict(hit[1]), time.monotonic() - (hit[0] - self.ttl)
+
+    def set(self, key: str, value: dict) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, dict(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: str) -> None:
+        self._data.pop(key, None)
+
+
+# ワーカー（プロセス）内で共有する L1
+_l1 = _LRU(PROFILE_L1_SIZE, PROFILE_L1_TTL)
+
+
+class ProfileService:
+    """
+    公開プロフィールの2段キャッシュ。
+    L1: プロセス内 LRU、L2: Redis hash、どちらにも無い分だけ Mongo に $in で1回問い合わせる。
+    """
+
+    def __init__(self, user_repo: Users, cache_repo: ProfileCache):
+        self.user_repo = user_repo
+        self.cache = cache_repo
+
+    async def get_many(self, uids: list[str]) -> dict[str, dict]:
+        uids = list(dict.fromkeys(uids))
+        result: dict[str, dict] = {}
+        missing = []
+        for uid in uids:
+            if (p := _l1.get(uid)) is not None:
+                result[uid] = p
+            else:
+                missing.append(uid)
+        if not missing:
+            return result
+
+        try:
+            from_l2 = await redis_breaker.call(self.cache.get_many, missing)
+        except BackendUnavailable:
+            # Redis が使えない間は L2 を飛ばして Mongo へ
+            from_l2 = {}
+        for uid, p in from_l2.items():
+            _l1.set(uid, p)
+            result[uid] = p
+        missing = [uid for uid in missing if uid not in from_l2]
+        if not missing:
+            return result
+
+        try:
+            users = await mongo_breaker.call(self.user_repo.get_many, missing)
+        except BackendUnavailable:
+            # Mongo も使えなければ、期限切れの L1 で埋められる分だけ返す
+            for uid in missing:
+                if (hit := _l1.get_stale(uid)) is not None:
+                    result[uid], age = hit
+                    mark_degraded("stale", age)
+            if len(result) < len(uids):
+                mark_degraded("partial")
+            return result
+        profiles = [_public(u) for u in users]
+        try:
+            await redis_breaker.call(self.cache.set_many, profiles)
+        except BackendUnavailable:
+            pass
+        for p in profiles:
+            _l1.set(p["uid"], p)
+            result[p["uid"]] = p
+        return result
+
+    async def get(self, uid: str) -> Optional[dict]:
+        return (await self.get_many([uid])).get(uid)
+
+    async def invalidate(self, uid: str) -> None:
+        """
+        書き込み後に呼ぶ。L2 を消し、全ワーカーの L1 への通知（Pub/Sub）はジョブで送る。
+        Redis が使えなくても書き込み自体は成功として返す（L2 は TTL、他ワーカーの L1 は L1 の TTL で入れ替わる）
+        """
+        _l1.pop(uid)
+        try:
+            await redis_breaker.call(self.cache.delete, uid)
+            await redis_breaker.call(jobs.enqueue, "profiles.invalidate", uid=uid)
+        except BackendUnavailable:
+            logger.warning("Profile cache invalidation skipped for %s; Redis unavailable", uid)
+
+
+@jobs.handler("profiles.invalidate")
+async def publish_invalidation(uid: str):
+    await get_storage().profile_cache().publish_invalidation(uid)
+
+
+def _public(user: dict) -> dict:
+    return {
+        "uid": user["uid"],
+        "display_name": user["display_name"],
+        "icon_url": user.get("icon_url"),
+        "registered_at": user["registered_at"],
+    }
+
+
+async def listen_invalidations(redis_client):
+    """他ワーカーからのプロフィール無効化を受けて L1 から落とす（起動時にタスクとして走らせる）"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(keys.profile_invalidations())
+            async for message in pubsub.listen():
+                if message.get("type") == "message":
+                    _l1.pop(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Profile invalidation listener failed; retrying")
+            await asyncio.sleep(1)
@@ -1,21 +1,28 @@
-from src.repositories.room_repo import RoomRepository
-from src.repositories.misc_repo import PointRecordRepository
+from src.repositories.interfaces import PointRecords, Rooms
 from fastapi import HTTPException
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
 import uuid
-from src.ws import send_event, broadcast_event_to_room 
-import random
-import string
+from src.ws import deliver_later, members_changed, to_room, to_users
+from src.events import JoinApproved, JoinRejected, JoinRequest, JoinRequestCancelled
+from src.config import STALE_CACHE_SIZE
+from src.resilience import StaleCache, mongo_breaker
+from src.ids import room_ids, MAX_ATTEMPTS
+from pymongo.errors import DuplicateKeyError
 import asyncio
 
-def generate_room_id(length=5):
-    chars = string.ascii_uppercase + string.digits  # 例：A-Z, 0-9
-    return ''.join(random.choices(chars, k=length))
+# 参加申請の有効期限（秒）
+JOIN_REQUEST_TTL = 30
+# 一括承認・却下で一度に扱える申請数
+MAX_BULK_APPLICANTS = 100
+MAX_MEMBER_PAGE = 500
+# Mongo 障害中に返す直近のルーム詳細・ルーム一覧
+_stale_rooms = StaleCache("rooms", STALE_CACHE_SIZE)
 
 
 
 class RoomService:
-    def __init__(self, room_repo: RoomRepository, point_repo: PointRecordRepository):
+    def __init__(self, room_repo: Rooms, point_repo: PointRecords):
         self.room_repo = room_repo
         self.point_repo = point_repo
         self.pending_timers = {}
@@ -25,35 +32,59 @@ class RoomService:
         if not (1 <= len(name) <= 20):
             raise HTTPException(status_code=400, detail="ルーム名は1〜20文字で指定してください")
 
-        while True:
-            room_id = generate_room_id(5)
-            if not await self.room_repo.exists(room_id):
-                break
-
-        payload = {
-            "room_id": room_id,
-            "name": data["name"],
-            "description": data.get("description"),
-            "color_id": data["color_id"],
-            "created_by": uid,
-            "created_at": datetime.now(),
-            "is_archived": False,
-            "members": [{"uid": uid, "joined_at": datetime.now()}],
-            "pending_members": []
-        }
-        await self.room_repo.create(payload)
-        return room_id
+        for _ in range(MAX_ATTEMPTS):
+            room_id = await room_ids.next()
+            payload = {
+                "room_id": room_id,
+                "name": data["name"],
+                "description": data.get("description"),
+                "color_id": data["color_id"],
+                "created_by": uid,
+                "created_at": datetime.now(),
+                "is_archived": False,
+            }
+            try:
+                await self.room_repo.create(payload, created_by=uid)
+                return room_id
+            except DuplicateKeyError:
+                # 旧方式のランダム ID と重なった
+                continue
+        raise HTTPException(status_code=503, detail="Could not allocate a room ID")
 
     async def get_room(self, room_id: str):
-        room = await self.room_repo.get_by_id(room_id)
+        room = await _stale_rooms.fetch(("room", room_id), mongo_breaker, self._load_room, room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
         return room
+
+    async def _load_room(self, room_id: str):
+        room = await self.room_repo.get_by_id(room_id)
+        if not room:
+            return None
+        return (await self.room_repo.with_members([room]))[0]
     async def list_all_rooms(self):
-        return await self.room_repo.list_all()
+        return await self.room_repo.with_members(await self.room_repo.list_all())
 
     async def list_user_rooms(self, uid: str):
-        return await self.room_repo.list_rooms_for_user(uid)
+        return await _stale_rooms.fetch(("user", uid), mongo_breaker, self._load_user_rooms, uid)
+
+    async def _load_user_rooms(self, uid: str):
+        return await self.room_repo.with_members(await self.room_repo.list_rooms_for_user(uid))
+
+    async def list_members(
+        self, room_id: str, state: str = "member", after: Optional[str] = None, limit: int = 100
+    ) -> dict:
+        if state not in ("member", "pending"):
+            raise HTTPException(status_code=400, detail="state must be 'member' or 'pending'")
+        if not (1 <= limit <= MAX_MEMBER_PAGE):
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_MEMBER_PAGE}")
+        if not await self.room_repo.get_by_id(room_id):
+            raise HTTPException(status_code=404, detail="Room not found")
+        items = await self.room_repo.members.list_page(room_id, state=state, after=after, limit=limit)
+        return {
+            "items": items,
+            "next_after": items[-1]["uid"] if len(items) == limit else None,
+        }
 
     async def update_room(self, room_id: str, updates: dict, current_uid: str):
 
@@ -77,38 +108,37 @@ class RoomService:
             raise HTTPException(status_code=403, detail="Not allowed to delete this room")
 
         # --- 全員ポイント残高チェック ---
-        point_histories = await self.point_repo.history(room_id)
-        balances = {}
-        for record in point_histories:
-            if record.get("is_deleted"):
-                continue
-            for pt in record.get("points", []):
-                uid = pt["uid"]
-                balances[uid] = balances.get(uid, 0) + pt["value"]
-        for member in room.get("members", []):
-            if balances.get(member["uid"], 0) != 0:
+        balances = await self.point_repo.room_balances(room_id)
+        for member_uid in await self.room_repo.members.member_uids(room_id):
+            if balances.get(member_uid, 0) != 0:
                 raise HTTPException(status_code=400, detail="ルームメンバーにポイント残高があるため削除不可")
         # 論理削除
-        return await self.room_repo.update(room_id, {"is_archived": True})
+        ok = await self.room_repo.update(room_id, {"is_archived": True})
+        await self.room_repo.members.clear(room_id)
+        await deliver_later(members_changed(room_id))
+        return ok
 
     async def join_room(self, room_id: str, uid: str):
         room = await self.room_repo.get_by_id(room_id)
         if not room:
             raise HTTPException(status_code=404, detail="Room not found")
-        if any(m["uid"] == uid for m in room.get("members", [])):
+        if await self.room_repo.members.is_member(room_id, uid):
             return True
         await self.room_repo.add_member(room_id, uid)
+        await deliver_later(members_changed(room_id))
         return True
 
     async def request_join(self, room_id: str, applicant_uid: str):
         room = await self.room_repo.get_by_id(room_id)
-        if any(m["uid"] == applicant_uid for m in room.get("members", [])):
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+        state = await self.room_repo.members.state_of(room_id, applicant_uid)
+        if state == "member":
             raise HTTPException(status_code=400, detail="Already a member")
-        if any(m["uid"] == applicant_uid for m in room.get("pending_members", [])):
+        # 申請は (room_id, uid) で一意なので、同時に来ても1件しか作られない
+        if state == "pending" or not await self.room_repo.add_pending_member(room_id, applicant_uid):
             raise HTTPException(status_code=400, detail="Already requested")
-        await self.room_repo.add_pending_member(room_id, applicant_uid)
-        for member in room["members"]:
-            await send_event(member["uid"], {"type": "join_request", "room_id": room_id, "applicant_uid": applicant_uid})
+        await deliver_later(to_room(room_id, JoinRequest(room_id=room_id, applicant_uid=applicant_uid)))
         key = f"{room_id}:{applicant_uid}"
         if key in self.pending_timers:
             self.pending_timers[key].cancel()
@@ -118,9 +148,8 @@ class RoomService:
     
     async def _auto_cancel_join_request(self, room_id, applicant_uid, key):
         try:
-            await asyncio.sleep(30)
-            room = await self.room_repo.get_by_id(room_id)
-            if any(m["uid"] == applicant_uid for m in room.get("pending_members", [])):
+            await asyncio.sleep(JOIN_REQUEST_TTL)
+            if await self.room_repo.members.state_of(room_id, applicant_uid) == "pending":
                 await self.cancel_join_request(room_id, applicant_uid)
         except asyncio.CancelledError:
             pass
@@ -135,21 +164,76 @@ class RoomService:
 
     # approve_member
     async def approve_member(self, room_id: str, applicant_uid: str, approver_uid: str):
-        room = await self.room_repo.get_by_id(room_id)
-        if not any(m["uid"] == approver_uid for m in room["members"]):
-            raise HTTPException(status_code=403, detail="No permission")
+        await self._require_member(room_id, approver_uid)
         ok = await self.room_repo.approve_pending_member(room_id, applicant_uid)
         if not ok:
             raise HTTPException(status_code=400, detail="Already processed or not pending")
-        await send_event(applicant_uid, {"type": "join_approved", "room_id": room_id})
-        await broadcast_event_to_room(room_id, {
-            "type": "join_approved",
-            "room_id": room_id,
-            "applicant_uid": applicant_uid,
-        })
+        await deliver_later(
+            members_changed(room_id),
+            to_users([applicant_uid], JoinApproved(room_id=room_id)),
+            to_room(room_id, JoinApproved(room_id=room_id, applicant_uid=applicant_uid)),
+        )
         self._cancel_pending_timer(room_id, applicant_uid)
 
 
+    # ─── 一括承認 / 却下 ───
+
+    async def approve_members(self, room_id: str, applicant_uids: list[str], approver_uid: str) -> dict:
+        applicant_uids = self._check_bulk(applicant_uids)
+        await self._require_member(room_id, approver_uid)
+        approved = await self.room_repo.approve_pending_members(room_id, applicant_uids)
+        if approved:
+            for uid in approved:
+                self._cancel_pending_timer(room_id, uid)
+            # 申請者ごとではなく1回にまとめて通知する
+            await deliver_later(
+                members_changed(room_id),
+                to_users(approved, JoinApproved(room_id=room_id)),
+                to_room(room_id, JoinApproved(room_id=room_id, applicant_uids=approved)),
+            )
+        return _outcomes(applicant_uids, approved, "approved")
+
+    async def reject_members(self, room_id: str, applicant_uids: list[str], approver_uid: str) -> dict:
+        applicant_uids = self._check_bulk(applicant_uids)
+        await self._require_member(room_id, approver_uid)
+        rejected = await self.room_repo.remove_pending_members(room_id, applicant_uids)
+        await self._notify_rejected(room_id, rejected)
+        return _outcomes(applicant_uids, rejected, "rejected")
+
+    async def reject_expired_members(self, room_id: str, approver_uid: str) -> dict:
+        """期限（JOIN_REQUEST_TTL）を過ぎた申請をまとめて却下する"""
+        await self._require_member(room_id, approver_uid)
+        cutoff = datetime.now() - timedelta(seconds=JOIN_REQUEST_TTL)
+        rejected = await self.room_repo.remove_expired_pending_members(room_id, cutoff)
+        await self._notify_rejected(room_id, rejected)
+        return _outcomes(rejected, rejected, "rejected")
+
+    def _check_bulk(self, applicant_uids: list[str]) -> list[str]:
+        applicant_uids = list(dict.fromkeys(applicant_uids))
+        if not (1 <= len(applicant_uids) <= MAX_BULK_APPLICANTS):
+            raise HTTPException(
+                status_code=400,
+                detail=f"applicant_user_ids must contain 1 to {MAX_BULK_APPLICANTS} uids",
+            )
+        return applicant_uids
+
+    async def _require_member(self, room_id: str, uid: str) -> None:
+        room = await self.room_repo.get_by_id(room_id)
+        if not room:
+            raise HTTPException(status_code=404, detail="Room not found")
+        if not await self.room_repo.members.is_member(room_id, uid):
+            raise HTTPException(status_code=403, detail="No permission")
+
+    async def _notify_rejected(self, room_id: str, rejected: list[str]) -> None:
+        if not rejected:
+            return
+        await deliver_later(
+            to_room(room_id, JoinRejected(room_id=room_id, applicant_uids=rejected)),
+            *(to_users([uid], JoinRejected(room_id=room_id, applicant_uid=uid)) for uid in rejected),
+        )
+        for uid in rejected:
+            self._cancel_pending_timer(room_id, uid)
+
     # cancel_join_request
     async def cancel_join_request(self, room_id: str, user_id: str):
         room = await self.room_repo.get_by_id(room_id)
@@ -158,26 +242,18 @@ class RoomService:
         ok = await self.room_repo.remove_pending_member(room_id, user_id)
         if not ok:
             raise HTTPException(status_code=400, detail="Not in pending list or already processed")
-        for m in room["members"]:
-            await send_event(m["uid"], {"type": "join_request_cancelled", "room_id": room_id, "user_id": user_id})
-        await send_event(user_id, {"type": "join_request_cancelled", "room_id": room_id, "user_id": user_id})
+        event = JoinRequestCancelled(room_id=room_id, user_id=user_id)
+        await deliver_later(to_room(room_id, event), to_users([user_id], event))
         self._cancel_pending_timer(room_id, user_id)
     
     # reject_member
     async def reject_member(self, room_id: str, applicant_uid: str, approver_uid: str):
-        room = await self.room_repo.get_by_id(room_id)
-        if not any(m["uid"] == approver_uid for m in room["members"]):
-            raise HTTPException(status_code=403, detail="No permission")
+        await self._require_member(room_id, approver_uid)
         ok = await self.room_repo.remove_pending_member(room_id, applicant_uid)
         if not ok:
             raise HTTPException(status_code=400, detail="Already processed or not pending")
-        event_payload = {
-            "type": "join_rejected",
-            "room_id": room_id,
-            "applicant_uid": applicant_uid
-        }
-        await broadcast_event_to_room(room_id, event_payload)
-        await send_event(applicant_uid, event_payload)
+        event_payload = JoinRejected(room_id=room_id, applicant_uid=applicant_uid)
+        await deliver_later(to_room(room_id, event_payload), to_users([applicant_uid], event_payload))
         self._cancel_pending_timer(room_id, applicant_uid)
     
     async def leave_room(self, room_id: str, uid: str):
@@ -186,21 +262,19 @@ class RoomService:
             raise HTTPException(status_code=404, detail="Room not found")
         if room["created_by"] == uid:
             # 自分以外にメンバーがいるなら退会不可
-            members = [m for m in room.get("members", []) if m["uid"] != uid]
-            if members:
+            if await self.room_repo.members.count(room_id) > 1:
                 raise HTTPException(status_code=400, detail="ルーム作成者は他のメンバーがいる間は退会できません")
             # 作成者1人だけなら→退会＝削除で良い（バリデーションはdelete_roomのロジックでOK）
             await self.delete_room(room_id, uid)
             return True
-        balance = 0
-        from collections import defaultdict
-        point_histories = await self.point_repo.history(room_id)
-        for record in point_histories:
-            if record.get("is_deleted"): continue
-            for pt in record.get("points", []):
-                if pt["uid"] == uid:
-                    balance += pt["value"]
+        balance = (await self.point_repo.room_balances(room_id)).get(uid, 0)
         if balance != 0:
             raise HTTPException(status_code=400, detail="ポイント残高が0でないため退会不可")
         await self.room_repo.remove_member(room_id, uid)
+        await deliver_later(members_changed(room_id))
         return True
+
+
+def _outcomes(requested: list[str], done: list[str], ok: str) -> dict:
+    done = set(done)
+    return {"results": {uid: ok if uid in done else "not_pending" for uid in requested}}
@@ -0,0 +1,146 @@
+# src/services/series_service.py
+
+from typing import Optional
+
+from fastapi import HTTPException
+
+from src.jobs import jobs
+from src.repositories import get_storage
+from src.repositories.interfaces import PointRecords, Rooms, SeriesCache
+
+SERIES_METHODS = ("lttb", "minmax")
+MAX_SERIES_POINTS = 2000
+
+
+def lttb(points: list[dict], threshold: int) -> list[dict]:
+    """
+    Largest-Triangle-Three-Buckets。
+    points は {"t": epoch秒, "balance": int, ...} の時系列（t 昇順）。
+    先頭・末尾は必ず残し、各バケットから面積最大の1点を選ぶ。
+    """
+    n = len(points)
+    if threshold >= n:
+        return points
+    if threshold < 3:
+        return [points[0], points[-1]]
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # 次バケットの平均点
+        nxt_start = int((i + 1) * every) + 1
+        nxt_end = min(int((i + 2) * every) + 1, n)
+        span = nxt_end - nxt_start
+        avg_t = sum(p["t"] for p in points[nxt_start:nxt_end]) / span
+        avg_v = sum(p["balance"] for p in points[nxt_start:nxt_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        at, av = points[a]["t"], points[a]["balance"]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs(
+                (at - avg_t) * (points[j]["balance"] - av)
+                - (at - points[j]["t"]) * (avg_v - av)
+            )
+            if area > best_area:
+                best, best_area = j, area
+        sampled.append(points[best])
+        a = best
+    sampled.append(points[-1])
+    return sampled
+
+
+def minmax(points: list[dict], threshold: int) -> list[dict]:
+    """バケットごとに最小・最大の2点を時刻順で残す（先頭・末尾は保持）"""
+    n = len(points)
+    if threshold >= n:
+        return points
+    if threshold < 4:
+        return [points[0], points[-1]]
+
+    buckets = (threshold - 2) // 2
+    inner = points[1:-1]
+    size = len(inner) / buckets
+    sampled = [points[0]]
+    for b in range(buckets):
+        chunk = inner[int(b * size):int((b + 1) * size)]
+        if not chunk:
+            continue
+        lo = min(chunk, key=lambda p: p["balance"])
+        hi = max(chunk, key=lambda p: p["balance"])
+        sampled.extend(sorted({id(lo): lo, id(hi): hi}.values(), key=lambda p: p["t"]))
+    sampled.append(points[-1])
+    return sampled
+
+
+class SeriesService:
+    def __init__(
+        self,
+        point_repo: PointRecords,
+        room_repo: Rooms,
+        cache_repo: SeriesCache,
+    ):
+        self.point_repo = point_repo
+        self.room_repo = room_repo
+        self.cache = cache_repo
+
+    async def balance_series(
+        self, room_id: str, points: int = 200, method: str = "lttb", uid: Optional[str] = None
+    ) -> dict:
+        """uid を渡したらそのユーザーがメンバーのときだけ返す（ジョブからの作り直しは None）"""
+        if method not in SERIES_METHODS:
+            raise HTTPException(400, f"Unsupported method: {method}")
+        if not (2 <= points <= MAX_SERIES_POINTS):
+            raise HTTPException(400, f"points must be between 2 and {MAX_SERIES_POINTS}")
+        if not await self.room_repo.get_by_id(room_id):
+            raise HTTPException(404, "Room not found")
+        if uid is not None and not await self.room_repo.members.is_member(room_id, uid):
+            raise HTTPException(403, "Not a member of this room")
+
+        version = await self.point_repo.latest_version(room_id)
+        variant = f"{method}:{points}"
+        if cached := await self.cache.get(room_id, version, variant):
+            return cached
+
+        downsample = lttb if method == "lttb" else minmax
+        series: dict[str, list[dict]] = {}
+        current_uid, buf = None, []
+        # uid 順に流れてくるので、1ユーザー分ずつ間引いて捨てる
+        async for row in self.point_repo.iter_running_totals(room_id):
+            if row["uid"] != current_uid:
+                if current_uid is not None:
+                    series[current_uid] = _finish(downsample(buf, points))
+                current_uid, buf = row["uid"], []
+            buf.append({
+                "t": row["created_at"].timestamp(),
+                "created_at": row["created_at"],
+                "round_id": row["round_id"],
+                "balance": row["balance"],
+            })
+        if current_uid is not None:
+            series[current_uid] = _finish(downsample(buf, points))
+
+        result = {"room_id": room_id, "version": version, "method": method, "series": series}
+        await self.cache.set(room_id, version, variant, result)
+        return result
+
+
+@jobs.handler("series.refresh")
+async def refresh_series(room_id: str):
+    """ポイント記録の追加後に、既定の表示（lttb / 200点）を作り直しておく"""
+    storage = get_storage()
+    service = SeriesService(storage.points(), storage.rooms(), storage.series_cache())
+    try:
+        await service.balance_series(room_id)
+    except HTTPException:
+        # その間にルームが消えた。やり直しても同じなので成功扱い
+        pass
+
+
+def _finish(points: list[dict]) -> list[dict]:
+    return [
+        {"created_at": p["created_at"].isoformat(), "round_id": p["round_id"], "balance": p["balance"]}
+        for p in points
+    ]
@@ -1,44 +1,61 @@
-import random
-import string
-from src.repositories.user_repo import UserRepository
-from src.repositories.room_repo import RoomRepository
+from src.repositories.interfaces import Rooms, Users
+from src.services.profile_service import ProfileService
+from src.db import causal_session, remember_causal_mark
+from src.ids import user_ids, MAX_ATTEMPTS
 from fastapi import HTTPException
-
-def generate_uid(length=8):
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+from pymongo.errors import DuplicateKeyError
+from typing import Optional
 
 class UserService:
-    def __init__(self, repo: UserRepository, room_repo: RoomRepository):
+    def __init__(
+        self,
+        repo: Users,
+        room_repo: Rooms,
+        profiles: Optional[ProfileService] = None,
+    ):
         self.repo = repo
         self.room_repo = room_repo
+        self.profiles = profiles
 
     # JWTのsub or uid = external_id として渡される
     async def create_user(self, user_data: dict, external_id: str):
+        # 書き込み→読み直しを同じ因果一貫セッションで行い、次のリクエストにも引き継ぐ
+        async with causal_session() as session:
+            user, written = await self._create_or_restore(user_data, external_id)
+            if user:
+                await remember_causal_mark(user["uid"], session)
+                # 既存ユーザーのログインではプロフィールは変わらないので消さない
+                if written and self.profiles:
+                    await self.profiles.invalidate(user["uid"])
+            return user
+
+    async def _create_or_restore(self, user_data: dict, external_id: str) -> tuple[Optional[dict], bool]:
+        """(ユーザー, 新規作成または復活させたか)"""
         user_data = user_data.copy()
         user_data["external_id"] = external_id
 
     # まずactiveなユーザーを探す
         exists = await self.repo.get_by_external_id(external_id)
         if exists:
-            return exists
+            return exists, False
 
     # 論理削除ユーザーを復活させる
-        deleted_user = await self.repo.collection.find_one({"external_id": external_id, "is_deleted": True})
+        deleted_user = await self.repo.get_deleted_by_external_id(external_id)
         if deleted_user:
-            await self.repo.collection.update_one(
-                {"external_id": external_id},
-                {"$set": {**user_data, "is_deleted": False}}
-            )
-            return await self.repo.get_by_external_id(external_id)
+            await self.repo.restore(external_id, user_data)
+            return await self.repo.get_by_external_id(external_id), True
 
     # どちらもいなければ新規
-        uid = generate_uid()
-        while await self.repo.get_by_uid(uid):
-            uid = generate_uid()
-        user_data["uid"] = uid
-
-        await self.repo.create(user_data)
-        return await self.repo.get_by_uid(uid)
+        for _ in range(MAX_ATTEMPTS):
+            uid = await user_ids.next()
+            doc = {**user_data, "uid": uid}
+            try:
+                await self.repo.create(doc)
+                return await self.repo.get_by_uid(uid), True
+            except DuplicateKeyError:
+                # 旧方式のランダム uid と重なった
+                continue
+        raise HTTPException(status_code=503, detail="Could not allocate a user ID")
 
     # DB主キーuidで取得
     async def get_user(self, uid: str):
@@ -52,6 +69,8 @@ class UserService:
         ok = await self.repo.update_display_name(uid, display_name)
         if not ok:
             raise HTTPException(status_code=404, detail="User not found or already deleted")
+        if self.profiles:
+            await self.profiles.invalidate(uid)
         return ok
 
     async def list_users(self):
@@ -62,7 +81,9 @@ class UserService:
             for user in users
         ]
         return result
- 
+
+    async def get_profiles(self, uids: list[str]) -> dict[str, dict]:
+        return await self.profiles.get_many(uids)
 
 
 
@@ -0,0 +1,91 @@
+# src/singleflight.py
+
+"""
+同じ読み取りが同時に何本も来たとき（ブロードキャスト直後の一斉再取得など）に、
+実際のクエリを1本だけ走らせて結果を共有する。
+"""
+
+import asyncio
+import copy
+import functools
+import inspect
+import time
+from typing import Any, Awaitable, Callable
+
+from src.config import SINGLE_FLIGHT_CACHE_MS
+from src.db import current_session
+
+
+class SingleFlight:
+    MAX_CACHE = 1024
+
+    def __init__(self, ttl: float = 0.0):
+        self.ttl = ttl
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._cache: dict[tuple, tuple[float, Any]] = {}
+
+    async def do(self, key: tuple, fn: Callable[[], Awaitable[Any]]) -> Any:
+        if self.ttl and (hit := self._cache.get(key)):
+            if hit[0] > time.monotonic():
+                return copy.deepcopy(hit[1])
+            self._cache.pop(key, None)
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        # 呼び出し側がキャンセルされても共有中のクエリは止めない
+        result = await asyncio.shield(task)
+        # 呼び出し側が結果を書き換えても他に影響しないよう複製して返す
+        return copy.deepcopy(result)
+
+    def _done(self, key: tuple, task: asyncio.Future) -> None:
+        failed = task.cancelled() or task.exception() is not None
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        else:
+            # invalidate 済み（書き込みより前に始まったクエリ）なので結果は保持しない
+            return
+        if not self.ttl or failed:
+            return
+        if len(self._cache) >= self.MAX_CACHE:
+            now = time.monotonic()
+            self._cache = {k: v for k, v in self._cache.items() if v[0] > now}
+            if len(self._cache) >= self.MAX_CACHE:
+                self._cache.clear()
+        self._cache[key] = (time.monotonic() + self.ttl, task.result())
+
+    def invalidate(self, name: str, namespace: str, scope: Any) -> None:
+        """name（メソッド）・namespace（コレクション）・第1引数が一致するものを捨てる"""
+        def match(key: tuple) -> bool:
+            return key[0] == name and key[1] == namespace and key[2][:1] == (scope,)
+
+        for key in [k for k in self._inflight if match(k)]:
+            del self._inflight[key]
+        for key in [k for k in self._cache if match(k)]:
+            del self._cache[key]
+
+
+flights = SingleFlight(ttl=SINGLE_FLIGHT_CACHE_MS / 1000)
+
+
+def single_flight(fn):
+    """
+    リポジトリの読み取りメソッド用デコレータ。
+    (メソッド名, コレクション名, 正規化した引数) が同じ並行呼び出しを1回にまとめる。
+    因果一貫セッション中はセッションに紐づけて読む必要があるのでまとめない。
+    """
+    sig = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    async def wrapper(self, *args, **kwargs):
+        if current_session() is not None:
+            return await fn(self, *args, **kwargs)
+        bound = sig.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        values = tuple(v for k, v in bound.arguments.items() if k != "self")
+        key = (fn.__qualname__, self.collection.full_name, values)
+        return await flights.do(key, lambda: fn(self, *args, **kwargs))
+
+    return wrapper
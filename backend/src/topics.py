@@ -0,0 +1,112 @@
+# src/topics.py
+
+"""
+WebSocket 接続ごとのルーム購読（ワーカーごとのメモリ上）。
+
+enter_room で購読し、leave_room / 切断で外す。ルームの詳細イベントは購読者にだけ送り、
+購読していないメンバーには room_updated を (uid, ルーム) ごとに間隔を空けてまとめて送る。
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from src.events import RoomUpdated
+
+
+class TopicIndex:
+    """room_id → 購読中の uid と、その逆引き"""
+
+    def __init__(self):
+        self._subscribers: dict[str, set[str]] = {}
+        self._rooms: dict[str, set[str]] = {}
+
+    def subscribe(self, uid: str, room_id: str) -> None:
+        self._subscribers.setdefault(room_id, set()).add(uid)
+        self._rooms.setdefault(uid, set()).add(room_id)
+
+    def unsubscribe(self, uid: str, room_id: str) -> None:
+        if (uids := self._subscribers.get(room_id)) is not None:
+            uids.discard(uid)
+            if not uids:
+                del self._subscribers[room_id]
+        if (rooms := self._rooms.get(uid)) is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self._rooms[uid]
+
+    def unsubscribe_all(self, uid: str) -> set[str]:
+        rooms = self._rooms.get(uid, set()).copy()
+        for room_id in rooms:
+            self.unsubscribe(uid, room_id)
+        return rooms
+
+    def subscribers(self, room_id: str) -> set[str]:
+        return self._subscribers.get(room_id, set())
+
+    def is_subscribed(self, uid: str, room_id: str) -> bool:
+        return room_id in self._rooms.get(uid, ())
+
+    def counts(self) -> dict:
+        return {
+            "rooms": len(self._subscribers),
+            "subscribers": len(self._rooms),
+            "subscriptions": sum(len(rooms) for rooms in self._rooms.values()),
+        }
+
+
+class UpdateNotices:
+    """
+    room_updated を (uid, room_id) ごとに interval 秒に1回までに抑える。
+    間隔内に来た分は数えておき、間隔が空いたところで count 付きの1通にまとめて送る。
+    """
+
+    def __init__(self, interval: float, send: Callable[[str, RoomUpdated], Awaitable[None]]):
+        self.interval = interval
+        self._send = send
+        self._last: dict[str, dict[str, float]] = {}
+        self._pending: dict[str, dict[str, int]] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def notify(self, uid: str, room_id: str) -> None:
+        pending = self._pending.setdefault(uid, {})
+        if room_id in pending:
+            pending[room_id] += 1
+            return
+        pending[room_id] = 1
+        wait = self._last.get(uid, {}).get(room_id, float("-inf")) + self.interval - time.monotonic()
+        if wait <= 0:
+            await self._flush(uid, room_id)
+            return
+        task = asyncio.create_task(self._flush_later(uid, room_id, wait))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush_later(self, uid: str, room_id: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._flush(uid, room_id)
+
+    async def _flush(self, uid: str, room_id: str) -> None:
+        pending = self._pending.get(uid)
+        count = pending.pop(room_id, 0) if pending is not None else 0
+        if not count:
+            # 待っている間に切断された
+            return
+        if not pending:
+            del self._pending[uid]
+        self._last.setdefault(uid, {})[room_id] = time.monotonic()
+        await self._send(uid, RoomUpdated(room_id=room_id, count=count))
+
+    def forget(self, uid: str) -> None:
+        self._pending.pop(uid, None)
+        self._last.pop(uid, None)
+
+    def counts(self) -> dict:
+        return {
+            "uids": len(self._last.keys() | self._pending.keys()),
+            "pending": sum(len(p) for p in self._pending.values()),
+            "tasks": len(self._tasks),
+        }
+
+
+topics = TopicIndex()
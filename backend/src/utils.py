@@ -1,22 +1,32 @@
+import base64
+import heapq
 import logging
+from contextvars import ContextVar
+from datetime import datetime
+from bson import ObjectId
 from fastapi import Request, HTTPException, status, Depends
-from jose import jwt
-from src.config import AUTH_PROVIDER, SUPABASE_JWT_SECRET, FIREBASE_PROJECT_ID
-from src.db import get_db
+from src.auth_providers import get_provider
+from src.config import STALE_CACHE_SIZE
+from src.db import causal_session
+from src.repositories import get_storage
+from src.resilience import StaleCache, mongo_breaker
 
-# Supabase 用
-#   jose.jwt.decode
+logger = logging.getLogger(__name__)
 
-# Firebase 用
-from google.oauth2 import id_token
-from google.auth.transport.requests import Request as GoogleRequest
+# external_id → uid。Mongo が使えない間も、直近に認証できた利用者は通す
+_uids_by_external_id = StaleCache("uids_by_external_id", STALE_CACHE_SIZE)
+# POST /api/batch で認証済みの uid。サブリクエストではトークンの検証と users の参照を省く
+batch_uid: ContextVar[str | None] = ContextVar("batch_uid", default=None)
 
-logger = logging.getLogger(__name__)
 
-async def get_current_uid(
-    request: Request,
-    db=Depends(get_db)
-) -> str:
+async def find_registered_uid(external_id: str) -> str | None:
+    users = get_storage().users()
+    return await _uids_by_external_id.fetch(external_id, mongo_breaker, users.uid_by_external_id, external_id)
+
+
+async def get_current_uid(request: Request) -> str:
+    if (uid := batch_uid.get()) is not None:
+        return uid
     auth = request.headers.get("Authorization")
     logger.debug(f"Authorization header: {auth}")
     if not auth or not auth.startswith("Bearer "):
@@ -25,43 +35,15 @@ async def get_current_uid(
     token = auth.split()[1]
 
     try:
-        external_id: str | None = None
-
-        if AUTH_PROVIDER == "supabase":
-            try:
-                payload = jwt.decode(
-                    token,
-                    SUPABASE_JWT_SECRET,
-                    algorithms=["HS256"],
-                    audience="authenticated"
-                )
-                external_id = payload.get("sub")
-            except Exception as e:
-                logger.error("Supabase JWT decode error: %s", e)
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail=f"Supabase decode error: {e}"
-                )
-
-        elif AUTH_PROVIDER == "firebase":
-            try:
-                id_info = id_token.verify_firebase_token(
-                    token,
-                    GoogleRequest(),
-                    audience=FIREBASE_PROJECT_ID
-                )
-                # Token によっては "user_id"、または "sub" にユーザー UID が入っている
-                external_id = id_info.get("user_id") or id_info.get("sub")
-            except Exception as e:
-                logger.error("Firebase token verify error: %s", e)
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid Firebase token"
-                )
-        else:
-            logger.error("Unknown AUTH_PROVIDER: %s", AUTH_PROVIDER)
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                                detail="Invalid AUTH_PROVIDER setting")
+        provider = get_provider()
+        try:
+            external_id = provider.external_id(token)
+        except Exception as e:
+            logger.error("%s token verify error: %s", provider.name, e)
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail=f"Invalid {provider.name} token"
+            )
 
         if not external_id:
             raise HTTPException(
@@ -69,18 +51,15 @@ async def get_current_uid(
                 detail="Could not retrieve external_id from token"
             )
 
-        user = await db.users.find_one({
-            "external_id": external_id,
-            "is_deleted": False
-        })
-        if not user:
+        uid = await find_registered_uid(external_id)
+        if not uid:
             logger.warning("User not found: external_id=%s", external_id)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not registered"
             )
 
-        return user["uid"]
+        return uid
 
     except HTTPException:
         # 上記で投げた HTTPException はそのまま
@@ -93,46 +72,84 @@ async def get_current_uid(
         )
 
 
+async def get_causal_uid(current_uid: str = Depends(get_current_uid)):
+    """
+    get_current_uid と同じだが、リクエストの間その利用者の因果一貫セッションを張る。
+    書き込み直後の読み取り（approve → history など）が secondary でも自分の書き込みを見る。
+    """
+    async with causal_session(current_uid):
+        yield current_uid
+
+
 async def get_current_external_id(request: Request) -> str:
     auth = request.headers.get("Authorization")
     if not auth or not auth.startswith("Bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
     token = auth.split()[1]
 
-    if AUTH_PROVIDER == "supabase":
-        try:
-            payload = jwt.decode(
-                token,
-                SUPABASE_JWT_SECRET,
-                algorithms=["HS256"],
-                audience="authenticated"
-            )
-            return payload["sub"]
-        except Exception as e:
-            logger.error("Supabase token decode error for external_id: %s", e)
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid Supabase token"
-            )
+    provider = get_provider()
+    try:
+        return provider.external_id(token)
+    except Exception as e:
+        logger.error("%s token verify error for external_id: %s", provider.name, e)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail=f"Invalid {provider.name} token"
+        )
+
+
+class _Desc:
+    """heapq を降順で使うための比較反転ラッパー"""
+
+    __slots__ = ("v",)
 
-    elif AUTH_PROVIDER == "firebase":
+    def __init__(self, v):
+        self.v = v
+
+    def __lt__(self, other):
+        return other.v < self.v
+
+    def __eq__(self, other):
+        return self.v == other.v
+
+
+async def merge_sorted(*iterators, key, reverse: bool = False):
+    """
+    ソート済みの非同期イテレータ群を key 順に遅延マージする（k-way merge）。
+    各イテレータから同時に保持するのは先頭1件だけ。reverse=True なら降順。
+    """
+    k = (lambda item: _Desc(key(item))) if reverse else key
+    heap = []
+    for idx, it in enumerate(iterators):
+        it = it.__aiter__()
         try:
-            id_info = id_token.verify_firebase_token(
-                token,
-                GoogleRequest(),
-                audience=FIREBASE_PROJECT_ID
-            )
-            return id_info.get("user_id") or id_info.get("sub")
-        except Exception as e:
-            logger.error("Firebase token verify error for external_id: %s", e)
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid Firebase token"
-            )
+            item = await it.__anext__()
+        except StopAsyncIteration:
+            continue
+        heap.append((k(item), idx, item, it))
+    heapq.heapify(heap)
+
+    while heap:
+        _, idx, item, it = heap[0]
+        yield item
+        try:
+            nxt = await it.__anext__()
+        except StopAsyncIteration:
+            heapq.heappop(heap)
+            continue
+        heapq.heapreplace(heap, (k(nxt), idx, nxt, it))
 
-    else:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Invalid AUTH_PROVIDER setting"
-        )
 
+def encode_cursor(created_at, oid) -> str:
+    """(created_at, _id) の位置を URL セーフな不透明文字列にする"""
+    raw = f"{created_at.isoformat()}|{oid}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, oid = raw.split("|", 1)
+        return datetime.fromisoformat(ts), ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
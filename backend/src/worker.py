@@ -0,0 +1,36 @@
+# src/worker.py
+
+"""
+ジョブキューのコマンドライン。
+
+    python -m src.worker stats   # 未配送の件数・待ち時間・dead-letter を表示
+    python -m src.worker work    # API と別プロセスでワーカーだけ動かす（API 側は JOB_WORKER_CONCURRENCY=0）
+
+src.jobs を -m で直接動かすとモジュールが __main__ と src.jobs の2つに分かれ、
+ハンドラが登録される側と run する側が食い違うのでここに分けている。
+"""
+
+import asyncio
+import json
+import sys
+
+
+async def _main(command: str):
+    # ハンドラを登録させるため API 一式を読み込んでから src.jobs のキューを使う
+    import src.main  # noqa: F401
+    from src.db import close, connect
+    from src.jobs import jobs
+
+    connect()
+    try:
+        if command == "work":
+            jobs.concurrency = max(jobs.concurrency, 1)
+            await jobs.run()
+        else:
+            print(json.dumps(await jobs.stats(), indent=2))
+    finally:
+        await close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1] if len(sys.argv) > 1 else "stats"))
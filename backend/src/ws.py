@@ -1,175 +1,351 @@
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status, HTTPException
-from jose import jwt
-from src.config import SUPABASE_JWT_SECRET, AUTH_PROVIDER, FIREBASE_PROJECT_ID
-from src.db import db, redis_client
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Header, Query, status, HTTPException
+from src.auth_providers import get_provider
+from src.config import ROOM_MEMBER_CACHE_TTL, ROOM_UPDATE_NOTICE_INTERVAL
+from src.db import get_redis
+from src.repositories import get_storage
+from src.redis_keys import keys
+from src.profiling import PROFILE_HEADER, profiler, verify_profile_signature
+from src.topics import UpdateNotices, topics
+from src.events import (
+    JSON,
+    MEMBERS,
+    MSGPACK,
+    Event,
+    Pong,
+    UserEntered,
+    UserLeft,
+    PointRoundCancelled,
+    PointRoundStatus,
+    SettleRequested,
+    as_event,
+    decode_client_message,
+    negotiate,
+    schema,
+)
+from src.resilience import BackendUnavailable, StaleCache, mongo_breaker, redis_breaker
+from src.config import STALE_CACHE_SIZE
+from src.utils import find_registered_uid
+from contextlib import nullcontext
 import asyncio
+import json
+import logging
+import os
+from collections import Counter
 
-# Firebase 用
-from google.oauth2 import id_token as firebase_id_token
-from google.auth.transport.requests import Request as GoogleRequest
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 active_connections: dict[str, WebSocket] = {}
+# uid → 接続で合意したエンコード（JSON / MSGPACK）
+connection_protocols: dict[str, str] = {}
 
 
 async def get_uid_from_token(token: str) -> str:
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
 
-    external_id: str | None = None
-
-    if AUTH_PROVIDER == "supabase":
-        try:
-            payload = jwt.decode(
-                token,
-                SUPABASE_JWT_SECRET,
-                algorithms=["HS256"],
-                audience="authenticated"
-            )
-            external_id = payload.get("sub")
-        except Exception as e:
-            # JWT エラーはそのまま伝播させる
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                detail=f"Supabase JWT decode error: {e}")
-
-    elif AUTH_PROVIDER == "firebase":
-        try:
-            id_info = firebase_id_token.verify_firebase_token(
-                token,
-                GoogleRequest(),
-                audience=FIREBASE_PROJECT_ID
-            )
-            # Firebase トークンのペイロードには user_id or sub が入っている
-            external_id = id_info.get("user_id") or id_info.get("sub")
-        except Exception as e:
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
-                                detail=f"Invalid Firebase token: {e}")
-    else:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                            detail=f"Unknown AUTH_PROVIDER: {AUTH_PROVIDER}")
+    provider = get_provider()
+    try:
+        external_id = provider.external_id(token)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                            detail=f"Invalid {provider.name} token: {e}")
 
     if not external_id:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="Could not retrieve external_id from token")
 
-    user = await db.users.find_one({"external_id": external_id, "is_deleted": False})
-    if not user:
+    uid = await find_registered_uid(external_id)
+    if not uid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                             detail="User not registered")
 
-    return user["uid"]
+    return uid
 
 
 @router.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
+async def websocket_endpoint(
+    websocket: WebSocket,
+    token: str = Query(...),
+    profile: str | None = Query(None),
+):
     # 初回接続時にトークン検証
     try:
         uid = await get_uid_from_token(token)
+    except BackendUnavailable:
+        # 認証に使う DB が落ちている。クライアントには後で再接続してもらう
+        await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+        return
     except HTTPException:
         await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
         return
 
-    await websocket.accept()
+    subprotocol = negotiate(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=subprotocol)
+    protocol = MSGPACK if subprotocol else JSON
     active_connections[uid] = websocket
+    connection_protocols[uid] = protocol
+    profile_enabled = verify_profile_signature(profile)
 
-    # SettlementCacheRepository を使ってキャッシュを探せるように準備
-    from src.repositories.misc_repo import SettlementCacheRepository
-    settle_cache = SettlementCacheRepository(redis_client)
+    storage = get_storage()
 
     async def cancel_round(room_id: str, reason: str):
-        from src.repositories.misc_repo import RoundCacheRepository
-        cache = RoundCacheRepository(redis_client)
-        await cache.clear(room_id)
-        await broadcast_event_to_room(room_id, {
-            "type":    "point_round_cancelled",
-            "room_id": room_id,
-            "reason":  reason,
-        })
+        cache = storage.round_cache()
+        await redis_breaker.call(cache.clear, room_id)
+        await broadcast_event_to_room(room_id, PointRoundCancelled(room_id=room_id, reason=reason))
 
     try:
         while True:
-            data = await websocket.receive_json()
+            data = await _receive(websocket, protocol)
             if not isinstance(data, dict):
                 continue
 
             event_type = data.get("type")
             room_id    = data.get("room_id")
 
-            # ping/pong
-            if event_type == "ping":
-                await websocket.send_json({"type": "pong"})
-                continue
+            try:
+                # X-Profile と同じ署名を profile クエリで渡した接続か、profiling:until 中だけ計測する
+                measure = profile_enabled or profiler.toggled
+                async with (profiler.profile(f"ws:{event_type}") if measure else nullcontext()):
+                    # ping/pong
+                    if event_type == "ping":
+                        await _send(websocket, protocol, Pong())
+                        continue
 
-            # 入室／退室
-            if event_type in ("enter_room", "leave_room") and room_id:
-                # presence 更新
-                if event_type == "enter_room":
-                    await redis_client.sadd(f"presence:{room_id}", uid)
-                else:
-                    await redis_client.srem(f"presence:{room_id}", uid)
-
-                # user_entered / user_left をブロードキャスト
-                await broadcast_event_to_room(room_id, {
-                    "type":    f"user_{'entered' if event_type=='enter_room' else 'left'}",
-                    "room_id": room_id,
-                    "uid":     uid,
-                })
-
-                # --- 追加処理: 未承認の SATO リクエストをキャッシュから探して即プッシュ ---
-                if event_type == "enter_room":
-                    # キーのパターン: settle:<room_id>:<from_uid>-><to_uid>
-                    async for key in redis_client.scan_iter(f"settle:{room_id}:*->{uid}"):
-                        data = await redis_client.hgetall(key)
-                        if data and data.get("amount"):
-                            await websocket.send_json({
-                                "type":     "settle_requested",
-                                "room_id":  data["room_id"],
-                                "from_uid": data["from_uid"],
-                                "to_uid":   data["to_uid"],
-                                "amount":   int(data["amount"]),
-                            })
-                # ------------------------------------------------------------------
-
-                # アクティブルラウンドがあればキャンセル
-                meta = await redis_client.hgetall(f"points:{room_id}")
-                if meta.get("round_id"):
-                    await cancel_round(room_id, "User entered/left during active round")
+                    # 入室／退室
+                    if event_type in ("enter_room", "leave_room") and room_id:
+                        # presence 更新と購読の付け外し（入室は通知の前、退室は通知の後）
+                        if event_type == "enter_room":
+                            topics.subscribe(uid, room_id)
+                            await redis_breaker.call(storage.presence().add, room_id, uid)
+                        else:
+                            await redis_breaker.call(storage.presence().remove, room_id, uid)
 
-                continue
+                        # user_entered / user_left をブロードキャスト
+                        presence_event = UserEntered if event_type == "enter_room" else UserLeft
+                        await broadcast_event_to_room(room_id, presence_event(room_id=room_id, uid=uid))
+                        if event_type == "leave_room":
+                            topics.unsubscribe(uid, room_id)
 
-            # クライアントからの明示的キャンセル
-            if event_type == "cancel_point_round" and room_id:
-                await cancel_round(room_id, "User cancelled the round")
-                continue
+                        # --- 追加処理: 未承認の SATO リクエストをキャッシュから探して即プッシュ ---
+                        if event_type == "enter_room":
+                            for req in await redis_breaker.call(storage.settle_cache().pending_for, uid):
+                                if req["room_id"] != room_id:
+                                    continue
+                                await _send(websocket, protocol, SettleRequested(
+                                    room_id=req["room_id"],
+                                    from_uid=req["from_uid"],
+                                    to_uid=req["to_uid"],
+                                    amount=int(req["amount"]),
+                                ))
+                            # 進行中ラウンドがあれば現在の状態をまとめて送る（再接続時の復元用）
+                            round_status = await redis_breaker.call(storage.round_cache().status, room_id)
+                            if round_status:
+                                await _send(websocket, protocol, PointRoundStatus(**round_status))
+                        # ------------------------------------------------------------------
 
-            # （他のイベント処理があればここに…）
+                        # 入退室ではラウンドを止めない（中断は cancel_point_round かタイムアウト）
+                        continue
+
+                    # クライアントからの明示的キャンセル
+                    if event_type == "cancel_point_round" and room_id:
+                        await cancel_round(room_id, "User cancelled the round")
+                        continue
+
+                    # （他のイベント処理があればここに…）
+            except BackendUnavailable as e:
+                # Mongo / Redis の障害で接続ごと落とさない（この1件だけ諦める）
+                logger.warning("Skipped WebSocket %s from %s: %s", event_type, uid, e.detail)
 
     except WebSocketDisconnect:
         # 切断時はすべての presence:* から削除
-        keys = await redis_client.keys("presence:*")
-        for key in keys:
-            await redis_client.srem(key, uid)
+        try:
+            await redis_breaker.call(storage.presence().remove_everywhere, uid)
+        except BackendUnavailable:
+            logger.warning("Could not clear presence for %s", uid)
 
     finally:
         if active_connections.get(uid) is websocket:
             del active_connections[uid]
-async def send_event(uid: str, event: dict):
+            connection_protocols.pop(uid, None)
+        if uid not in active_connections:
+            # 同じ uid の新しい接続が無ければ購読も片付ける
+            topics.unsubscribe_all(uid)
+            notices.forget(uid)
+
+
+@router.get("/ws/schema")
+async def ws_schema():
+    """msgpack サブプロトコルのイベントコード表"""
+    return schema()
+
+
+@router.get("/ws/stats")
+async def ws_stats(x_profile: str | None = Header(None, alias=PROFILE_HEADER)):
+    """
+    このワーカーの接続・購読・タスク数とメモリ（benchmarks/ws_soak.py が定期的に読む）。
+    X-Profile と同じ署名が必要。
+    """
+    if not verify_profile_signature(x_profile):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN)
+    # タイマー（参加申請の自動取消・ラウンドのタイムアウト）が溜まっていないかはコルーチン名ごとの数で見る
+    tasks = Counter(
+        getattr(task.get_coro(), "__qualname__", "?") for task in asyncio.all_tasks()
+    )
+    return {
+        "pid": os.getpid(),
+        "rss_bytes": _rss_bytes(),
+        "connections": len(active_connections),
+        "protocols": dict(Counter(connection_protocols.values())),
+        "topics": topics.counts(),
+        "notices": notices.counts(),
+        "room_member_cache": len(_room_members),
+        "tasks": sum(tasks.values()),
+        "tasks_by_coro": dict(tasks.most_common(20)),
+    }
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # Linux 以外
+        return None
+
+
+async def _receive(websocket: WebSocket, protocol: str):
+    if protocol == JSON:
+        return await websocket.receive_json()
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode_client_message(message["bytes"])
+    # msgpack 接続でもテキストフレームは JSON として受ける
+    return json.loads(message["text"])
+
+
+async def _send(websocket: WebSocket, protocol: str, event: Event):
+    data = event.encode(protocol)
+    if protocol == MSGPACK:
+        await websocket.send_bytes(data)
+    else:
+        await websocket.send_text(data)
+
+
+async def send_event(uid: str, event: Event | dict):
     ws = active_connections.get(uid)
     if not ws:
         return
     try:
-        await ws.send_json(event)
+        await _send(ws, connection_protocols.get(uid, JSON), as_event(event))
     except Exception:
         if active_connections.get(uid) is ws:
             del active_connections[uid]
+            connection_protocols.pop(uid, None)
+
+
+notices = UpdateNotices(ROOM_UPDATE_NOTICE_INTERVAL, send_event)
+# ルームのメンバー一覧（ワーカーごと）。参加・承認・退会・削除では members_changed で全ワーカーから捨てる
+_room_members = StaleCache("room_members", STALE_CACHE_SIZE, max_age=ROOM_MEMBER_CACHE_TTL)
+
+
+async def _member_uids(room_id: str) -> frozenset[str]:
+    rooms = get_storage().rooms()
+    if not await rooms.exists(room_id):
+        return frozenset()
+    return frozenset(await rooms.members.member_uids(room_id))
 
 
-async def broadcast_event_to_room(room_id: str, event: dict):
-    """room_id の全メンバーに対して send_event を実行"""
-    room = await db.rooms.find_one({"room_id": room_id, "is_archived": False})
-    if not room:
+async def broadcast_event_to_room(room_id: str, event: Event | dict):
+    """
+    room_id のイベントを、ルームを開いている（enter_room 済みの）メンバーにだけ送る。
+    開いていないメンバーには room_updated をまとめて送る。参加申請まわり（audience=MEMBERS）は全員に送る。
+    エンコードはプロトコルごとに1回。
+    """
+    event = as_event(event)
+    try:
+        # Mongo が落ちている間は直近のメンバー一覧で配る（無ければこのイベントは諦める）
+        member_uids = await _room_members.fetch(room_id, mongo_breaker, _member_uids, room_id)
+    except BackendUnavailable as e:
+        logger.warning("Dropped %s for room %s: %s", getattr(event, "type", "event"), room_id, e.detail)
+        return
+
+    viewers = topics.subscribers(room_id)
+    # このワーカーに接続しているメンバーだけを見る（メンバー数と接続数の少ない方を回す）
+    if len(member_uids) <= len(active_connections):
+        connected = [uid for uid in member_uids if uid in active_connections]
+    else:
+        connected = [uid for uid in active_connections if uid in member_uids]
+    if event.audience == MEMBERS:
+        for member_uid in connected:
+            await send_event(member_uid, event)
         return
+    for member_uid in [uid for uid in viewers if uid in member_uids]:
+        await send_event(member_uid, event)
+    for member_uid in connected:
+        if member_uid not in viewers:
+            await notices.notify(member_uid, room_id)
+
+
 
-    for member in room.get("members", []):
-        await send_event(member["uid"], event)
+# ─── ワーカー間の配送 ───
+# 接続はそれを持つプロセスにしか無いので、HTTP ハンドラは deliver_later で Pub/Sub に流して返し、
+# 全ワーカーの listen_deliveries がそれぞれ自分の接続にだけ送る（ジョブキューには載せない）。
+# 1回の deliver_later の手順は順に送るので、順序が要るイベントは1回にまとめる。
 
+def to_room(room_id: str, event: Event) -> dict:
+    return {"room_id": room_id, "event": event.to_dict()}
+
+
+def to_users(uids: list[str], event: Event) -> dict:
+    return {"uids": list(uids), "event": event.to_dict()}
+
+
+def members_changed(room_id: str) -> dict:
+    """各ワーカーのメンバー一覧を捨てさせる（同じ deliver_later の後続の手順は新しい一覧で配る）"""
+    return {"members_of": room_id}
+
+
+async def deliver_later(*steps: dict):
+    message = json.dumps({"steps": list(steps)}, default=str)
+    try:
+        await redis_breaker.call(get_redis().publish, keys.ws_deliveries(), message)
+    except BackendUnavailable:
+        # 他のワーカーには届かないが、このプロセスの接続にだけでも送る
+        logger.warning("WebSocket fan-out unavailable; delivering locally only")
+        await _deliver(list(steps))
+
+
+async def _deliver(steps: list[dict]):
+    for step in steps:
+        if "members_of" in step:
+            _room_members.pop(step["members_of"])
+            continue
+        event = as_event(step["event"])
+        if "room_id" in step:
+            await broadcast_event_to_room(step["room_id"], event)
+        else:
+            for uid in step["uids"]:
+                await send_event(uid, event)
+
+
+async def listen_deliveries(redis_client):
+    """deliver_later の内容をこのプロセスの接続に配る（起動時にタスクとして走らせる）"""
+    while True:
+        try:
+            pubsub = redis_client.pubsub()
+            await pubsub.subscribe(keys.ws_deliveries())
+            async for message in pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    await _deliver(json.loads(message["data"])["steps"])
+                except Exception:
+                    logger.exception("WebSocket delivery failed")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("WebSocket delivery listener failed; retrying")
+            await asyncio.sleep(1)
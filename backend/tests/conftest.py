@@ -0,0 +1,51 @@
+# tests/conftest.py
+
+"""
+STORAGE_BACKEND=memory でアプリ一式を動かす。Mongo / Redis サーバーは要らない
+（ジョブキュー・WebSocket の配送・冪等キーが使う Redis は fakeredis）。
+
+    cd backend && pip install -r requirements-dev.txt && python -m pytest -q
+"""
+
+import os
+
+os.environ.update({
+    "STORAGE_BACKEND": "memory",
+    "SUPABASE_JWT_SECRET": "test-secret",
+    "JOB_WORKER_CONCURRENCY": "0",
+    "LEADERBOARD_RECONCILE_SECONDS": "0",
+    "LOOP_LAG_THRESHOLD_MS": "0",
+})
+
+import fakeredis.aioredis  # noqa: E402
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from jose import jwt  # noqa: E402
+
+import src.db  # noqa: E402
+from src.main import app  # noqa: E402
+from src.repositories import get_storage  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    src.db._redis_client = fakeredis.aioredis.FakeRedis(decode_responses=True)
+    with TestClient(app) as c:
+        yield c
+
+
+@pytest.fixture
+def storage():
+    return get_storage()
+
+
+@pytest.fixture
+def register(client):
+    """外部 ID でユーザー登録して (認証ヘッダ, uid) を返す"""
+    def _register(name: str) -> tuple[dict, str]:
+        token = jwt.encode({"sub": f"ext-{name}", "aud": "authenticated"}, "test-secret", algorithm="HS256")
+        headers = {"Authorization": f"Bearer {token}"}
+        res = client.post("/api/users", headers=headers, json={"display_name": name, "email": f"{name}@example.com"})
+        assert res.status_code == 200, res.text
+        return headers, res.json()["uid"]
+    return _register
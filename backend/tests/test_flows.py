@@ -0,0 +1,117 @@
+# tests/test_flows.py
+
+import asyncio
+import uuid
+
+import pytest
+
+
+def _name(prefix: str) -> str:
+    # セッションでストレージを共有するので、テストごとに別のユーザー・ルームにする
+    return f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture
+def room(client, storage, register):
+    """2人が参加済みで、どちらも在室しているルーム"""
+    alice, alice_uid = register(_name("alice"))
+    bob, bob_uid = register(_name("bob"))
+    res = client.post("/api/rooms", headers=alice, json={"name": "table", "color_id": 1})
+    assert res.status_code == 200, res.text
+    room_id = res.json()["room_id"]
+
+    assert client.post(f"/api/rooms/{room_id}/join", headers=bob).status_code == 200
+    res = client.post(f"/api/rooms/{room_id}/approve", headers=alice, json={"applicant_user_id": bob_uid})
+    assert res.status_code == 200, res.text
+
+    # WebSocket の enter_room の代わり
+    for uid in (alice_uid, bob_uid):
+        asyncio.run(storage.presence().add(room_id, uid))
+    return {"room_id": room_id, "alice": (alice, alice_uid), "bob": (bob, bob_uid)}
+
+
+def _play_round(client, room_id: str, scores: list[tuple[dict, str, int]]) -> str:
+    assert client.post(f"/api/rooms/{room_id}/points/start").status_code == 200
+    for headers, uid, value in scores:
+        res = client.post(f"/api/rooms/{room_id}/points/submit", headers=headers, json={"uid": uid, "value": value})
+        assert res.status_code == 200, res.text
+    res = client.post(f"/api/rooms/{room_id}/points/finalize")
+    assert res.status_code == 200, res.text
+    round_id = res.json()["round_id"]
+    for headers, _, _ in scores:
+        res = client.post(f"/api/rooms/{room_id}/points/{round_id}/approve", headers=headers)
+        assert res.status_code == 200, res.text
+    return round_id
+
+
+def _balances(client, headers: dict) -> dict[str, int]:
+    res = client.get("/api/me/bootstrap", headers=headers)
+    assert res.status_code == 200, res.text
+    return {r["room_id"]: r["balance"] for r in res.json()["rooms"]}
+
+
+def test_create_join_round_approve_balances(client, room):
+    room_id = room["room_id"]
+    (alice, alice_uid), (bob, bob_uid) = room["alice"], room["bob"]
+
+    res = client.get(f"/api/rooms/{room_id}/members", headers=alice)
+    assert {m["uid"] for m in res.json()["items"]} == {alice_uid, bob_uid}
+    assert set(client.get(f"/api/rooms/{room_id}/presence", headers=alice).json()) == {alice_uid, bob_uid}
+
+    round_id = _play_round(client, room_id, [(alice, alice_uid, 30), (bob, bob_uid, -30)])
+
+    history = client.get(f"/api/rooms/{room_id}/points/history", headers=alice).json()
+    assert [r["round_id"] for r in history] == [round_id]
+    assert _balances(client, alice)[room_id] == 30
+    assert _balances(client, bob)[room_id] == -30
+
+    board = client.get(f"/api/leaderboard?room_id={room_id}", headers=bob).json()
+    assert [(e["uid"], e["score"]) for e in board["top"]] == [(alice_uid, 30), (bob_uid, -30)]
+    assert board["me"] == {"rank": 2, "uid": bob_uid, "score": -30}
+
+
+def test_round_with_nonzero_sum_is_cancelled(client, room):
+    room_id = room["room_id"]
+    (alice, alice_uid), (bob, bob_uid) = room["alice"], room["bob"]
+
+    assert client.post(f"/api/rooms/{room_id}/points/start").status_code == 200
+    client.post(f"/api/rooms/{room_id}/points/submit", headers=alice, json={"uid": alice_uid, "value": 10})
+    client.post(f"/api/rooms/{room_id}/points/submit", headers=bob, json={"uid": bob_uid, "value": 5})
+
+    assert client.post(f"/api/rooms/{room_id}/points/finalize").status_code == 400
+    assert client.get(f"/api/rooms/{room_id}/points/history", headers=alice).json() == []
+    assert _balances(client, alice)[room_id] == 0
+
+
+def test_settlement_moves_balance(client, room):
+    room_id = room["room_id"]
+    (alice, alice_uid), (bob, bob_uid) = room["alice"], room["bob"]
+    _play_round(client, room_id, [(alice, alice_uid, 30), (bob, bob_uid, -30)])
+
+    # マイナスの側（bob）がプラスの側（alice）に申請し、alice が承認する
+    res = client.post(f"/api/rooms/{room_id}/settle/request", headers=bob, json={"to_uid": alice_uid, "amount": 10})
+    assert res.status_code == 200, res.text
+    res = client.post(f"/api/rooms/{room_id}/settle/request/{bob_uid}/approve", headers=alice)
+    assert res.status_code == 200, res.text
+
+    assert _balances(client, alice)[room_id] == 20
+    assert _balances(client, bob)[room_id] == -20
+
+
+def test_room_ids_are_unique(client, register):
+    headers, _ = register(_name("carol"))
+    ids = {
+        client.post("/api/rooms", headers=headers, json={"name": f"r{i}", "color_id": 0}).json()["room_id"]
+        for i in range(20)
+    }
+    assert len(ids) == 20
+
+
+def test_room_reads_are_members_only(client, room, register):
+    room_id = room["room_id"]
+    alice, _ = room["alice"]
+    outsider, _ = register(_name("carol"))
+
+    for path in ("points/history", "points/series", "settle/history"):
+        assert client.get(f"/api/rooms/{room_id}/{path}", headers=alice).status_code == 200, path
+        assert client.get(f"/api/rooms/{room_id}/{path}", headers=outsider).status_code == 403, path
@@ -308,6 +308,8 @@ export default function DashboardPage() {
         case "join_request_cancelled":
         case "join_rejected":
         case "join_approved":
+        // 開いていないルームの更新はまとめて room_updated で届く
+        case "room_updated":
           setMsg((m) => m + "x");
           break;
         default:
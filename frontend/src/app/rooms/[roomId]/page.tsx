@@ -376,10 +376,10 @@ export default function RoomPage() {
     if (!token || !roomId) return;
     (async () => {
       try {
-        const [roomData, ph, sh] = await Promise.all([
-          api.getRoom(token, roomId),
-          api.getPointHistory(token, roomId),
-          api.getSettlementHistory(token, roomId),
+        const [roomData, ph, sh] = await api.batchBodies(token, [
+          { path: `/rooms/${roomId}` },
+          { path: `/rooms/${roomId}/points/history` },
+          { path: `/rooms/${roomId}/settle/history` },
         ]);
         setRoom(roomData);
         setPointHistory(ph);
@@ -483,9 +483,12 @@ export default function RoomPage() {
           setJoinQueue((q) => [...q, ev.applicant_uid]);
           break;
         case "join_approved":
-        case "join_rejected":
-          setJoinQueue((q) => q.filter((uid) => uid !== ev.applicant_uid));
+        case "join_rejected": {
+          // 一括承認・却下では applicant_uids にまとめて入ってくる
+          const done: string[] = ev.applicant_uids ?? [ev.applicant_uid];
+          setJoinQueue((q) => q.filter((uid) => !done.includes(uid)));
           break;
+        }
         case "join_request_cancelled":
           setJoinQueue((q) => q.filter((uid) => uid !== ev.user_id));
           break;
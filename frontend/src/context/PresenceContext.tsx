@@ -16,6 +16,7 @@ import { onAuthStateChanged } from "firebase/auth";
 type Event =
   | { type: "user_entered"; room_id: string; uid: string }
   | { type: "user_left"; room_id: string; uid: string }
+  | { type: "room_updated"; room_id: string; count: number }
   | { type: string; [key: string]: any };
 
 interface PresenceContextValue {
@@ -96,6 +97,14 @@ export const PresenceProvider = ({ children }: PropsWithChildren) => {
           next[ev.room_id]?.delete(ev.uid);
           return next;
         });
+      } else if (
+        ev.type === "room_updated" &&
+        subscribedRooms.current.has(ev.room_id)
+      ) {
+        // 入室していないルームの在室者は個別には届かないので取り直す
+        api.getPresence(token, ev.room_id).then((list) => {
+          setOnlineUsers((prev) => ({ ...prev, [ev.room_id]: new Set(list) }));
+        });
       }
 
       listeners.current.forEach((fn) => fn(ev));
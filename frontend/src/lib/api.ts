@@ -199,3 +199,48 @@ export const rejectSettlementRequest = (
     method: "POST",
     token,
   });
+
+// --- まとめて取得（POST /batch。読み取りだけ、認証と往復を1回で済ませる）---
+export type BatchRequest = { path: string; method?: "GET" | "POST"; body?: any };
+export type BatchResponse<T = any> = {
+  status: number;
+  headers: Record<string, string>;
+  body: T;
+};
+
+export const batch = (token: string, requests: BatchRequest[]) =>
+  api<{ responses: BatchResponse[] }>("/batch", {
+    method: "POST",
+    token,
+    body: { requests },
+  }).then((res) => res.responses);
+
+// 全部成功したら本文だけを順に返す（失敗があれば最初のものを投げる）
+export async function batchBodies(token: string, requests: BatchRequest[]) {
+  const responses = await batch(token, requests);
+  const failed = responses.find((r) => r.status >= 400);
+  if (failed) throw new Error(failed.body?.detail || `HTTP ${failed.status}`);
+  return responses.map((r) => r.body);
+}
+
+// --- ランキング（room_id 無しなら全ルーム合計の残高）---
+export type LeaderboardEntry = { rank: number; uid: string; score: number };
+export type Leaderboard = {
+  scope: string;
+  total: number;
+  top: LeaderboardEntry[];
+  me: LeaderboardEntry | null;
+  around: LeaderboardEntry[];
+};
+
+export const getLeaderboard = (
+  token: string,
+  opts: { room_id?: string; limit?: number; radius?: number } = {}
+) => {
+  const params = new URLSearchParams();
+  if (opts.room_id) params.set("room_id", opts.room_id);
+  if (opts.limit != null) params.set("limit", String(opts.limit));
+  if (opts.radius != null) params.set("radius", String(opts.radius));
+  const qs = params.toString();
+  return api<Leaderboard>(`/leaderboard${qs ? `?${qs}` : ""}`, { token });
+};